@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks of eru-py against a local stand-in ERU server.
+
+Run them with::
+
+    $ python -m benchmarks.run --output result.json
+
+and replay traffic recorded by :class:`eruhttp.TrafficRecorder` with::
+
+    $ python -m benchmarks.replay traffic.jsonl.gz --speed 10
+"""
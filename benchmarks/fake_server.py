@@ -0,0 +1,451 @@
+# -*- coding: utf-8 -*-
+"""A stand-in ERU server, good enough for :class:`eruhttp.EruClient` benchmarks.
+
+Containers, hosts and tasks are generated from their index, so serving a
+cluster of 100k containers costs no memory. Every response can be delayed
+by `latency` seconds and containers can be padded to `container_size`
+bytes of json.
+
+e.g.::
+
+    >>> server = FakeEru(apps={'app': 5000}, latency=0.002).start()
+    >>> client = EruClient(server.url)
+    >>> server.stop()
+"""
+import base64
+import hashlib
+import json
+import socket
+import struct
+import threading
+import time
+import zlib
+
+from six.moves import BaseHTTPServer, socketserver
+from six.moves.urllib.error import URLError
+from six.moves.urllib.parse import parse_qs, urlparse
+from six.moves.urllib.request import Request, urlopen
+
+from eruhttp import gzip_compress, match_endpoint
+
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+
+def websocket_frame(payload, opcode=0x1):
+    """Unmasked server frame of `payload` bytes."""
+    header = bytearray([0x80 | opcode])
+    n = len(payload)
+    if n < 126:
+        header.append(n)
+    elif n < 1 << 16:
+        header.append(126)
+        header.extend(struct.pack('!H', n))
+    else:
+        header.append(127)
+        header.extend(struct.pack('!Q', n))
+    return bytes(header) + payload
+
+
+class FakeEru(object):
+    """State and settings of the stand-in server.
+
+    :param apps: dict of app name => how many containers it has.
+    :param hosts_per_pod: containers are spread over that many hosts.
+    :param latency: seconds to wait before every response.
+    :param container_size: pad every container to about this many bytes of json.
+    :param log_lines: lines sent by every log websocket before closing.
+    :param log_line_size: bytes of every log line.
+    :param task_duration: seconds before tasks of deploys and builds are finished.
+    :param capacity: requests served at `latency`, more in flight are slower and
+    more than twice as many are answered 503.
+    :param gzip: gzip responses of 1KB or more to clients accepting it.
+    """
+
+    def __init__(self, apps=None, hosts_per_pod=100, latency=0.0, container_size=0,
+                 log_lines=1000, log_line_size=100, task_duration=0.0, capacity=None,
+                 gzip=False, host='127.0.0.1', port=0):
+        self.apps = apps or {'app': 100}
+        self.hosts_per_pod = hosts_per_pod
+        self.latency = latency
+        self.container_size = container_size
+        self.log_lines = log_lines
+        self.log_line_size = log_line_size
+        self.task_duration = task_duration
+        self.capacity = capacity
+        self.gzip = gzip
+        self.in_flight = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        # task id -> when it finishes
+        self.tasks = {}
+        # task id -> how many containers it deploys
+        self.task_containers = {}
+        self.envs = {}
+        self.requests = 0
+        self.next_task_id = 1
+        self._lock = threading.Lock()
+        self._server = _ThreadingHTTPServer((host, port), _Handler)
+        self._server.eru = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return 'http://{0}:{1}/'.format(host, port)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread = None
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def new_task_ids(self, n):
+        with self._lock:
+            first = self.next_task_id
+            self.next_task_id += n
+            finishes = time.time() + self.task_duration
+            for task_id in range(first, first + n):
+                self.tasks[task_id] = finishes
+        return list(range(first, first + n))
+
+    def call_back(self, url, task_id, ncontainer):
+        """Call `url` once for every container once the task is finished."""
+        time.sleep(self.task_remaining(task_id))
+        for i in range(ncontainer):
+            payload = json.dumps({'task_id': task_id, 'container_id': '{0:064x}'.format(i)})
+            try:
+                urlopen(Request(url, payload.encode('utf-8'), {'Content-Type': 'application/json'})).read()
+            except (URLError, socket.error):
+                pass
+
+    def task_remaining(self, task_id):
+        """Seconds before the task finishes, tasks not created here are finished."""
+        return max(self.tasks.get(task_id, 0) - time.time(), 0)
+
+    def container(self, app_name, i):
+        c = {
+            'container_id': '{0:08x}{1:056x}'.format(i, hash(app_name) & 0xffffffff),
+            'appname': app_name,
+            'version': 'v{0}'.format(i % 3),
+            'entrypoint': ('web', 'worker')[i % 2],
+            'env': 'prod',
+            'podname': 'pod{0}'.format(i % 2),
+            'hostname': 'host{0}'.format(i % self.hosts_per_pod),
+            'host': '10.1.{0}.{1}'.format(i % self.hosts_per_pod // 250, i % self.hosts_per_pod % 250),
+            'in_removal': i % 100 == 99,
+            'is_alive': 1,
+            'created': '2016-01-01 00:00:{0:02d}.{1:06d}'.format(i // 1000000 % 60, i % 1000000),
+            'networks': [{
+                'network_id': 1,
+                'vlan_address': '10.{0}.{1}.{2}/16'.format(100 + i % 2, i // 250 % 250, i % 250 + 1),
+            }],
+            'cores': {'full': [{'label': str(i % 24), 'host': 'host'}], 'part': [], 'nshare': 0},
+            'callback_url': '',
+            'props': {},
+        }
+        if self.container_size:
+            c['props']['pad'] = 'x' * max(self.container_size - len(json.dumps(c)), 0)
+        return c
+
+    def app_containers(self, app_name, version=None):
+        n = self.apps.get(app_name, 0)
+        return [i for i in range(n) if version is None or 'v{0}'.format(i % 3) == version]
+
+    def host_containers(self, host_name):
+        h = int(host_name.replace('host', '') or 0)
+        return [(app_name, i) for app_name in sorted(self.apps)
+                for i in range(h, self.apps[app_name], self.hosts_per_pod)]
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 1024
+
+
+def _page(records, params):
+    start = int(params.get('start', 0))
+    limit = int(params.get('limit', 20))
+    return records[start:start + limit]
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    # headers and body go out in one packet, keep-alive requests don't
+    # wait for delayed acks
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def eru(self):
+        return self.server.eru
+
+    def reply(self, body, code=200):
+        eru = self.eru
+        content = json.dumps(body).encode('utf-8')
+        compressed = (eru.gzip and len(content) >= 1024 and
+                      'gzip' in (self.headers.get('Accept-Encoding') or ''))
+        if compressed:
+            content = gzip_compress(content)
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        if compressed:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+        with eru._lock:
+            eru.bytes_sent += len(content)
+
+    def read_json(self):
+        eru = self.eru
+        length = int(self.headers.get('Content-Length') or 0)
+        content = self.rfile.read(length) if length else b''
+        with eru._lock:
+            eru.bytes_received += len(content)
+        if self.headers.get('Content-Encoding') == 'gzip':
+            content = zlib.decompress(content, 31)
+        try:
+            return json.loads(content.decode('utf-8')) if content else {}
+        except ValueError:
+            return {}
+
+    def handle_request(self, method):
+        eru = self.eru
+        with eru._lock:
+            eru.requests += 1
+            eru.in_flight += 1
+            in_flight = eru.in_flight
+        try:
+            if eru.capacity and in_flight > eru.capacity * 2:
+                # drain the body, the connection is kept alive
+                self.read_json()
+                return self.reply({'error': 'overloaded'}, 503)
+            if eru.latency:
+                # requests over capacity queue up
+                time.sleep(eru.latency * max(1.0, in_flight / float(eru.capacity or in_flight)))
+            self.route(method)
+        finally:
+            with eru._lock:
+                eru.in_flight -= 1
+
+    def route(self, method):
+        parsed = urlparse(self.path)
+        params = dict((k, v[-1]) for k, v in parse_qs(parsed.query).items())
+        endpoint, args = match_endpoint(parsed.path)
+        if endpoint.startswith('/websockets/'):
+            return self.serve_websocket(endpoint, args, params)
+
+        handler = getattr(self, 'route_' + method, {}).get(endpoint)
+        body = self.read_json() if method in ('POST', 'PUT', 'DELETE') else None
+        if handler is None:
+            return self.reply({'error': 'not found'}, 404)
+        result = handler(self, args, params, body)
+        code = 200
+        if isinstance(result, tuple):
+            result, code = result
+        self.reply(result, code)
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def do_PUT(self):
+        self.handle_request('PUT')
+
+    def do_DELETE(self):
+        self.handle_request('DELETE')
+
+    def get_version(self, args, params, body):
+        return {'version': 'fake-eru'}
+
+    def get_apps(self, args, params, body):
+        return _page([{'name': name} for name in sorted(self.eru.apps)], params)
+
+    def get_app(self, args, params, body):
+        if args['name'] not in self.eru.apps:
+            return {'error': 'app not found'}, 404
+        return {'name': args['name'], 'git': 'git@example.com:{0}.git'.format(args['name'])}
+
+    def get_app_containers(self, args, params, body):
+        eru = self.eru
+        indexes = _page(eru.app_containers(args['name'], args.get('version')), params)
+        return [eru.container(args['name'], i) for i in indexes]
+
+    def get_host_containers(self, args, params, body):
+        eru = self.eru
+        return [eru.container(app_name, i)
+                for app_name, i in _page(eru.host_containers(args['host']), params)]
+
+    def get_pods(self, args, params, body):
+        return _page([{'id': i, 'name': 'pod{0}'.format(i)} for i in range(2)], params)
+
+    def get_pod(self, args, params, body):
+        return {'name': args['pod']}
+
+    def get_pod_hosts(self, args, params, body):
+        hosts = [{'name': 'host{0}'.format(i), 'podname': args['pod'], 'is_alive': True}
+                 for i in range(self.eru.hosts_per_pod)]
+        return _page(hosts, params)
+
+    def get_host(self, args, params, body):
+        return {'name': args['host'], 'is_alive': True}
+
+    def get_container(self, args, params, body):
+        return {'container_id': args['container_id'], 'is_alive': 1}
+
+    def poll_container(self, args, params, body):
+        return {'r': 0, 'container': args['container_id'], 'status': 1}
+
+    def container_action(self, args, params, body):
+        return {'r': 0, 'msg': 'ok'}
+
+    def deploy(self, args, params, body):
+        task_ids = self.eru.new_task_ids(1)
+        self.eru.task_containers[task_ids[0]] = body.get('ncontainer', 1)
+        if body.get('callback_url'):
+            callback = threading.Thread(target=self.eru.call_back,
+                                        args=(body['callback_url'], task_ids[0], body.get('ncontainer', 1)))
+            callback.daemon = True
+            callback.start()
+        return {'r': 0, 'msg': 'ok', 'tasks': task_ids,
+                'watch_keys': ['eru:task:result:{0}'.format(t) for t in task_ids]}
+
+    def build(self, args, params, body):
+        task_id = self.eru.new_task_ids(1)[0]
+        return {'r': 0, 'msg': 'ok', 'task': task_id,
+                'watch_key': 'eru:task:result:{0}'.format(task_id)}
+
+    def ok(self, args, params, body):
+        return {'r': 0, 'msg': 'ok'}
+
+    def get_task(self, args, params, body):
+        task_id = int(args['task_id'])
+        finished = not self.eru.task_remaining(task_id)
+        props = {}
+        if finished and task_id in self.eru.task_containers:
+            props['container_ids'] = ['{0:08x}{1:056x}'.format(i, task_id)
+                                      for i in range(self.eru.task_containers[task_id])]
+        return {'id': task_id, 'finished': finished, 'result': 1 if finished else None, 'props': props}
+
+    def get_task_log(self, args, params, body):
+        return ['log line {0}'.format(i) for i in range(10)]
+
+    def get_env(self, args, params, body):
+        return dict(self.eru.envs.get(args['name'], {}).get(params.get('env'), {}))
+
+    def list_env(self, args, params, body):
+        return {'r': 0, 'msg': 'ok', 'data': sorted(self.eru.envs.get(args['name'], {}))}
+
+    def set_env(self, args, params, body):
+        body = dict(body)
+        env = body.pop('env', None)
+        self.eru.envs.setdefault(args['name'], {})[env] = body
+        return {'r': 0, 'msg': 'ok'}
+
+    def delete_env(self, args, params, body):
+        self.eru.envs.get(args['name'], {}).pop((body or {}).get('env'), None)
+        return {'r': 0, 'msg': 'ok'}
+
+    def register(self, args, params, body):
+        return {'r': 0, 'msg': 'ok'}, 201
+
+    def get_networks(self, args, params, body):
+        return [{'id': i, 'name': 'net{0}'.format(i), 'netspace': '10.{0}.0.0/16'.format(100 + i)}
+                for i in range(2)]
+
+    def get_network(self, args, params, body):
+        i = args['network'].replace('net', '')
+        i = int(i) if i.isdigit() else 0
+        return {'id': i, 'name': 'net{0}'.format(i), 'netspace': '10.{0}.0.0/16'.format(100 + i)}
+
+    route_GET = {
+        '/': get_version,
+        '/api/app/': get_apps,
+        '/api/app/{name}/': get_app,
+        '/api/app/{name}/containers/': get_app_containers,
+        '/api/app/{name}/{version}/containers/': get_app_containers,
+        '/api/app/{name}/env/': get_env,
+        '/api/app/{name}/listenv/': list_env,
+        '/api/host/{host}/': get_host,
+        '/api/host/{host}/containers/': get_host_containers,
+        '/api/pod/list/': get_pods,
+        '/api/pod/{pod}/': get_pod,
+        '/api/pod/{pod}/hosts/': get_pod_hosts,
+        '/api/container/{container_id}/': get_container,
+        '/api/container/{container_id}/poll/': poll_container,
+        '/api/task/{task_id}/': get_task,
+        '/api/task/{task_id}/log/': get_task_log,
+        '/api/network/list/': get_networks,
+        '/api/network/{network}/': get_network,
+    }
+    route_PUT = {
+        '/api/app/{name}/env/': set_env,
+        '/api/container/{container_id}/kill/': container_action,
+        '/api/container/{container_id}/cure/': container_action,
+        '/api/container/{container_id}/start/': container_action,
+        '/api/container/{container_id}/stop/': container_action,
+        '/api/container/{container_id}/bind_eip/': container_action,
+        '/api/host/{host}/down/': ok,
+        '/api/host/{host}/cure/': ok,
+    }
+    route_POST = {
+        '/api/app/register/': register,
+        '/api/deploy/private/': deploy,
+        '/api/deploy/public/': deploy,
+        '/api/deploy/build/': build,
+        '/api/deploy/rmcontainers/': ok,
+        '/api/deploy/rmversion/': ok,
+    }
+    route_DELETE = {
+        '/api/app/{name}/env/': delete_env,
+    }
+
+    def serve_websocket(self, endpoint, args, params):
+        key = self.headers.get('Sec-WebSocket-Key', '')
+        accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode('ascii')).digest())
+        self.send_response(101, 'Switching Protocols')
+        self.send_header('Upgrade', 'websocket')
+        self.send_header('Connection', 'Upgrade')
+        self.send_header('Sec-WebSocket-Accept', accept.decode('ascii'))
+        self.end_headers()
+
+        eru = self.eru
+        n = eru.log_lines
+        tail = int(params.get('tail') or 0)
+        first = n - tail if 0 < tail < n else 0
+        pad = 'x' * eru.log_line_size
+        try:
+            for i in range(first, n):
+                if endpoint == '/websockets/tasklog/{task_id}/':
+                    line = json.dumps({'id': i, 'message': pad})
+                else:
+                    line = '{0} {1}'.format(i, pad)
+                self.wfile.write(websocket_frame(line.encode('utf-8')))
+            if endpoint == '/websockets/tasklog/{task_id}/':
+                # the log ends when the task finishes
+                self.wfile.flush()
+                time.sleep(eru.task_remaining(int(args['task_id'])))
+            self.wfile.write(websocket_frame(struct.pack('!H', 1000), opcode=0x8))
+            self.wfile.flush()
+        except socket.error:
+            pass
+        self.close_connection = True
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""Replay traffic recorded by :class:`eruhttp.TrafficRecorder` and print the
+results as json, like `benchmarks.run` does.
+
+    $ python -m benchmarks.replay traffic.jsonl.gz [--speed 10] [--workers 16] [--processes]
+
+Requests keep their recorded spacing divided by `speed`, `--speed 0`
+sends them as fast as the workers go. Requests are dealt round robin to
+`workers` threads, or processes, each sending its share in order, so a
+worker falls behind when the server is slower than recorded, which is
+reported as `lag`. Without `--url` a local :class:`FakeEru` is started,
+the live ERU server is never needed.
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+
+import eruhttp
+from benchmarks.fake_server import FakeEru
+
+
+def replay_entry(client, entry):
+    """Send the request of one recorded `entry` with `client`."""
+    params = dict(entry.get('params') or {})
+    if entry['kind'] == 'websocket':
+        for _ in client.request_websocket(entry['url'], as_json=False, params=params):
+            pass
+        return
+    status = entry.get('status') or 200
+    client.request(entry['url'], entry['method'], params=params, json=entry.get('body'),
+                   expected_code=status if 200 <= status < 300 else 200)
+
+
+def _replay_share(args):
+    url, entries, speed, t0, started = args
+    client = eruhttp.EruClient(url)
+    results = []
+    if started > time.time():
+        time.sleep(started - time.time())
+    for entry in entries:
+        if speed:
+            delay = started + (entry['t'] - t0) / speed - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        sent = time.time()
+        lag = sent - started - (entry['t'] - t0) / speed if speed else 0.0
+        try:
+            replay_entry(client, entry)
+            error = None
+        except eruhttp.EruException as e:
+            error = e.code
+        results.append((entry['method'], entry['endpoint'], time.time() - sent, max(lag, 0.0), error))
+    client.close()
+    return results
+
+
+def _quantile(values, q):
+    if not values:
+        return 0.0
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def replay(entries, url, speed=1, workers=8, processes=False):
+    """Replay `entries` against the server at `url`, returns the stats as a dict."""
+    entries = sorted(entries, key=lambda e: e['t'])
+    if not entries:
+        return {'requests': 0}
+    t0 = entries[0]['t']
+    # a little ahead, so every worker is ready when the first request is due
+    started = time.time() + 0.1
+    shares = [(url, entries[i::workers], speed, t0, started) for i in range(workers)]
+    pool = Pool(workers) if processes else ThreadPool(workers)
+    try:
+        results = [r for share in pool.map(_replay_share, shares) for r in share]
+    finally:
+        pool.close()
+    wall = time.time() - started
+
+    latencies = sorted(r[2] for r in results)
+    errors = {}
+    for r in results:
+        if r[4] is not None:
+            errors[str(r[4])] = errors.get(str(r[4]), 0) + 1
+    return {
+        'requests': len(results),
+        'recorded_duration': entries[-1]['t'] - t0,
+        'wall': wall,
+        'throughput': len(results) / wall if wall > 0 else 0.0,
+        'latency_p50': _quantile(latencies, 0.5),
+        'latency_p99': _quantile(latencies, 0.99),
+        'lag_max': max(r[3] for r in results),
+        'errors': errors,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='replay recorded ERU traffic')
+    parser.add_argument('path', help='file written by eruhttp.TrafficRecorder')
+    parser.add_argument('--url', help='server to replay against, a local FakeEru by default')
+    parser.add_argument('--speed', type=float, action='append',
+                        help='1 for real time, 10 for 10x, 0 for as fast as possible, can be repeated')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--processes', action='store_true', help='use processes instead of threads')
+    parser.add_argument('--latency', type=float, default=0, help='latency of the local FakeEru')
+    parser.add_argument('--output', help='write results to this file instead of stdout')
+    args = parser.parse_args(argv)
+
+    entries = list(eruhttp.read_traffic(args.path))
+    server = None
+    url = args.url
+    if url is None:
+        server = FakeEru(latency=args.latency).start()
+        url = server.url
+
+    results = []
+    try:
+        for speed in args.speed or [1]:
+            stats = replay(entries, url, speed, args.workers, args.processes)
+            params = {'speed': speed, 'workers': args.workers, 'processes': args.processes,
+                      'requests': stats['requests']}
+            for name, unit in (('throughput', 'req/s'), ('latency_p50', 's'), ('latency_p99', 's'),
+                               ('lag_max', 's'), ('wall', 's')):
+                name, value = 'replay.x{0:g}.{1}'.format(speed, name), stats[name]
+                results.append({'name': name, 'value': round(value, 6), 'unit': unit, 'params': params})
+                sys.stderr.write('{0:<40} {1:>14.3f} {2}\n'.format(name, value, unit))
+            if stats['errors']:
+                sys.stderr.write('errors by status: {0}\n'.format(stats['errors']))
+    finally:
+        if server is not None:
+            server.stop()
+
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': int(time.time()),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+"""Run the eru-py benchmarks and print the results as json.
+
+    $ python -m benchmarks.run [--quick] [--output result.json] [--only paging]
+
+Every result is `{"name", "value", "unit", "params"}`, results of two
+versions can be compared by `name`.
+"""
+import argparse
+import contextlib
+import json
+import multiprocessing
+import platform
+import sys
+import time
+
+import eruhttp
+from benchmarks.fake_server import FakeEru
+from erucli import STARTUP_BUDGETS
+
+# cpu time, `time.clock` on python 2
+process_time = getattr(time, 'process_time', None) or time.clock
+
+
+def _serve(urls, kwargs):
+    server = FakeEru(**kwargs).start()
+    urls.put(server.url)
+    # serves until terminated
+    while True:
+        time.sleep(60)
+
+
+@contextlib.contextmanager
+def fake_eru_process(**kwargs):
+    """A :class:`FakeEru` in its own process, yields its url. What it
+    allocates stays out of tracemalloc of the benchmark."""
+    urls = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_serve, args=(urls, kwargs))
+    process.daemon = True
+    process.start()
+    try:
+        yield urls.get(timeout=30)
+    finally:
+        process.terminate()
+        process.join()
+
+
+class Benchmarks(object):
+
+    def __init__(self, quick=False):
+        self.quick = quick
+        self.results = []
+
+    def scale(self, full, quick):
+        return quick if self.quick else full
+
+    def record(self, name, value, unit, **params):
+        self.results.append({'name': name, 'value': round(value, 6), 'unit': unit, 'params': params})
+        sys.stderr.write('{0:<40} {1:>14.3f} {2}\n'.format(name, value, unit))
+
+    def bench_requests(self):
+        n = self.scale(2000, 200)
+        with FakeEru(apps={'app': 10}) as server:
+            client = eruhttp.EruClient(server.url)
+            started = time.time()
+            for _ in range(n):
+                client.get_app('app')
+            self.record('requests.sync', n / (time.time() - started), 'req/s', requests=n)
+
+            for concurrency in (8, 32):
+                client = eruhttp.EruClient(server.url, transport=eruhttp.TransportConfig(
+                    pool_maxsize=concurrency))
+                started = time.time()
+                for result in client.bulk(client.get_app, ['app'] * n, concurrency):
+                    assert result.error is None
+                self.record('requests.bulk.c{0}'.format(concurrency),
+                            n / (time.time() - started), 'req/s', requests=n, concurrency=concurrency)
+
+        latency = 0.005
+        n = self.scale(400, 100)
+        with FakeEru(apps={'app': 10}, latency=latency) as server:
+            client = eruhttp.EruClient(server.url, transport=eruhttp.TransportConfig(pool_maxsize=64))
+            started = time.time()
+            for result in client.stop_containers(range(n), concurrency=64):
+                assert result.error is None
+            self.record('requests.bulk.latency5ms.c64', n / (time.time() - started), 'req/s',
+                        requests=n, concurrency=64, latency=latency)
+
+    def bench_paging(self):
+        ncontainer = self.scale(5000, 1000)
+        latency = 0.005
+        with FakeEru(apps={'app': ncontainer}, latency=latency) as server:
+            client = eruhttp.EruClient(server.url)
+            for prefetch in (0, 4):
+                started = time.time()
+                n = sum(1 for _ in client.iter_app_containers('app', page_size=100, prefetch=prefetch))
+                assert n == ncontainer
+                self.record('paging.iter_app_containers.prefetch{0}'.format(prefetch),
+                            n / (time.time() - started), 'containers/s',
+                            containers=ncontainer, page_size=100, latency=latency)
+
+    def bench_scale_planning(self):
+        for ncontainer in self.scale((10000, 50000), (10000,)):
+            server = FakeEru(apps={'app': ncontainer})
+            containers = [server.container('app', i) for i in range(ncontainer)]
+            server.stop()
+
+            started = time.time()
+            index = eruhttp.ContainerIndex(containers)
+            eruhttp._plan_scale_out('app', index, None, 10, None, ncontainer * 2)
+            self.record('planning.scale_out.{0}'.format(ncontainer), time.time() - started, 's',
+                        containers=ncontainer)
+
+            started = time.time()
+            index = eruhttp.ContainerIndex(containers)
+            eruhttp._plan_scale_in('app', index, 10, None, 2)
+            self.record('planning.scale_in.{0}'.format(ncontainer), time.time() - started, 's',
+                        containers=ncontainer)
+
+        ncontainer = self.scale(20000, 2000)
+        with FakeEru(apps={'app': ncontainer}) as server:
+            client = eruhttp.EruClient(server.url)
+            started = time.time()
+            client.scale_out('app', ncontainer=10, ceiling=ncontainer * 2, dry_run=True)
+            self.record('planning.scale_out.dry_run.{0}'.format(ncontainer), time.time() - started, 's',
+                        containers=ncontainer)
+
+    def bench_logs(self):
+        nlines = self.scale(20000, 2000)
+        with FakeEru(log_lines=nlines) as server:
+            client = eruhttp.EruClient(server.url)
+            started = time.time()
+            n = sum(1 for _ in client.container_log('c', stdout=1))
+            self.record('logs.container_log', n / (time.time() - started), 'lines/s', lines=n)
+
+            started = time.time()
+            n = sum(1 for _ in client.build_log(1))
+            self.record('logs.build_log', n / (time.time() - started), 'lines/s', lines=n)
+
+        ncontainer = self.scale(50, 10)
+        nlines = self.scale(1000, 200)
+        with FakeEru(log_lines=nlines) as server:
+            client = eruhttp.EruClient(server.url)
+            ids = ['c{0}'.format(i) for i in range(ncontainer)]
+            started = time.time()
+            n = sum(1 for _ in client.stream_logs(ids, stderr=0))
+            self.record('logs.stream_logs.{0}'.format(ncontainer), n / (time.time() - started),
+                        'lines/s', lines=n, containers=ncontainer)
+
+    def bench_memory(self):
+        try:
+            import tracemalloc
+        except ImportError:
+            # python 2
+            return
+
+        ncontainer = self.scale(50000, 5000)
+        server = FakeEru(apps={'app': ncontainer})
+        # decoded from json like the client does, so no string is shared between containers
+        payloads = [json.dumps(server.container('app', i)) for i in range(ncontainer)]
+        server.stop()
+
+        for name, load in (('dict', json.loads),
+                           ('record', lambda p: eruhttp.Container.from_dict(json.loads(p)))):
+            tracemalloc.start()
+            containers = [load(p) for p in payloads]
+            size = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            self.record('memory.containers.{0}'.format(name), size / float(len(containers)),
+                        'bytes/container', containers=ncontainer)
+            del containers
+
+            started = time.time()
+            eruhttp.ContainerIndex([load(p) for p in payloads])
+            self.record('memory.containers.{0}.index'.format(name), time.time() - started, 's',
+                        containers=ncontainer)
+
+    def bench_release(self):
+        napp = self.scale(40, 10)
+        task_duration = 0.2
+        with FakeEru(task_duration=task_duration, log_lines=100) as server:
+            client = eruhttp.EruClient(server.url, transport=eruhttp.TransportConfig(pool_maxsize=32))
+            deploys = [dict(pod_name=pod, ncore=1, ncontainer=4, entrypoint='web', env='prod',
+                            network_ids=[1]) for pod in ('pod0', 'pod1')]
+            specs = [eruhttp.ReleaseSpec('app{0}'.format(i), 'v1', 'base', 'pod0', deploys)
+                     for i in range(napp)]
+            release = eruhttp.Release(client, specs)
+            release.run()
+            report = release.report()
+            self.record('release.wall', report['wall'], 's', apps=napp, task_duration=task_duration)
+            for stage, timing in sorted(report['stages'].items()):
+                self.record('release.{0}.mean'.format(stage), timing['mean'], 's',
+                            apps=napp, count=timing['count'], failed=timing['failed'])
+
+    def bench_limits(self):
+        n = self.scale(2000, 400)
+        latency, capacity, concurrency = 0.01, 8, 64
+        with FakeEru(latency=latency, capacity=capacity) as server:
+            for name, limiter in (('none', None),
+                                  ('adaptive', eruhttp.Limiter(concurrency=concurrency, adaptive=True))):
+                client = eruhttp.EruClient(server.url, transport=eruhttp.TransportConfig(
+                    pool_maxsize=concurrency, limits={'*': limiter} if limiter else None))
+                started = time.time()
+                errors = sum(1 for result in client.bulk(client.get_app, ['app'] * n, concurrency)
+                             if result.error is not None)
+                elapsed = time.time() - started
+                params = dict(requests=n, concurrency=concurrency, capacity=capacity, latency=latency)
+                self.record('limits.{0}.ok'.format(name), (n - errors) / elapsed, 'req/s', **params)
+                self.record('limits.{0}.errors'.format(name), errors, 'requests', **params)
+
+    def bench_codec(self):
+        server = FakeEru()
+        page = json.dumps([server.container('app', i) for i in range(100)]).encode('utf-8')
+        server.stop()
+        rounds = self.scale(200, 20)
+        mb = len(page) * rounds / 1e6
+        for name, codec in eruhttp.JSON_CODECS.items():
+            started = process_time()
+            for _ in range(rounds):
+                containers = codec.loads(page)
+            self.record('codec.{0}.loads'.format(name), (process_time() - started) / mb, 's/MB',
+                        bytes=len(page), rounds=rounds)
+            started = process_time()
+            for _ in range(rounds):
+                codec.dumps(containers)
+            self.record('codec.{0}.dumps'.format(name), (process_time() - started) / mb, 's/MB',
+                        bytes=len(page), rounds=rounds)
+
+        ncontainer = self.scale(5000, 1000)
+        for compressed in (False, True):
+            with FakeEru(apps={'app': ncontainer}, gzip=compressed) as server:
+                client = eruhttp.EruClient(server.url, transport=eruhttp.TransportConfig(
+                    compress_min_size=1024 if compressed else None))
+                n = sum(1 for _ in client.iter_app_containers('app', prefetch=0))
+                self.record('wire.list_containers.{0}'.format('gzip' if compressed else 'plain'),
+                            server.bytes_sent / float(n), 'bytes/container', containers=n)
+                client.remove_containers(['{0:064x}'.format(i) for i in range(ncontainer)])
+                self.record('wire.remove_containers.{0}'.format('gzip' if compressed else 'plain'),
+                            server.bytes_received / float(ncontainer), 'bytes/container',
+                            containers=ncontainer)
+
+    def bench_stream(self):
+        try:
+            import tracemalloc
+        except ImportError:
+            # python 2
+            return
+
+        ncontainer = self.scale(20000, 2000)
+        # in-process, the server would weigh as much as the client on the peak
+        with fake_eru_process(apps={'app': ncontainer}) as url:
+            client = eruhttp.EruClient(url)
+            for stream in (False, True):
+                name = 'stream' if stream else 'full'
+                tracemalloc.start()
+                started = time.time()
+                n = sum(1 for _ in client.list_app_containers('app', limit=ncontainer, stream=stream))
+                elapsed = time.time() - started
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                assert n == ncontainer
+                self.record('stream.list_app_containers.{0}.peak'.format(name), peak / 1e6, 'MB',
+                            containers=n)
+                self.record('stream.list_app_containers.{0}'.format(name), n / elapsed, 'containers/s',
+                            containers=n)
+
+    def bench_ip_pool(self):
+        nused = self.scale(60000, 10000)
+        pool = eruhttp.IPPool('10.100.0.0/16')
+        used = ['10.100.{0}.{1}/16'.format(i // 256, i % 256) for i in range(nused)]
+        started = time.time()
+        pool.mark_used(used)
+        self.record('ip_pool.mark_used', nused / (time.time() - started), 'addresses/s', used=nused)
+
+        n = min(pool.free, 2000)
+        started = time.time()
+        pool.allocate(n)
+        self.record('ip_pool.allocate', n / (time.time() - started), 'addresses/s', used=nused, allocated=n)
+
+    def bench_cli(self):
+        import os
+        import subprocess
+
+        def wall(args, env=None):
+            started = time.time()
+            subprocess.check_call([sys.executable] + args, env=env, stdout=devnull)
+            return time.time() - started
+
+        rounds = self.scale(10, 3)
+        env = dict(os.environ, ERU_DAEMON_SOCKET='/tmp/eru-bench-{0}.sock'.format(os.getpid()))
+        with open(os.devnull, 'w') as devnull, FakeEru(apps={'app': 10}) as server:
+            env['ERU_URL'] = server.url
+            commands = [
+                ('python', ['-c', 'pass'], None),
+                ('import', ['-c', 'import eruhttp'], STARTUP_BUDGETS['import']),
+                ('direct', ['-m', 'erucli', 'get_app', 'app'], STARTUP_BUDGETS['direct']),
+                ('daemon', ['-m', 'erucli', '--daemon', 'get_app', 'app'], STARTUP_BUDGETS['daemon']),
+            ]
+            # start the helper and warm its cache
+            wall(commands[-1][1], env)
+            try:
+                for name, args, budget in commands:
+                    value = sorted(wall(args, env) for _ in range(rounds))[rounds // 2]
+                    self.record('cli.{0}'.format(name), value, 's', rounds=rounds, budget=budget)
+                    if budget is not None and value > budget:
+                        sys.stderr.write('cli.{0} is over its budget of {1}s\n'.format(name, budget))
+            finally:
+                subprocess.call([sys.executable, '-m', 'erucli', 'daemon', 'stop'], env=env, stdout=devnull)
+            # what `import eruhttp` leaves for first use
+            out = subprocess.check_output([sys.executable, '-c', 'import eruhttp, sys; print(sorted('
+                                           'm for m in ("websocket", "netaddr") if m in sys.modules))'])
+            assert out.strip() == b'[]', out
+
+    def run(self, only=None):
+        for name in sorted(dir(self)):
+            if name.startswith('bench_') and (not only or name[len('bench_'):] in only):
+                getattr(self, name)()
+        return {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'quick': self.quick,
+            'time': int(time.time()),
+            'results': self.results,
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='eru-py benchmarks')
+    parser.add_argument('--quick', action='store_true', help='smaller sizes, for a smoke run')
+    parser.add_argument('--output', help='write results to this file instead of stdout')
+    parser.add_argument('--only', action='append', help='only run these benchmarks, like `paging`')
+    args = parser.parse_args(argv)
+
+    report = Benchmarks(quick=args.quick).run(args.only)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,424 @@
+# -*- coding: utf-8 -*-
+"""`eru`, the command line of :class:`eruhttp.EruClient`.
+
+Every public method of the client is a command, positional arguments and
+`name=value` keyword arguments are read as json when they are, as strings
+otherwise, quote them as json to force a string like `'"1234"'`::
+
+    $ export ERU_URL=http://eru.example.com
+    $ eru get_container 8c4d1e
+    $ eru list_app_containers appname limit=100
+    $ eru container_log 8c4d1e stdout=1
+    $ eru scale_out appname ncontainer=2 dry_run=true
+
+Results are printed as json, iterators one item per line. `ERU_URL` may
+list many comma separated nodes.
+
+Only the standard library is imported before the command runs, `eruhttp`
+is imported when the command needs the client and imports `netaddr` and
+`websocket` itself on first use. With `--daemon`, or `ERU_DAEMON=1`,
+commands are sent to a helper process over a unix socket, started at the
+first command, which keeps its HTTP sessions and response caches warm
+between commands, so the command never imports `eruhttp` at all. The helper
+exits after `--idle` seconds without commands, or with `eru daemon stop`.
+
+:data:`STARTUP_BUDGETS` are checked by `python -m benchmarks.run --only cli`.
+"""
+import argparse
+import errno
+import json
+import os
+import re
+import socket
+import sys
+import threading
+import time
+
+# seconds of wall time: `import eruhttp`, and a whole `eru get_app` against a
+# local server without and with the helper process
+STARTUP_BUDGETS = {
+    'import': 0.4,
+    'direct': 0.5,
+    'daemon': 0.1,
+}
+DAEMON_IDLE = 600
+DAEMON_START_TIMEOUT = 5
+
+
+class CliError(Exception):
+
+    def __init__(self, code, message):
+        super(CliError, self).__init__(code, message)
+        self.code = code
+        self.message = message
+
+
+def daemon_socket_path():
+    path = os.environ.get('ERU_DAEMON_SOCKET')
+    if path:
+        return path
+    directory = os.environ.get('XDG_RUNTIME_DIR') or os.environ.get('TMPDIR') or '/tmp'
+    return os.path.join(directory, 'eru-{0}.sock'.format(os.getuid()))
+
+
+_NAME = re.compile(r'^[A-Za-z_]\w*$')
+
+
+def parse_value(s):
+    try:
+        return json.loads(s)
+    except ValueError:
+        return s
+
+
+def parse_arguments(arguments):
+    """(args, kwargs) of a command from its `value` and `name=value` arguments."""
+    args, kwargs = [], {}
+    for argument in arguments:
+        name, sep, value = argument.partition('=')
+        if sep and _NAME.match(name):
+            kwargs[name] = parse_value(value)
+        else:
+            args.append(parse_value(argument))
+    return args, kwargs
+
+
+def _plain(obj):
+    """`obj` made of what json can dump."""
+    if isinstance(obj, dict):
+        return dict((k, _plain(v)) for k, v in obj.items())
+    if hasattr(obj, '_asdict'):
+        return dict((k, _plain(v)) for k, v in obj._asdict().items())
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return [_plain(v) for v in obj]
+    if hasattr(obj, 'to_dict'):
+        return _plain(obj.to_dict())
+    if isinstance(obj, BaseException):
+        return [getattr(obj, 'code', 0), getattr(obj, 'message', str(obj))]
+    if hasattr(obj, '__dict__') and not isinstance(obj, type):
+        return dict((k, _plain(v)) for k, v in vars(obj).items() if not k.startswith('_'))
+    return obj
+
+
+def _is_iterator(obj):
+    return hasattr(obj, '__next__') or hasattr(obj, 'next')
+
+
+def _dumps(obj):
+    return json.dumps(_plain(obj), default=str, sort_keys=True)
+
+
+def call(client, method, args, kwargs):
+    """Call `method` of `client`, yield ('item', x) for each item if it returns
+    an iterator, ('result', x) otherwise."""
+    func = getattr(client, method, None) if not method.startswith('_') else None
+    if not callable(func):
+        raise CliError(2, 'unknown command {0}, see `eru help`'.format(method))
+    _bind(method, func, args, kwargs)
+    result = func(*args, **kwargs)
+    if _is_iterator(result):
+        for item in result:
+            yield 'item', item
+    else:
+        yield 'result', result
+
+
+def _bind(method, func, args, kwargs):
+    """Raise :class:`CliError` if `func` can't be called with these arguments,
+    a TypeError raised by the command itself is a bug, not a usage error."""
+    import inspect
+    try:
+        if hasattr(inspect, 'signature'):
+            inspect.signature(func).bind(*args, **kwargs)
+        else:
+            inspect.getcallargs(func, *args, **kwargs)
+    except TypeError as e:
+        raise CliError(2, '{0}: {1}'.format(method, e))
+
+
+def make_client(url, timeout, cache=False):
+    import eruhttp
+    urls = url.split(',') if ',' in url else url
+    return eruhttp.EruClient(urls, timeout=timeout,
+                             cache=eruhttp.ResponseCache() if cache else None)
+
+
+def run_direct(url, timeout, method, args, kwargs):
+    import eruhttp
+    client = make_client(url, timeout)
+    try:
+        for kind, value in call(client, method, args, kwargs):
+            yield kind, value
+    except eruhttp.EruException as e:
+        raise CliError(e.code, e.message)
+    finally:
+        client.close()
+
+
+def _connect(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error:
+        sock.close()
+        raise
+    return sock
+
+
+def _send(sock, message):
+    sock.sendall((json.dumps(message) + '\n').encode('utf-8'))
+
+
+def _recv_lines(sock):
+    f = sock.makefile('rb')
+    try:
+        for line in f:
+            yield json.loads(line.decode('utf-8'))
+    finally:
+        f.close()
+
+
+def connect_daemon(path, idle, start=True):
+    """A socket connected to the helper, started if it isn't running and `start` is set."""
+    try:
+        return _connect(path)
+    except socket.error as e:
+        if not start or e.errno not in (errno.ENOENT, errno.ECONNREFUSED):
+            raise
+    start_daemon(path, idle)
+    deadline = time.time() + DAEMON_START_TIMEOUT
+    while True:
+        try:
+            return _connect(path)
+        except socket.error:
+            if time.time() > deadline:
+                raise CliError(1, 'eru daemon did not start, see `eru daemon serve`')
+            time.sleep(0.02)
+
+
+def start_daemon(path, idle):
+    import subprocess
+    env = dict(os.environ)
+    here = os.path.dirname(os.path.abspath(__file__))
+    env['PYTHONPATH'] = os.pathsep.join([here] + [p for p in [env.get('PYTHONPATH')] if p])
+    with open(os.devnull, 'r+b') as devnull:
+        subprocess.Popen([sys.executable, '-m', 'erucli', 'daemon', 'serve',
+                          '--socket', path, '--idle', str(idle)],
+                         stdin=devnull, stdout=devnull, stderr=devnull, close_fds=True,
+                         env=env, preexec_fn=os.setsid)
+
+
+def run_daemon(path, idle, url, timeout, method, args, kwargs):
+    sock = connect_daemon(path, idle)
+    try:
+        _send(sock, {'url': url, 'timeout': timeout, 'method': method,
+                     'args': args, 'kwargs': kwargs})
+        for message in _recv_lines(sock):
+            if 'error' in message:
+                raise CliError(*message['error'])
+            kind = 'item' if 'item' in message else 'result'
+            yield kind, message[kind]
+            if kind == 'result':
+                return
+    finally:
+        sock.close()
+
+
+class Daemon(object):
+    """The helper process behind `--daemon`, one :class:`eruhttp.EruClient`
+    with a response cache for each (url, timeout), shared by all commands.
+
+    :param path: the unix socket to listen on, only the user can connect.
+    :param idle: exit after this many seconds without a command running.
+    """
+
+    def __init__(self, path, idle=DAEMON_IDLE):
+        self.path = path
+        self.idle = idle
+        self.started = time.time()
+        self.last_command = self.started
+        self.commands = 0
+        # commands still running, a long `container_log` keeps the helper alive
+        self.running = 0
+        self.clients = {}
+        self.server = None
+        self._lock = threading.Lock()
+
+    def client(self, url, timeout):
+        key = (url, timeout)
+        with self._lock:
+            client = self.clients.get(key)
+            if client is None:
+                client = self.clients[key] = make_client(url, timeout, cache=True)
+        return client
+
+    def status(self):
+        return {'pid': os.getpid(), 'uptime': time.time() - self.started, 'commands': self.commands,
+                'urls': sorted(set(url for url, _ in self.clients))}
+
+    def handle(self, rfile, wfile):
+        line = rfile.readline()
+        if not line:
+            return
+        request = json.loads(line.decode('utf-8'))
+        with self._lock:
+            self.running += 1
+            self.commands += 1
+        try:
+            self._handle(request, wfile)
+        finally:
+            with self._lock:
+                self.running -= 1
+                self.last_command = time.time()
+
+    def _handle(self, request, wfile):
+        import eruhttp
+
+        def write(message):
+            wfile.write((_dumps(message) + '\n').encode('utf-8'))
+            wfile.flush()
+
+        command = request.get('command')
+        if command == 'status':
+            return write({'result': self.status()})
+        if command == 'stop':
+            write({'result': 'stopped'})
+            return self.stop()
+        try:
+            client = self.client(request['url'], request['timeout'])
+            for kind, value in call(client, request['method'], request['args'], request['kwargs']):
+                write({kind: value})
+        except (eruhttp.EruException, CliError) as e:
+            write({'error': [e.code, e.message]})
+        except socket.error:
+            # the command went away, like with ctrl-c on `eru container_log`
+            pass
+        except Exception as e:
+            write({'error': [1, '{0}: {1}'.format(type(e).__name__, e)]})
+
+    def serve(self):
+        from six.moves import socketserver
+
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                daemon.handle(self.rfile, self.wfile)
+
+        class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+            daemon_threads = True
+
+        try:
+            # a socket left by a daemon that died
+            _connect(self.path).close()
+            raise CliError(1, 'eru daemon already listening on {0}'.format(self.path))
+        except socket.error:
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+        umask = os.umask(0o077)
+        try:
+            self.server = Server(self.path, Handler)
+        finally:
+            os.umask(umask)
+
+        def watch_idle():
+            while self.running or time.time() - self.last_command < self.idle:
+                time.sleep(min(self.idle, 1))
+            self.stop()
+        watcher = threading.Thread(target=watch_idle)
+        watcher.daemon = True
+        watcher.start()
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+            for client in self.clients.values():
+                client.close()
+
+    def stop(self):
+        # shutdown waits for serve_forever, which may be running this very thread
+        threading.Thread(target=self.server.shutdown).start()
+
+
+def daemon_command(action, path, idle):
+    if action == 'serve':
+        Daemon(path, idle).serve()
+        return 0
+    if action == 'start':
+        connect_daemon(path, idle).close()
+        return 0
+    try:
+        sock = connect_daemon(path, idle, start=False)
+    except socket.error:
+        sys.stderr.write('eru daemon is not running\n')
+        return 0 if action == 'stop' else 1
+    try:
+        _send(sock, {'command': action})
+        for message in _recv_lines(sock):
+            sys.stdout.write(_dumps(message.get('result')) + '\n')
+    finally:
+        sock.close()
+    return 0
+
+
+def print_help(parser):
+    parser.print_help()
+    import eruhttp
+    commands = sorted(name for name in dir(eruhttp.EruClient)
+                      if not name.startswith('_') and callable(getattr(eruhttp.EruClient, name)))
+    sys.stdout.write('\ncommands:\n  {0}\n'.format('\n  '.join(commands)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='eru', description='ERU command line, see `pydoc erucli`',
+                                     add_help=False)
+    parser.add_argument('-h', '--help', action='store_true')
+    parser.add_argument('--url', default=os.environ.get('ERU_URL'),
+                        help='ERU url, comma separated for many nodes, $ERU_URL by default')
+    parser.add_argument('--timeout', type=float, default=5)
+    parser.add_argument('--daemon', action='store_true', default=os.environ.get('ERU_DAEMON') == '1',
+                        help='go through the helper process, started if needed, $ERU_DAEMON=1')
+    parser.add_argument('--no-daemon', dest='daemon', action='store_false')
+    parser.add_argument('--socket', default=None, help='unix socket of the helper process')
+    parser.add_argument('--idle', type=float, default=DAEMON_IDLE,
+                        help='seconds without commands before the helper exits')
+    parser.add_argument('command', nargs='?')
+    parser.add_argument('arguments', nargs=argparse.REMAINDER)
+    options = parser.parse_args(argv)
+
+    if options.help or options.command in (None, 'help'):
+        print_help(parser)
+        return 0
+    path = options.socket or daemon_socket_path()
+    try:
+        if options.command == 'daemon':
+            action = options.arguments[0] if options.arguments else 'status'
+            if action not in ('serve', 'start', 'stop', 'status'):
+                parser.error('eru daemon serve|start|stop|status')
+            return daemon_command(action, path, options.idle)
+
+        if not options.url:
+            parser.error('--url or $ERU_URL is required')
+        args, kwargs = parse_arguments(options.arguments)
+        if options.daemon:
+            results = run_daemon(path, options.idle, options.url, options.timeout,
+                                 options.command, args, kwargs)
+        else:
+            results = run_direct(options.url, options.timeout, options.command, args, kwargs)
+        out = sys.stdout
+        for kind, value in results:
+            out.write(_dumps(value) + '\n')
+            if kind == 'item':
+                out.flush()
+    except CliError as e:
+        sys.stderr.write('error {0}: {1}\n'.format(e.code, e.message))
+        return 1
+    except KeyboardInterrupt:
+        return 130
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
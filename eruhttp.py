@@ -1,16 +1,74 @@
 # -*- coding: utf-8 -*-
+import binascii
+import bisect
+import codecs
+import gzip
+import heapq
+import importlib
+import itertools
 import json
 import os
+import random
+import re
+import select
 import socket
-import urllib
-import urlparse
-from collections import defaultdict, Counter
-from urlparse import urljoin
+import sys
+import threading
+import time
+import zlib
+from collections import defaultdict, deque, namedtuple, OrderedDict
 
 import requests
 import six
-import websocket
-from netaddr import IPNetwork, IPAddress
+from requests.adapters import HTTPAdapter
+from six.moves import queue
+from six.moves.urllib.parse import parse_qsl, urlencode, urljoin, urlparse
+
+
+class _LazyModule(object):
+    """A module imported at its first use, keeps `import eruhttp`, and so the
+    `eru` command, fast when it isn't needed. `alias` is the global name
+    it's bound to, if not `name`."""
+
+    def __init__(self, name, alias=None):
+        self._name = name
+        self._alias = alias or name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if attr.startswith('__'):
+            raise AttributeError(attr)
+        module = self._module
+        if module is None:
+            module = self._module = importlib.import_module(self._name)
+            # later uses in this module skip the stand-in
+            globals()[self._alias] = module
+        return getattr(module, attr)
+
+
+# only needed by logs and other websockets, and by networks and scaling
+websocket = _LazyModule('websocket')
+netaddr = _LazyModule('netaddr')
+# only needed by concurrent calls, deploy callbacks and websocket multiplexing
+multiprocessing_pool = _LazyModule('multiprocessing.pool', 'multiprocessing_pool')
+BaseHTTPServer = _LazyModule('six.moves.BaseHTTPServer', 'BaseHTTPServer')
+socketserver = _LazyModule('six.moves.socketserver', 'socketserver')
+# python 2 has no selectors, see `_Poller`
+selectors = _LazyModule('selectors') if six.PY3 else None
+
+# optional faster json libraries, see `JsonCodec`
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ujson
+except ImportError:
+    ujson = None
+try:
+    import simplejson
+except ImportError:
+    simplejson = None
 
 
 class EruException(Exception):
@@ -26,14 +84,1431 @@ class EruException(Exception):
     __unicode__ = __str__
 
 
-class EruClient(object):
+ENDPOINTS = [
+    '/',
+    '/api/app/',
+    '/api/app/register/',
+    '/api/app/{name}/',
+    '/api/app/{name}/env/',
+    '/api/app/{name}/listenv/',
+    '/api/app/{name}/containers/',
+    '/api/app/{name}/tasks/',
+    '/api/app/{name}/images/',
+    '/api/app/{name}/versions/',
+    '/api/app/{name}/{version}/',
+    '/api/app/{name}/{version}/tasks/',
+    '/api/app/{name}/{version}/containers/',
+    '/api/deploy/private/',
+    '/api/deploy/public/',
+    '/api/deploy/build/',
+    '/api/deploy/rmversion/',
+    '/api/deploy/rmcontainers/',
+    '/api/container/{container_id}/',
+    '/api/container/{container_id}/kill/',
+    '/api/container/{container_id}/cure/',
+    '/api/container/{container_id}/start/',
+    '/api/container/{container_id}/stop/',
+    '/api/container/{container_id}/poll/',
+    '/api/container/{container_id}/bind_network',
+    '/api/container/{container_id}/bind_eip/',
+    '/api/container/{container_id}/release_eip/',
+    '/api/pod/create/',
+    '/api/pod/list/',
+    '/api/pod/{pod}/',
+    '/api/pod/{pod}/hosts/',
+    '/api/host/create/',
+    '/api/host/{host}/',
+    '/api/host/{host}/down/',
+    '/api/host/{host}/cure/',
+    '/api/host/{host}/containers/',
+    '/api/host/{host}/eip/',
+    '/api/network/create/',
+    '/api/network/list/',
+    '/api/network/add_eip/',
+    '/api/network/delete_eip/',
+    '/api/network/{network}/',
+    '/api/task/{task_id}/',
+    '/api/task/{task_id}/log/',
+    '/websockets/tasklog/{task_id}/',
+    '/websockets/containerlog/{container_id}/',
+]
+
+
+def _compile_endpoints(templates):
+    routes = defaultdict(list)
+    for template in templates:
+        segments = tuple(template.split('/'))
+        literals = [(i, seg) for i, seg in enumerate(segments) if not seg.startswith('{')]
+        names = [(i, seg[1:-1]) for i, seg in enumerate(segments) if seg.startswith('{')]
+        routes[len(segments)].append((template, literals, names))
+    for candidates in routes.values():
+        # `/api/pod/list/` has to win over `/api/pod/{pod}/`
+        candidates.sort(key=lambda route: -len(route[1]))
+    return routes
+
+
+_ROUTES = _compile_endpoints(ENDPOINTS)
+
+
+def match_endpoint(path):
+    """Map an expanded path back to its template in :data:`ENDPOINTS`.
+
+    e.g.::
+
+        >>> match_endpoint('/api/app/appname/containers/')
+        ('/api/app/{name}/containers/', {'name': 'appname'})
+
+    Returns `(path, {})` for paths not in :data:`ENDPOINTS`.
+    """
+    segments = path.split('?', 1)[0].split('/')
+    for template, literals, names in _ROUTES.get(len(segments), ()):
+        for i, seg in literals:
+            if segments[i] != seg:
+                break
+        else:
+            return template, dict((name, segments[i]) for i, name in names)
+    return path, {}
+
+
+DEFAULT_CACHE_TTLS = {
+    '/api/app/{name}/': 60,
+    '/api/app/{name}/{version}/': 300,
+    '/api/app/{name}/listenv/': 60,
+    '/api/pod/{pod}/': 60,
+    '/api/host/{host}/': 30,
+    '/api/network/{network}/': 300,
+    '/api/network/list/': 60,
+}
+
+_APP_CONTAINERS = ['/api/app/{name}/containers/', '/api/app/{name}/{version}/containers/',
+                   '/api/host/{host}/containers/', '/api/container/{container_id}/']
+_HOST_STATE = ['/api/host/{host}/', '/api/host/{host}/containers/', '/api/pod/{pod}/hosts/',
+               '/api/app/{name}/containers/', '/api/app/{name}/{version}/containers/',
+               '/api/container/{container_id}/']
+_CONTAINER_STATE = ['/api/container/{container_id}/', '/api/container/{container_id}/poll/']
+_APP_ENV = ['/api/app/{name}/env/', '/api/app/{name}/listenv/']
+
+# (method, template) of mutating calls => templates of cached GETs they make stale
+CACHE_INVALIDATIONS = {
+    ('POST', '/api/app/register/'): ['/api/app/', '/api/app/{name}/', '/api/app/{name}/versions/',
+                                     '/api/app/{name}/{version}/'],
+    ('PUT', '/api/app/{name}/env/'): _APP_ENV,
+    ('DELETE', '/api/app/{name}/env/'): _APP_ENV,
+    ('POST', '/api/deploy/private/'): _APP_CONTAINERS,
+    ('POST', '/api/deploy/public/'): _APP_CONTAINERS,
+    ('POST', '/api/deploy/build/'): ['/api/app/{name}/images/'],
+    ('POST', '/api/deploy/rmversion/'): _APP_CONTAINERS + ['/api/app/{name}/versions/'],
+    ('POST', '/api/deploy/rmcontainers/'): _APP_CONTAINERS,
+    ('PUT', '/api/container/{container_id}/kill/'): _CONTAINER_STATE,
+    ('PUT', '/api/container/{container_id}/cure/'): _CONTAINER_STATE,
+    ('PUT', '/api/container/{container_id}/start/'): _CONTAINER_STATE,
+    ('PUT', '/api/container/{container_id}/stop/'): _CONTAINER_STATE,
+    ('PUT', '/api/container/{container_id}/bind_network'): _CONTAINER_STATE,
+    ('PUT', '/api/container/{container_id}/bind_eip/'): _CONTAINER_STATE,
+    ('PUT', '/api/container/{container_id}/release_eip/'): _CONTAINER_STATE,
+    ('POST', '/api/pod/create/'): ['/api/pod/list/'],
+    ('POST', '/api/host/create/'): ['/api/pod/{pod}/', '/api/pod/{pod}/hosts/'],
+    ('PUT', '/api/host/{host}/down/'): _HOST_STATE,
+    ('PUT', '/api/host/{host}/cure/'): _HOST_STATE,
+    ('POST', '/api/host/{host}/eip/'): ['/api/host/{host}/', '/api/host/{host}/eip/'],
+    ('DELETE', '/api/host/{host}/eip/'): ['/api/host/{host}/', '/api/host/{host}/eip/'],
+    ('POST', '/api/network/create/'): ['/api/network/list/'],
+    ('POST', '/api/network/add_eip/'): ['/api/network/list/', '/api/network/{network}/'],
+    ('POST', '/api/network/delete_eip/'): ['/api/network/list/', '/api/network/{network}/'],
+}
+
+
+class _CacheEntry(object):
+
+    __slots__ = ('template', 'args', 'value', 'expires', 'etag', 'last_modified')
+
+    def __init__(self, template, args, value, expires, etag, last_modified):
+        self.template = template
+        self.args = args
+        self.value = value
+        self.expires = expires
+        self.etag = etag
+        self.last_modified = last_modified
+
+
+class ResponseCache(object):
+    """LRU cache of GET responses for :class:`EruClient`, opt-in with
+    `EruClient(url, cache=ResponseCache())`.
+
+    Only endpoints with a TTL are cached. Expired entries carrying an
+    `ETag` or `Last-Modified` are revalidated with a conditional GET, and
+    mutating calls drop the entries listed in :data:`CACHE_INVALIDATIONS`.
+    Cached responses are shared between callers, don't mutate them.
+
+    :param ttls: dict of endpoint template => seconds, defaults to :data:`DEFAULT_CACHE_TTLS`.
+    :param maxsize: max number of cached responses, least recently used are evicted.
+    """
+
+    def __init__(self, ttls=None, maxsize=1024):
+        self.ttls = DEFAULT_CACHE_TTLS if ttls is None else ttls
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(path, params):
+        return path, tuple(sorted(six.iteritems(params)))
+
+    def get(self, key):
+        """Return the entry of `key`, expired or not, None if absent."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries[key] = entry
+            if entry.expires > time.time():
+                self.hits += 1
+            else:
+                self.misses += 1
+            return entry
+
+    def set(self, key, template, args, value, etag=None, last_modified=None):
+        ttl = self.ttls.get(template)
+        if not ttl:
+            return
+        entry = _CacheEntry(template, args, value, time.time() + ttl, etag, last_modified)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = entry
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def touch(self, entry):
+        """Entry was revalidated by the server, keep it for another TTL."""
+        entry.expires = time.time() + self.ttls.get(entry.template, 0)
+
+    def invalidate(self, template, args=None):
+        """Drop cached responses of `template`, only those agreeing with
+        `args` on the parameters they have in common."""
+        args = args or {}
+        with self._lock:
+            stale = [key for key, entry in six.iteritems(self._entries)
+                     if entry.template == template and
+                     all(entry.args[k] == v for k, v in six.iteritems(args) if k in entry.args)]
+            for key in stale:
+                del self._entries[key]
+
+    def invalidate_for(self, method, template, args):
+        """Drop what a `method` call to `template` makes stale."""
+        for stale_template in CACHE_INVALIDATIONS.get((method, template), ()):
+            self.invalidate(stale_template, args)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RetryPolicy(object):
+    """When and how :class:`EruClient` retries a failed request.
+
+    Connection errors, timeouts and responses with a status in `statuses`
+    are retried for methods in `methods` only, POST isn't there by default
+    since deploying twice is worse than failing once. Retries wait for an
+    exponential backoff with full jitter, like `uniform(0, backoff * 2 ** n)`.
+
+    :param max_retries: how many times to retry after the first attempt.
+    :param backoff: base delay in seconds.
+    :param max_backoff: cap of the delay in seconds.
+    :param methods: http methods safe to retry.
+    :param statuses: response status codes worth a retry.
+    """
+
+    def __init__(self, max_retries=3, backoff=0.1, max_backoff=2.0,
+                 methods=('GET', 'HEAD', 'PUT', 'DELETE'), statuses=(502, 503, 504)):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.methods = frozenset(methods)
+        self.statuses = frozenset(statuses)
+
+    def can_retry(self, method, retries):
+        return retries < self.max_retries and method in self.methods
+
+    def delay(self, retries):
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** retries))
+
+
+def endpoint_class(method, template):
+    """Which class of :data:`ENDPOINT_CLASSES` a request is in, to be paced
+    by the :class:`Limiter` of that class."""
+    if template.startswith('/api/deploy/'):
+        return 'deploy'
+    if method == 'GET':
+        return 'read'
+    if template.startswith('/api/container/'):
+        return 'container'
+    return 'write'
+
+
+ENDPOINT_CLASSES = ('read', 'deploy', 'container', 'write')
+
+
+class Limiter(object):
+    """Pace the requests of an endpoint class: at most `rate` requests a
+    second with bursts of `burst`, and at most `concurrency` in flight.
+
+    With `adaptive`, the concurrency limit is found AIMD style like tcp
+    congestion control: it grows by one every round trip while responses
+    are fast and fine, and is cut by `decrease` on a 5xx, a timeout, or a
+    latency over `latency_tolerance` times the best latency seen lately,
+    at most once a round trip. Throughput then settles around what the
+    server sustains instead of collapsing when it's overloaded.
+
+    :param rate: requests a second, not limited if None.
+    :param burst: requests allowed at once after being idle, defaults to `rate`.
+    :param concurrency: requests in flight, not limited if None, where
+    adaptive limits start.
+    :param adaptive: adapt the concurrency limit to latency and errors.
+    :param min_concurrency: adaptive limits don't go below it.
+    :param max_concurrency: adaptive limits don't go above it.
+    :param decrease: factor the limit is multiplied by on congestion.
+    :param latency_tolerance: latency over the lately best one times this is congestion.
+    """
+
+    def __init__(self, rate=None, burst=None, concurrency=None, adaptive=False,
+                 min_concurrency=1, max_concurrency=256, decrease=0.5, latency_tolerance=2.0):
+        self.rate = rate
+        self.burst = burst or rate
+        self.adaptive = adaptive
+        self.limit = float(concurrency or (16 if adaptive else 0))
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.decrease = decrease
+        self.latency_tolerance = latency_tolerance
+        self.in_flight = 0
+        self._tokens = float(self.burst or 0)
+        self._refilled = time.time()
+        self._best_latency = None
+        self._rtt = None
+        self._last_decrease = 0
+        self._cond = threading.Condition()
+
+    def try_acquire(self):
+        """Take a slot if one is free now. Returns 0 if it was taken, otherwise
+        seconds to wait before trying again, None if it depends on a release."""
+        with self._cond:
+            if self.limit and self.in_flight >= max(int(self.limit), 1):
+                return None
+            if self.rate:
+                now = time.time()
+                self._tokens = min(self._tokens + (now - self._refilled) * self.rate, self.burst)
+                self._refilled = now
+                if self._tokens < 1:
+                    return (1 - self._tokens) / self.rate
+                self._tokens -= 1
+            self.in_flight += 1
+            return 0
+
+    def acquire(self, deadline=None):
+        """Wait for a slot, returns False if `deadline` passed before one was free."""
+        with self._cond:
+            while True:
+                wait = self.try_acquire()
+                if wait == 0:
+                    return True
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                    wait = remaining if wait is None else min(wait, remaining)
+                self._cond.wait(wait)
+
+    def release(self, latency=None, failed=False):
+        """Give back a slot, `latency` is None if the request wasn't sent,
+        `failed` is a 5xx or a timeout."""
+        with self._cond:
+            self.in_flight -= 1
+            if self.adaptive and latency is not None:
+                self._adapt(latency, failed)
+            self._cond.notify_all()
+
+    def _adapt(self, latency, failed):
+        now = time.time()
+        if self._best_latency is None or latency < self._best_latency:
+            self._best_latency = latency
+        else:
+            # forget a best latency the server can't make anymore
+            self._best_latency += (latency - self._best_latency) * 0.01
+        self._rtt = latency if self._rtt is None else self._rtt * 0.9 + latency * 0.1
+
+        congested = failed or latency > self._best_latency * self.latency_tolerance
+        if congested:
+            if now - self._last_decrease > self._rtt:
+                self.limit = max(self.limit * self.decrease, self.min_concurrency)
+                self._last_decrease = now
+        elif self.in_flight + 1 >= int(self.limit):
+            # only grow while the limit is actually used
+            self.limit = min(self.limit + 1 / self.limit, self.max_concurrency)
+
+
+class Node(object):
+    """One ERU API node of :class:`Router`, with its health and stats."""
+
+    def __init__(self, url):
+        self.url = url
+        self.healthy = True
+        self.latency = None
+        self.requests = 0
+        self.failures = 0
+        self.last_error = None
+        self.failed_at = None
+
+    def stats(self):
+        return {
+            'url': self.url,
+            'healthy': self.healthy,
+            'latency': self.latency,
+            'requests': self.requests,
+            'failures': self.failures,
+            'last_error': self.last_error,
+        }
+
+    def __repr__(self):
+        return '<Node {0} healthy:{1} latency:{2}>'.format(self.url, self.healthy, self.latency)
+
+
+class Router(object):
+    """Pick the ERU node to send a request to, among `urls`.
+
+    The healthy node with the lowest EWMA of latencies is picked. A node
+    failing to connect, timing out or answering a 5xx is unhealthy until
+    a health check, a GET to its `/`, succeeds, they run every
+    `health_interval` seconds in a background thread when there's more
+    than one node. Without health checks an unhealthy node is tried again
+    after `recheck` seconds.
+
+    :param urls: base urls of the nodes.
+    :param health_interval: seconds between health checks, None to disable them.
+    :param alpha: weight of the latest latency in the EWMA.
+    :param recheck: seconds before an unhealthy node is tried again without health checks.
+    """
+
+    def __init__(self, urls, health_interval=5, alpha=0.3, recheck=30):
+        self.nodes = [Node(url) for url in urls]
+        self.health_interval = health_interval
+        self.alpha = alpha
+        self.recheck = recheck
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._checker = None
+        if health_interval and len(self.nodes) > 1:
+            self._session = requests.Session()
+            self._checker = threading.Thread(target=self._check_forever)
+            self._checker.daemon = True
+            self._checker.start()
+
+    def pick(self, exclude=()):
+        """The best node not in `exclude`, None if there's none left."""
+        now = time.time()
+        candidates = [n for n in self.nodes if n not in exclude]
+        if not candidates:
+            return None
+        usable = [n for n in candidates
+                  if n.healthy or (self._checker is None and now - n.failed_at > self.recheck)]
+        if not usable:
+            # everything is down, the one failing first may be back first
+            return min(candidates, key=lambda n: n.failed_at)
+        return min(usable, key=lambda n: n.latency or 0)
+
+    def observe(self, node, latency, error=None):
+        """Account a request sent to `node`, `error` tells why it failed if it did."""
+        with self._lock:
+            node.requests += 1
+            if error is None:
+                node.healthy = True
+                node.latency = latency if node.latency is None else \
+                    node.latency + self.alpha * (latency - node.latency)
+                return
+            node.failures += 1
+            node.last_error = error
+            node.healthy = False
+            node.failed_at = time.time()
+
+    def check(self):
+        """Health check every node once."""
+        for node in self.nodes:
+            started = time.time()
+            try:
+                resp = self._session.get(urljoin(node.url, '/'), timeout=min(self.health_interval, 2))
+                error = None if resp.status_code == 200 else 'Status {0}'.format(resp.status_code)
+            except requests.exceptions.RequestException as e:
+                error = str(e)
+            self.observe(node, time.time() - started, error)
+
+    def _check_forever(self):
+        while not self._stop.wait(self.health_interval):
+            self.check()
+
+    def stats(self):
+        return [node.stats() for node in self.nodes]
+
+    def close(self):
+        self._stop.set()
+
+
+class JsonCodec(object):
+    """How request and response bodies are encoded, `dumps` returns utf-8
+    bytes and `loads` takes bytes or str."""
+
+    def __init__(self, name, loads, dumps):
+        self.name = name
+        self.loads = loads
+        self.dumps = dumps
+
+    def __repr__(self):
+        return '<JsonCodec {0}>'.format(self.name)
+
+
+def _stdlib_dumps(obj):
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+
+def _stdlib_loads(s):
+    # json.loads takes bytes since python 3.6 only
+    if six.PY3 and isinstance(s, bytes):
+        s = s.decode('utf-8')
+    return json.loads(s)
+
+
+JSON_CODECS = OrderedDict()
+if orjson is not None:
+    JSON_CODECS['orjson'] = JsonCodec(
+        'orjson', orjson.loads, lambda obj: orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS))
+if ujson is not None:
+    JSON_CODECS['ujson'] = JsonCodec(
+        'ujson', ujson.loads, lambda obj: ujson.dumps(obj, ensure_ascii=False).encode('utf-8'))
+if simplejson is not None:
+    JSON_CODECS['simplejson'] = JsonCodec(
+        'simplejson', simplejson.loads,
+        lambda obj: simplejson.dumps(obj, separators=(',', ':')).encode('utf-8'))
+JSON_CODECS['json'] = JsonCodec('json', _stdlib_loads, _stdlib_dumps)
+
+
+def json_codec(name=None):
+    """The :class:`JsonCodec` called `name`, the fastest one installed if
+    not specified: orjson, ujson, simplejson, then the stdlib json."""
+    if name is None:
+        return next(iter(JSON_CODECS.values()))
+    try:
+        return JSON_CODECS[name]
+    except KeyError:
+        raise EruException(0, 'json codec {0} is not installed'.format(name))
+
+
+def gzip_compress(data, level=6):
+    """gzip `data` with zlib, `gzip.compress` is python 3 only."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+class TransportConfig(object):
+    """HTTP transport settings of :class:`EruClient`.
+
+    :param pool_connections: how many hosts to keep connection pools for.
+    :param pool_maxsize: max connections kept in each pool, should be at least
+    the number of threads sharing the client.
+    :param connect_timeout: seconds to wait for a connection, defaults to client `timeout`.
+    :param read_timeout: seconds to wait for a response, defaults to client `timeout`.
+    :param retry: :class:`RetryPolicy`, no retry if not set.
+    :param deadline: seconds a request may take in total, retries included.
+    :param limits: dict of endpoint class in :data:`ENDPOINT_CLASSES`, or `*`
+    for all the requests, => :class:`Limiter`, like
+    `{'*': Limiter(rate=100), 'deploy': Limiter(concurrency=4, adaptive=True)}`.
+    :param codec: :class:`JsonCodec` or its name, the fastest installed if not set.
+    :param compress_min_size: json request bodies of at least this many bytes
+    are sent gzipped, the server (or a proxy in front of it) has to inflate
+    them. Not compressed if None. Compressed responses are always accepted.
+    """
+
+    def __init__(self, pool_connections=10, pool_maxsize=10, connect_timeout=None,
+                 read_timeout=None, retry=None, deadline=None, limits=None, codec=None,
+                 compress_min_size=None):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retry = retry or RetryPolicy(max_retries=0)
+        self.deadline = deadline
+        self.limits = dict(limits or {})
+        self.codec = codec if isinstance(codec, JsonCodec) else json_codec(codec)
+        self.compress_min_size = compress_min_size
+
+    def encode_body(self, obj, headers):
+        """Encode a json request body, gzipped if it's big enough, and set
+        the headers that go with it."""
+        body = self.codec.dumps(obj)
+        headers['Content-Type'] = 'application/json'
+        if self.compress_min_size is not None and len(body) >= self.compress_min_size:
+            body = gzip_compress(body)
+            headers['Content-Encoding'] = 'gzip'
+        return body
+
+    def limiters(self, method, url):
+        """Limiters a request goes through, the one of its class first."""
+        if not self.limits:
+            return ()
+        limiters = [self.limits.get(endpoint_class(method, match_endpoint(url)[0])),
+                    self.limits.get('*')]
+        return [limiter for limiter in limiters if limiter is not None]
+
+    def mount(self, session):
+        adapter = HTTPAdapter(pool_connections=self.pool_connections,
+                              pool_maxsize=self.pool_maxsize)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+
+
+class _Flight(object):
+
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """Collapse identical calls made at the same time from many threads into
+    one, every caller gets the result (or the exception) of that one call."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def do(self, key, func):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = func()
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+
+def _single_flight_key(url, kwargs):
+    """Key of a GET for :class:`SingleFlight`, None if it can't be shared."""
+    if set(kwargs) - {'params'}:
+        return None
+    params = dict(kwargs.get('params') or {})
+    params.setdefault('start', 0)
+    params.setdefault('limit', 20)
+    return url, tuple(sorted(six.iteritems(params)))
+
+
+class _Poller(object):
+    """Wait for readable sockets, `selectors` on python 3 and `select` on python 2."""
+
+    def __init__(self):
+        self._selector = selectors.DefaultSelector() if selectors else None
+        self._data = {}
+
+    def register(self, sock, data):
+        if self._selector is not None:
+            self._selector.register(sock, selectors.EVENT_READ, data)
+        self._data[sock] = data
+
+    def unregister(self, sock):
+        if self._data.pop(sock, None) is not None and self._selector is not None:
+            self._selector.unregister(sock)
+
+    def select(self, timeout=None):
+        """Data of the readable sockets."""
+        if self._selector is not None:
+            return [key.data for key, _ in self._selector.select(timeout)]
+        readable, _, _ = select.select(list(self._data), [], [], timeout)
+        return [self._data[sock] for sock in readable]
+
+    def close(self):
+        self._data.clear()
+        if self._selector is not None:
+            self._selector.close()
+
+
+class StreamConfig(object):
+    """Websocket settings of :class:`EruClient`, see :meth:`EruClient.request_websocket`.
+
+    :param recv_timeout: seconds of silence before pinging the server.
+    :param heartbeat_timeout: seconds without any frame, pong included,
+    before the connection is considered broken.
+    :param max_reconnects: how many times in a row to reopen a broken stream.
+    :param backoff: base delay in seconds between reconnects, doubled each time.
+    :param max_backoff: cap of the delay in seconds.
+    :param resume_window: lines requested again when resuming a `tail` stream.
+    :param batch_size: max json frames decoded in one go.
+    """
+
+    def __init__(self, recv_timeout=10, heartbeat_timeout=30, max_reconnects=5,
+                 backoff=0.5, max_backoff=10, resume_window=100, batch_size=64):
+        self.recv_timeout = recv_timeout
+        self.heartbeat_timeout = heartbeat_timeout
+        self.max_reconnects = max_reconnects
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.resume_window = resume_window
+        self.batch_size = batch_size
+
+
+def _readable(sock):
+    pending = getattr(sock, 'pending', None)
+    if pending is not None and pending():
+        return True
+    readable, _, _ = select.select([sock], [], [], 0)
+    return bool(readable)
+
+
+def _loads_batch(frames, loads=json.loads):
+    """Decode many frames with one call, each frame being a json document."""
+    if len(frames) == 1:
+        return [loads(frames[0])]
+    return loads('[' + ','.join(frames) + ']')
+
+
+_json_decoder = json.JSONDecoder()
+_WHITESPACE = ' \t\n\r'
+_NUMBER_END = ',]' + _WHITESPACE
+
+
+def iter_json_array(chunks):
+    """Yield the items of a json array as soon as each of them is decoded
+    from `chunks`, an iterable of bytes like `Response.iter_content`. Only
+    the item being decoded and the chunk it's in are held in memory.
+
+    e.g.::
+
+        >>> list(iter_json_array([b'[{"a": 1}, {"a"', b': 2}]']))
+        [{'a': 1}, {'a': 2}]
+    """
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(chunks)
+    buf, pos, started, eof = '', 0, False, False
+    while True:
+        while pos < len(buf) and buf[pos] in _WHITESPACE:
+            pos += 1
+        if pos == len(buf):
+            pass
+        elif not started:
+            if buf[pos] != '[':
+                raise ValueError('Not a json array')
+            started = True
+            pos += 1
+            continue
+        elif buf[pos] == ']':
+            return
+        elif buf[pos] == ',':
+            pos += 1
+            continue
+        else:
+            try:
+                item, end = _json_decoder.raw_decode(buf, pos)
+            except ValueError:
+                # the item goes on in the next chunk
+                if eof:
+                    raise
+            else:
+                # so may a number, `2.` is decoded as 2 until the next chunk says `2.5`
+                if eof or isinstance(item, (dict, list) + six.string_types) or \
+                        (end < len(buf) and buf[end] in _NUMBER_END):
+                    pos = end
+                    yield item
+                    continue
+
+        if eof:
+            raise ValueError('Truncated json array')
+        chunk = next(chunks, None)
+        eof = chunk is None
+        buf = buf[pos:] + utf8.decode(chunk or b'', final=eof)
+        pos = 0
+
+
+def _drop_overlap(history, replay):
+    """Lines of `replay` coming after the last lines seen, `history`."""
+    history = list(history)
+    n = len(history)
+    # replay started before history, it's found whole in there
+    for p in range(len(replay), n - 1, -1):
+        if replay[p - n:p] == history:
+            return replay[p:]
+    # replay started in the middle of history
+    for k in range(min(n, len(replay)), 0, -1):
+        if history[-k:] == replay[:k]:
+            return replay[k:]
+    return replay
+
+
+class RequestInfo(object):
+    """What :class:`RequestHook` gets to know about a request.
+
+    `endpoint` is the template in :data:`ENDPOINTS`, like
+    `/api/app/{name}/containers/`, `kind` is `http` or `websocket`, and
+    for websockets `latency` is how long the stream lasted, `retries`
+    how many times it was reopened and `frames` how many frames arrived.
+    `body` is the payload before encoding and `response` the decoded
+    response of http requests, both are only kept until hooks ran.
+    """
+
+    __slots__ = ('kind', 'method', 'endpoint', 'url', 'params', 'body', 'started', 'status',
+                 'bytes_in', 'bytes_out', 'latency', 'retries', 'frames', 'error', 'response')
+
+    def __init__(self, kind, method, endpoint, url, params=None, body=None):
+        self.kind = kind
+        self.method = method
+        self.endpoint = endpoint
+        self.url = url
+        self.params = params
+        self.body = body
+        self.started = time.time()
+        self.status = None
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.latency = None
+        self.retries = 0
+        self.frames = 0
+        self.error = None
+        self.response = None
+
+
+class RequestHook(object):
+    """Called around every request of :class:`EruClient`, override what you need.
+    Hooks run in the thread of the request, keep them cheap."""
+
+    def before_request(self, info):
+        pass
+
+    def after_request(self, info):
+        pass
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class _EndpointMetrics(object):
+
+    __slots__ = ('count', 'errors', 'retries', 'bytes_in', 'bytes_out', 'latency_sum',
+                 'buckets', 'statuses')
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.retries = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.latency_sum = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.statuses = defaultdict(int)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the `q` quantile of latency."""
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(LATENCY_BUCKETS, self.buckets):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'retries': self.retries,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'statuses': dict((str(k), v) for k, v in six.iteritems(self.statuses)),
+            'latency': {
+                'sum': self.latency_sum,
+                'mean': self.latency_sum / self.count if self.count else 0,
+                'p50': self.quantile(0.5),
+                'p99': self.quantile(0.99),
+                'buckets': dict(zip([str(b) for b in LATENCY_BUCKETS] + ['+Inf'], self.buckets)),
+            },
+        }
+
+
+class MetricsAggregator(RequestHook):
+    """In-process counters and latency histograms per (method, endpoint).
+
+    e.g.::
+
+        >>> metrics = MetricsAggregator()
+        >>> eru_client = EruClient(url, hooks=[metrics])
+        >>> metrics.snapshot()['GET /api/app/{name}/']['latency']['p99']
+        0.05
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = defaultdict(_EndpointMetrics)
+
+    def after_request(self, info):
+        i = bisect.bisect_left(LATENCY_BUCKETS, info.latency)
+        with self._lock:
+            m = self._metrics[(info.method, info.endpoint)]
+            m.count += 1
+            m.errors += info.error is not None
+            m.retries += info.retries
+            m.bytes_in += info.bytes_in
+            m.bytes_out += info.bytes_out
+            m.latency_sum += info.latency
+            m.buckets[i] += 1
+            m.statuses[info.status] += 1
+
+    def snapshot(self):
+        """Metrics as a dict of `'METHOD endpoint'` => counters."""
+        with self._lock:
+            return dict(('{0} {1}'.format(method, endpoint), m.to_dict())
+                        for (method, endpoint), m in six.iteritems(self._metrics))
+
+    def dump(self, fp):
+        """Write :meth:`snapshot` as json to file object `fp`."""
+        json.dump(self.snapshot(), fp, indent=2, sort_keys=True)
+
+    def reset(self):
+        with self._lock:
+            self._metrics.clear()
+
+
+REDACTED = '<redacted>'
+REDACTED_KEYS = frozenset(['token', 'password', 'secret'])
+# endpoints whose payloads and responses are app envs, values are all secret
+_ENV_ENDPOINTS = frozenset(['/api/app/{name}/env/'])
+
+
+def _redact(obj, keys):
+    if isinstance(obj, dict):
+        return dict((k, REDACTED if k in keys else _redact(v, keys)) for k, v in six.iteritems(obj))
+    if isinstance(obj, list):
+        return [_redact(v, keys) for v in obj]
+    return obj
+
+
+def _redact_env(obj):
+    if not isinstance(obj, dict):
+        return obj
+    return dict((k, v if k in ('env', 'r', 'msg', 'error') else REDACTED)
+                for k, v in six.iteritems(obj))
+
+
+class TrafficRecorder(RequestHook):
+    """Append every request to a file of json lines, to be replayed against
+    a stand-in server with `python -m benchmarks.replay`::
+
+        >>> recorder = TrafficRecorder('/var/log/eru/traffic.jsonl.gz')
+        >>> eru_client = EruClient(url, hooks=[recorder])
+        >>> recorder.close()
+
+    A line has `t`, the time the request started, and `kind`, `method`,
+    `endpoint`, `url`, `params`, `body`, `status`, `bytes_in`, `bytes_out`,
+    `latency`, `retries`, `frames`, `error` and `response`. Values of
+    `redact_keys` anywhere and the values of app envs are replaced by
+    :data:`REDACTED`. Lines are written `buffer_size` at a time or once
+    `flush_interval` seconds old, a path ending with `.gz` gets a gzip member
+    for each write, which gzip tools and :func:`read_traffic` read as one.
+
+    :param responses: record responses, only their size is recorded otherwise.
+    :param max_response_size: responses of more bytes are not recorded.
+    """
+
+    def __init__(self, path, responses=True, max_response_size=64 * 1024, redact_keys=REDACTED_KEYS,
+                 buffer_size=256, flush_interval=1.0):
+        self.path = path
+        self.responses = responses
+        self.max_response_size = max_response_size
+        self.redact_keys = frozenset(redact_keys)
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.compress = path.endswith('.gz')
+        self._buffer = []
+        self._flushed = time.time()
+        self._lock = threading.Lock()
+        self._file = open(path, 'ab')
+
+    def entry(self, info):
+        """The line of `info` as a dict, redacted."""
+        keys = self.redact_keys
+        params, body, response = info.params, info.body, None
+        if self.responses and info.bytes_in <= self.max_response_size:
+            response = info.response
+        if info.endpoint in _ENV_ENDPOINTS:
+            body, response = _redact_env(body), _redact_env(response)
+        error = info.error
+        return {
+            't': round(info.started, 6),
+            'kind': info.kind,
+            'method': info.method,
+            'endpoint': info.endpoint,
+            'url': info.url,
+            'params': _redact(params, keys) if params else None,
+            'body': _redact(body, keys) if isinstance(body, (dict, list)) else None,
+            'status': info.status,
+            'bytes_in': info.bytes_in,
+            'bytes_out': info.bytes_out,
+            'latency': round(info.latency, 6),
+            'retries': info.retries,
+            'frames': info.frames,
+            'error': [error.code, error.message] if isinstance(error, EruException) else None,
+            'response': _redact(response, keys) if response is not None else None,
+        }
+
+    def after_request(self, info):
+        line = json.dumps(self.entry(info), separators=(',', ':'), default=str)
+        with self._lock:
+            self._buffer.append(line)
+            if (len(self._buffer) >= self.buffer_size or
+                    time.time() - self._flushed >= self.flush_interval):
+                self._flush()
+
+    def _flush(self):
+        if self._buffer and not self._file.closed:
+            data = ('\n'.join(self._buffer) + '\n').encode('utf-8')
+            self._file.write(gzip_compress(data) if self.compress else data)
+            self._file.flush()
+        del self._buffer[:]
+        self._flushed = time.time()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self._file.close()
+
+
+def read_traffic(path):
+    """Yield the entries written by :class:`TrafficRecorder` to `path`."""
+    f = gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')
+    with f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line.decode('utf-8'))
+
+
+_intern = sys.intern if six.PY3 else intern  # noqa: F821
+
+
+class Record(object):
+    """Compact read-only view of a record returned by ERU.
+
+    Frequently used fields live in `__slots__`, the repeated strings among
+    them (app name, version, pod name...) are interned, and the rest of the
+    dict, nested fields included, is kept as compact json and only decoded
+    when asked for. Records can be read like dicts, so code written for the
+    raw responses keeps working::
+
+        >>> c = Container.from_dict(eru_client.get_container('b84fb25bd99b'))
+        >>> c.appname, c['entrypoint'], len(c['cores']['full'])
+        ('appname', 'web', 2)
+    """
+
+    __slots__ = ('_rest',)
+    _interned = ()
+
+    @classmethod
+    def from_dict(cls, d):
+        record = cls.__new__(cls)
+        fields = cls._field_set
+        for name, value in six.iteritems(d):
+            if name not in fields:
+                continue
+            if name in cls._interned and isinstance(value, str):
+                value = _intern(value)
+            setattr(record, name, value)
+        rest = dict((k, v) for k, v in six.iteritems(d) if k not in fields)
+        record._rest = json.dumps(rest, separators=(',', ':')) if rest else None
+        return record
+
+    def _decode_rest(self):
+        return json.loads(self._rest) if self._rest else {}
+
+    def __getattr__(self, name):
+        # only called for fields not in `__slots__`, or not in the response
+        if name.startswith('_'):
+            raise AttributeError(name)
+        rest = self._decode_rest()
+        if name not in rest:
+            raise AttributeError(name)
+        return rest[name]
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def __contains__(self, key):
+        return hasattr(self, key)
+
+    def to_dict(self):
+        d = self._decode_rest()
+        for name in self.__slots__:
+            if hasattr(self, name):
+                d[name] = getattr(self, name)
+        return d
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.to_dict() == other.to_dict()
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __getstate__(self):
+        return self.to_dict()
+
+    def __setstate__(self, state):
+        other = self.from_dict(state)
+        for name in self.__slots__ + ('_rest',):
+            if hasattr(other, name):
+                setattr(self, name, getattr(other, name))
 
-    def __init__(self, url, timeout=5, username='', password=''):
+    def __repr__(self):
+        key = self.__slots__[0]
+        return '<{0} {1}:{2}>'.format(type(self).__name__, key, getattr(self, key, None))
+
+
+class Container(Record):
+    __slots__ = ('container_id', 'appname', 'version', 'entrypoint', 'env', 'podname',
+                 'hostname', 'host', 'in_removal', 'is_alive', 'created')
+    _interned = frozenset(['appname', 'version', 'entrypoint', 'env', 'podname',
+                           'hostname', 'host'])
+
+
+class Host(Record):
+    __slots__ = ('name', 'id', 'addr', 'ip', 'podname', 'is_alive', 'is_public')
+    _interned = frozenset(['podname'])
+
+
+class Pod(Record):
+    __slots__ = ('name', 'id', 'description')
+
+
+class Task(Record):
+    __slots__ = ('id', 'appname', 'version', 'type', 'finished', 'result', 'created')
+    _interned = frozenset(['appname', 'version'])
+
+
+class Network(Record):
+    __slots__ = ('name', 'id', 'netspace')
+
+
+class AppVersion(Record):
+    __slots__ = ('sha', 'id', 'appname', 'created')
+    _interned = frozenset(['appname'])
+
+
+for _record_type in (Container, Host, Pod, Task, Network, AppVersion):
+    _record_type._field_set = frozenset(_record_type.__slots__)
+
+
+def _as_records(record_type, records):
+    if record_type is None:
+        return records
+    return [record_type.from_dict(d) for d in records]
+
+
+CALLBACK_TIMEOUT = 60
+
+
+class CallbackWaiter(object):
+    """Callbacks of one deploy, done once `expected` of them arrived."""
+
+    def __init__(self, token, url, expected=1):
+        self.token = token
         self.url = url
+        self.expected = expected
+        self.callbacks = []
+        self._done = threading.Event()
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def add(self, payload):
+        with self._lock:
+            self.callbacks.append(payload)
+            if len(self.callbacks) < self.expected or self._done.is_set():
+                return
+            self._done.set()
+            listeners, self._listeners = self._listeners, []
+        for listener in listeners:
+            listener()
+
+    def on_done(self, listener):
+        """Call `listener()` once all the callbacks arrived, from the thread
+        of the callback server, or right away if they already did."""
+        with self._lock:
+            if not self._done.is_set():
+                self._listeners.append(listener)
+                return
+        listener()
+
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """Returns whether all the callbacks arrived."""
+        self._done.wait(timeout)
+        return self._done.is_set()
+
+
+class _CallbackHandler:
+    # mixed with BaseHTTPRequestHandler by `_callback_http_server`, a classic
+    # class on python 2 so that its __init__ isn't object's
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def receive(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        path = urlparse(self.path)
+        if body:
+            try:
+                payload = json.loads(body.decode('utf-8'))
+            except ValueError:
+                payload = dict(parse_qsl(body.decode('utf-8')))
+        else:
+            payload = dict(parse_qsl(path.query))
+
+        found = self.server.callbacks.deliver(path.path.strip('/').split('/')[-1], payload)
+        reply = json.dumps({'r': 0 if found else 1}).encode('utf-8')
+        self.send_response(200 if found else 404)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+    do_GET = do_POST = do_PUT = receive
+
+
+def _callback_http_server(address):
+    """The http server of :class:`CallbackServer`, its classes are built
+    here so that the http server modules are imported only when needed."""
+    # object, as type() wants a new-style base and those of python 2 are classic
+    handler = type('CallbackHandler', (_CallbackHandler, BaseHTTPServer.BaseHTTPRequestHandler, object), {})
+    server = type('CallbackHTTPServer', (socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer, object),
+                  {'daemon_threads': True, 'allow_reuse_address': True})
+    return server(address, handler)
+
+
+def _local_address(url):
+    """Address of the interface this machine reaches `url` through, so the
+    one ERU calls back, all of them if there's no route to `url`."""
+    parsed = urlparse(url)
+    if not parsed.hostname:
+        return '0.0.0.0'
+    try:
+        family, _, _, _, address = socket.getaddrinfo(parsed.hostname, parsed.port or 80,
+                                                      0, socket.SOCK_DGRAM)[0]
+        sock = socket.socket(family, socket.SOCK_DGRAM)
+        try:
+            # no packet is sent, this only picks the route
+            sock.connect(address)
+            return sock.getsockname()[0]
+        finally:
+            sock.close()
+    except (socket.error, IndexError):
+        return '0.0.0.0'
+
+
+class CallbackServer(object):
+    """Receive the `callback_url` calls of deploys, in a background thread.
+
+    Every deploy gets its own url, `<advertise_url>callback/<token>/`, and
+    calls to it are matched to the :class:`CallbackWaiter` of that deploy.
+    See :meth:`EruClient.submit_deploy_private`.
+
+    Tokens are random 128 bits from `os.urandom`, callbacks to any other
+    url are answered 404, so they can't be forged by guessing.
+
+    :param host: address to listen on, :class:`EruClient` starts its own
+    server on the interface it reaches ERU through.
+    :param port: port to listen on, a free one if 0.
+    :param advertise_url: url ERU reaches this server with, defaults to
+    the address listened on, or the hostname of this machine when
+    listening on all interfaces, and the port listened on.
+    """
+
+    def __init__(self, host='0.0.0.0', port=0, advertise_url=None):
+        self.host = host
+        self.port = port
+        self._advertise_url = advertise_url
+        self._waiters = {}
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        if self._advertise_url:
+            return self._advertise_url
+        host, port = self._server.server_address[:2]
+        if host in ('', '0.0.0.0', '::'):
+            host = socket.gethostname()
+        elif ':' in host:
+            host = '[{0}]'.format(host)
+        return 'http://{0}:{1}/'.format(host, port)
+
+    def start(self):
+        if self._server is None:
+            self._server = _callback_http_server((self.host, self.port))
+            self._server.callbacks = self
+            self._thread = threading.Thread(target=self._server.serve_forever)
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def register(self, expected=1):
+        """A new :class:`CallbackWaiter` with its own url."""
+        token = binascii.hexlify(os.urandom(16)).decode('ascii')
+        waiter = CallbackWaiter(token, urljoin(self.url, 'callback/{0}/'.format(token)), expected)
+        with self._lock:
+            self._waiters[token] = waiter
+        return waiter
+
+    def unregister(self, waiter):
+        with self._lock:
+            self._waiters.pop(waiter.token, None)
+
+    def deliver(self, token, payload):
+        with self._lock:
+            waiter = self._waiters.get(token)
+        if waiter is None:
+            return False
+        waiter.add(payload)
+        return True
+
+
+class DeployFuture(object):
+    """A deploy sent with a callback url, see :meth:`EruClient.submit_deploy_private`.
+
+    :param response: what ERU responded to the deploy.
+    :param task_ids: tasks of the deploy, polled if callbacks don't come.
+    """
+
+    def __init__(self, client, server, waiter, response):
+        self.response = response
+        self.task_ids = response.get('tasks', []) if isinstance(response, dict) else []
+        self.pushed = None
+        self._client = client
+        self._server = server
+        self._waiter = waiter
+
+    @property
+    def callbacks(self):
+        return list(self._waiter.callbacks)
+
+    def done(self):
+        return self._waiter.done()
+
+    def result(self, callback_timeout=CALLBACK_TIMEOUT, timeout=None):
+        """Wait for the deploy to be finished.
+
+        Returns the payloads of the callbacks if all of them arrived within
+        `callback_timeout` seconds, otherwise falls back to
+        :meth:`EruClient.wait_for_tasks` and returns the finished tasks.
+        `pushed` tells which one happened.
+
+        :param timeout: seconds to poll the tasks for, after `callback_timeout`.
+        """
+        try:
+            self.pushed = self._waiter.wait(callback_timeout)
+        finally:
+            self._server.unregister(self._waiter)
+        if self.pushed:
+            return self.callbacks
+        return list(self._client.wait_for_tasks(self.task_ids, timeout=timeout))
+
+
+PAGE_SIZE = 100
+PREFETCH_PAGES = 4
+BULK_CONCURRENCY = 64
+LOG_BUFFER_SIZE = 64
+STREAM_CHUNK_SIZE = 64 * 1024
+TASK_POLL_INTERVAL = 0.5
+TASK_POLL_MAX_INTERVAL = 8
+
+
+class EruClient(object):
+
+    def __init__(self, url, timeout=5, username='', password='', cache=None, transport=None,
+                 coalesce=False, stream_config=None, hooks=None, callback_server=None,
+                 health_interval=5):
+        """
+        :param url: base url of ERU, or a list of them to spread requests over
+        the fastest healthy ones, see :class:`Router`.
+        :param cache: :class:`ResponseCache`, GET responses are not cached if not set.
+        :param transport: :class:`TransportConfig`, pool size, timeouts and retries.
+        :param coalesce: if set, identical GETs in flight at the same time are sent
+        only once and share the response, see :class:`SingleFlight`.
+        :param stream_config: :class:`StreamConfig`, websocket timeouts and reconnects.
+        :param hooks: list of :class:`RequestHook` called around every request.
+        :param callback_server: :class:`CallbackServer` receiving callbacks of
+        deploys, one listening on the interface ERU is reached through is started
+        when first needed if not set.
+        :param health_interval: seconds between health checks of nodes when
+        there are many, None to disable them.
+        """
+        urls = [url] if isinstance(url, six.string_types) else list(url)
+        self.url = urls[0]
+        self.router = Router(urls, health_interval)
         self.timeout = timeout
         self.username = username
         self.password = password
+        self.transport = transport or TransportConfig()
         self.session = requests.Session()
+        self.transport.mount(self.session)
+        self.cache = cache
+        self.single_flight = SingleFlight() if coalesce else None
+        self.stream_config = stream_config or StreamConfig()
+        self.hooks = list(hooks or [])
+        self.callback_server = callback_server
+        self._callback_lock = threading.Lock()
 
     def request(self, url, method='GET', params=None, data=None, json=None, files=None, expected_code=200):
         if params is None:
@@ -43,47 +1518,524 @@ class EruClient(object):
 
         params.setdefault('start', 0)
         params.setdefault('limit', 20)
-        target_url = urljoin(self.url, url)
+
+        cache, cache_key, entry, headers = self.cache, None, None, {}
+        if cache is not None:
+            template, args = match_endpoint(url)
+            if method == 'GET' and template in cache.ttls:
+                cache_key = cache.key(url, params)
+                entry = cache.get(cache_key)
+                if entry is not None:
+                    if entry.expires > time.time():
+                        return entry.value
+                    if entry.etag:
+                        headers['If-None-Match'] = entry.etag
+                    if entry.last_modified:
+                        headers['If-Modified-Since'] = entry.last_modified
+
+        codec = self.transport.codec
+        body = data
+        if json is not None and not files:
+            body = self.transport.encode_body(json, headers)
+
+        info = self._start_request('http', method, url, params, json if json is not None else data)
         try:
-            resp = self.session.request(method=method,
-                                        url=target_url,
-                                        params=params,
-                                        data=data,
-                                        json=json,
-                                        files=files,
-                                        timeout=self.timeout)
-            r = resp.json()
+            resp = self._send(method, url, params, body, None if body is not data else json,
+                              files, headers, info)
+            if entry is not None and resp.status_code == 304:
+                cache.touch(entry)
+                return entry.value
+            r = codec.loads(resp.content)
+            if info is not None:
+                info.response = r
             if resp.status_code != expected_code:
                 raise EruException(resp.status_code, r.get('error', 'Unknown error'))
+            if cache_key is not None:
+                cache.set(cache_key, template, args, r,
+                          resp.headers.get('ETag'), resp.headers.get('Last-Modified'))
             return r
-        except requests.exceptions.ReadTimeout:
-            raise EruException(0, 'Read timeout')
-        except requests.exceptions.ConnectionError:
-            raise EruException(0, 'Connection refused')
+        except EruException as e:
+            if info is not None:
+                info.error = e
+            raise
         except Exception as e:
             err_msg = '''{url} responded: {msg}\n{params}\n{data}\n{json}'''.format(
-                url=url, msg=e.message, params=params, data=data, json=json)
-            raise EruException(0, err_msg)
+                url=url, msg=getattr(e, 'message', e), params=params, data=data, json=json)
+            error = EruException(0, err_msg)
+            if info is not None:
+                info.error = error
+            raise error
+        finally:
+            if cache is not None and method != 'GET':
+                cache.invalidate_for(method, template, args)
+            if info is not None:
+                self._finish_request(info)
+
+    def _start_request(self, kind, method, url, params=None, body=None):
+        """Tell hooks a request starts, returns its :class:`RequestInfo`, None if
+        there's no hook."""
+        if not self.hooks:
+            return None
+        info = RequestInfo(kind, method, match_endpoint(url)[0], url, params, body or None)
+        for hook in self.hooks:
+            hook.before_request(info)
+        return info
+
+    def _finish_request(self, info):
+        info.latency = time.time() - info.started
+        for hook in self.hooks:
+            hook.after_request(info)
+
+    def _send(self, method, url, params, data, json, files, headers, info=None, stream=False):
+        """Send the request, retrying as the :class:`RetryPolicy` of transport allows.
+        Requests with a method safe to retry first fail over to the other nodes.
+        Returns the response, whatever its status is, its body isn't read yet
+        if `stream` is set."""
+        transport = self.transport
+        retry = transport.retry
+        router = self.router
+        deadline = time.time() + transport.deadline if transport.deadline else None
+        connect_timeout = transport.connect_timeout or self.timeout
+        read_timeout = transport.read_timeout or self.timeout
+        limiters = transport.limiters(method, url)
+        node = router.pick()
+        tried = set()
+        retries = 0
+        while True:
+            for i, limiter in enumerate(limiters):
+                if not limiter.acquire(deadline):
+                    for acquired in limiters[:i]:
+                        acquired.release()
+                    raise EruException(0, 'Deadline exceeded')
+
+            timeout = (connect_timeout, read_timeout)
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    for limiter in limiters:
+                        limiter.release()
+                    raise EruException(0, 'Deadline exceeded')
+                timeout = (min(connect_timeout, remaining), min(read_timeout, remaining))
+
+            started = time.time()
+            failed = True
+            error = caught = resp = None
+            try:
+                resp = self.session.request(method=method,
+                                            url=urljoin(node.url, url),
+                                            params=params,
+                                            data=data,
+                                            json=json,
+                                            files=files,
+                                            headers=headers,
+                                            timeout=timeout,
+                                            stream=stream)
+                failed = resp.status_code >= 500
+                if info is not None:
+                    info.status = resp.status_code
+                    info.bytes_in = 0 if stream else len(resp.content)
+                    info.bytes_out = len(resp.request.body or b'')
+                if resp.status_code not in retry.statuses:
+                    return resp
+                if stream:
+                    # give the connection back before trying again
+                    resp.close()
+            except requests.exceptions.ReadTimeout:
+                error = EruException(0, 'Read timeout')
+            except requests.exceptions.ConnectionError:
+                error = EruException(0, 'Connection refused')
+            except Exception as e:
+                caught = e
+                raise
+            finally:
+                latency = time.time() - started
+                for limiter in limiters:
+                    limiter.release(latency, failed)
+                if error is not None:
+                    reason = error.message
+                elif isinstance(caught, requests.exceptions.ChunkedEncodingError):
+                    # the node broke off the response
+                    reason = str(caught)
+                elif caught is None and resp.status_code in retry.statuses:
+                    reason = 'Status {0}'.format(resp.status_code)
+                else:
+                    # an error of the request itself isn't the node's fault
+                    reason = None
+                router.observe(node, latency, reason)
+
+            if method in retry.methods:
+                tried.add(node)
+                other = router.pick(exclude=tried)
+                if other is not None:
+                    node = other
+                    if info is not None:
+                        info.retries += 1
+                    continue
 
-    def request_websocket(self, url, as_json=True, params=None):
-        # .......
-        ws_url = urljoin(self.url, url).replace(
+            give_up = not retry.can_retry(method, retries)
+            delay = 0 if give_up else retry.delay(retries)
+            if give_up or (deadline is not None and time.time() + delay >= deadline):
+                if error is not None:
+                    raise error
+                return resp
+            time.sleep(delay)
+            retries += 1
+            node = router.pick()
+            tried.clear()
+            if info is not None:
+                info.retries += 1
+
+    def node_stats(self):
+        """Health, EWMA latency, requests and failures of every ERU node."""
+        return self.router.stats()
+
+    def close(self):
+        """Stop health checks and close pooled connections."""
+        self.router.close()
+        self.session.close()
+
+    def websocket_url(self, url, params=None):
+        ws_url = urljoin(self.router.pick().url, url).replace(
             'http://', 'ws://').replace('https://', 'wss://')
         if params is None:
             params = {}
-        query = urllib.urlencode(params)
-        ws_url = urlparse.urlparse(ws_url)._replace(query=query).geturl()
-        ws = websocket.create_connection(ws_url)
+        query = urlencode(params)
+        return urlparse(ws_url)._replace(query=query).geturl()
+
+    def _connect_websocket(self, url, params):
+        config = self.stream_config
+        return websocket.create_connection(self.websocket_url(url, params),
+                                           timeout=config.recv_timeout)
+
+    def _recv_frames(self, ws, batch_size):
+        """Block until a frame arrives, then take the frames that already
+        arrived too, up to `batch_size`. Returns (closed, frames), frames are
+        empty for a ping or a pong, they tell the connection is alive too."""
+        frames = []
         while True:
-            try:
-                line = ws.recv()
-                if not line:
+            opcode, data = ws.recv_data(control_frame=True)
+            if opcode == websocket.ABNF.OPCODE_CLOSE:
+                return True, frames
+            if opcode in (websocket.ABNF.OPCODE_PING, websocket.ABNF.OPCODE_PONG) and not frames:
+                return False, frames
+            if opcode in (websocket.ABNF.OPCODE_TEXT, websocket.ABNF.OPCODE_BINARY) and data:
+                if six.PY3 and opcode == websocket.ABNF.OPCODE_TEXT:
+                    data = data.decode('utf-8')
+                frames.append(data)
+            if frames and (len(frames) >= batch_size or not _readable(ws.sock)):
+                return False, frames
+
+    def request_websocket(self, url, as_json=True, params=None, resume=None):
+        """Stream frames of a websocket. returns a generator.
+
+        The connection is pinged after `recv_timeout` seconds of silence and
+        considered broken after `heartbeat_timeout`, see :class:`StreamConfig`.
+        A broken connection is reopened with backoff when `resume` is set:
+
+        - `count`: the server replays the stream from the beginning, frames
+          already yielded are skipped.
+        - `tail`: the server replays the last `tail` lines, the stream is
+          reopened with `tail=resume_window` and the lines overlapping with
+          the last ones yielded are dropped. Lines are lost if more than
+          `resume_window` arrived while disconnected.
+
+        The generator ends when the server closes the websocket and raises
+        :class:`EruException` when it can't be reopened.
+        """
+        config = self.stream_config
+        params = dict(params or {})
+        batch_size = config.batch_size if as_json else 1
+        delivered = 0
+        history = deque(maxlen=config.resume_window)
+        skip, replay = 0, None
+        reconnects = 0
+        ws = None
+        last_seen = time.time()
+        info = self._start_request('websocket', 'GET', url, dict(params))
+        try:
+            while True:
+                closed, frames, error, replay_done = False, [], None, False
+                try:
+                    if ws is None:
+                        ws = self._connect_websocket(url, params)
+                        last_seen = time.time()
+                        if replay is not None:
+                            # the replay comes in a burst, don't wait long for its end
+                            ws.settimeout(min(1, config.recv_timeout))
+                    closed, frames = self._recv_frames(ws, batch_size)
+                    last_seen = time.time()
+                    reconnects = 0
+                except websocket.WebSocketTimeoutException as e:
+                    if ws is None:
+                        # the handshake timed out, reconnect like for any broken stream
+                        error = e
+                    elif time.time() - last_seen >= config.heartbeat_timeout:
+                        error = 'no heartbeat in {0}s'.format(config.heartbeat_timeout)
+                    else:
+                        ws.ping()
+                        # a replay shorter than resume_window is over
+                        replay_done = True
+                except (websocket.WebSocketException, socket.error) as e:
+                    error = e
+
+                if error is not None:
+                    if ws is not None:
+                        ws.close()
+                        ws = None
+                    if not resume or reconnects >= config.max_reconnects:
+                        error = EruException(0, 'Websocket {0} broken: {1}'.format(url, error))
+                        if info is not None:
+                            info.error = error
+                        raise error
+                    time.sleep(min(config.max_backoff, config.backoff * 2 ** reconnects))
+                    reconnects += 1
+                    if info is not None:
+                        info.retries += 1
+                    if resume == 'count':
+                        skip = delivered
+                    elif resume == 'tail':
+                        params['tail'] = config.resume_window
+                        replay = []
+                    continue
+
+                if skip:
+                    dropped = min(skip, len(frames))
+                    frames, skip = frames[dropped:], skip - dropped
+                if replay is not None:
+                    replay.extend(frames)
+                    if not (closed or replay_done or len(replay) >= config.resume_window):
+                        continue
+                    frames, replay = _drop_overlap(history, replay), None
+                    ws.settimeout(config.recv_timeout)
+                if resume == 'tail':
+                    history.extend(frames)
+                if info is not None:
+                    info.bytes_in += sum(len(frame) for frame in frames)
+                    info.frames += len(frames)
+                if as_json and frames:
+                    frames = _loads_batch(frames, self.transport.codec.loads)
+                for frame in frames:
+                    delivered += 1
+                    yield frame
+                if closed:
+                    return
+        finally:
+            if ws is not None:
+                ws.close()
+            if info is not None:
+                self._finish_request(info)
+
+    def multiplex_websockets(self, targets, as_json=True, buffer_size=LOG_BUFFER_SIZE):
+        """Read many websockets from the calling thread.
+
+        :param targets: list of (tag, stream, url, params), one websocket for each.
+        :param buffer_size: max frames read ahead for one websocket, a websocket
+        with a full buffer isn't read until the caller catches up, leaving the
+        rest to tcp flow control.
+        :returns: generator of (tag, stream, frame) in the order frames arrive,
+        ends once every websocket is closed. Raises :class:`EruException` when
+        a websocket breaks, after the frames it sent before.
+        """
+        loads = self.transport.codec.loads
+        poller = _Poller()
+        buffered = {}
+        infos = {}
+        urls = {}
+        errors = {}
+        arrived = deque()
+        try:
+            for tag, stream, url, params in targets:
+                try:
+                    ws = websocket.create_connection(self.websocket_url(url, params),
+                                                     timeout=self.timeout)
+                except (websocket.WebSocketException, socket.error) as e:
+                    raise EruException(0, 'Can not connect to {0}: {1}'.format(url, e))
+                conn = (ws, tag, stream)
+                buffered[conn] = 0
+                urls[conn] = url
+                poller.register(ws.sock, conn)
+                infos[conn] = self._start_request('websocket', 'GET', url, params)
+
+            while arrived or buffered:
+                if not arrived:
+                    for conn in poller.select():
+                        ws, tag, stream = conn
+                        while True:
+                            error = None
+                            try:
+                                opcode, frame = ws.recv_data(control_frame=True)
+                            except websocket.WebSocketTimeoutException:
+                                # the rest of the frame is late, don't hold the others up
+                                break
+                            except (websocket.WebSocketException, socket.error) as e:
+                                opcode, frame = websocket.ABNF.OPCODE_CLOSE, None
+                                error = EruException(0, 'Websocket {0} broken: {1}'.format(urls[conn], e))
+                            if opcode == websocket.ABNF.OPCODE_CLOSE:
+                                # closed, frames already read are still delivered
+                                poller.unregister(ws.sock)
+                                ws.close()
+                                info = infos.pop(conn)
+                                if info is not None:
+                                    info.error = error
+                                    self._finish_request(info)
+                                if error is not None:
+                                    errors[conn] = error
+                                if not buffered[conn]:
+                                    del buffered[conn]
+                                    if error is not None:
+                                        raise error
+                                break
+                            # pings are answered by websocket-client, pongs have nothing for us
+                            if opcode in (websocket.ABNF.OPCODE_TEXT, websocket.ABNF.OPCODE_BINARY) and frame:
+                                if infos[conn] is not None:
+                                    infos[conn].bytes_in += len(frame)
+                                    infos[conn].frames += 1
+                                if six.PY3 and opcode == websocket.ABNF.OPCODE_TEXT:
+                                    frame = frame.decode('utf-8')
+                                arrived.append((conn, frame))
+                                buffered[conn] += 1
+                                if buffered[conn] >= buffer_size:
+                                    poller.unregister(ws.sock)
+                                    break
+                            # ssl may hold whole frames that select can't see
+                            pending = getattr(ws.sock, 'pending', None)
+                            if not pending or not pending():
+                                break
                     continue
-                if as_json:
-                    line = json.loads(line)
-                yield line
-            except (websocket.WebSocketException, socket.error):
-                break
+
+                conn, frame = arrived.popleft()
+                ws, tag, stream = conn
+                buffered[conn] -= 1
+                if ws.connected:
+                    if buffered[conn] == buffer_size - 1:
+                        poller.register(ws.sock, conn)
+                elif not buffered[conn]:
+                    del buffered[conn]
+                yield tag, stream, loads(frame) if as_json else frame
+                if conn in errors and not buffered.get(conn):
+                    raise errors[conn]
+        finally:
+            for ws, _, _ in buffered:
+                ws.close()
+            poller.close()
+            for info in infos.values():
+                if info is not None:
+                    self._finish_request(info)
+
+    def _as_records(self, record_type, records):
+        return _as_records(record_type, records)
+
+    def request_stream(self, url, params=None, record_type=None, chunk_size=STREAM_CHUNK_SIZE):
+        """GET a list endpoint and yield its records as they are decoded
+        from the socket, see :func:`iter_json_array`. The page is never
+        held in memory as a whole, raw or decoded, and decoding overlaps
+        with the transfer. Responses are not cached, and the stdlib decoder is
+        used whatever the codec of transport is.
+
+        :param record_type: a :class:`Record` subclass, to yield records instead of dicts.
+        :param chunk_size: bytes read from the socket at once.
+        """
+        params = dict(params or {})
+        params.setdefault('start', 0)
+        params.setdefault('limit', 20)
+        info = self._start_request('http', 'GET', url, params)
+        resp = None
+        try:
+            resp = self._send('GET', url, params, None, None, None, {}, info, stream=True)
+            if resp.status_code != 200:
+                r = self.transport.codec.loads(resp.content)
+                raise EruException(resp.status_code, r.get('error', 'Unknown error'))
+            for record in iter_json_array(self._read_chunks(resp, chunk_size, info)):
+                yield record_type.from_dict(record) if record_type is not None else record
+        except EruException as e:
+            if info is not None:
+                info.error = e
+            raise
+        except Exception as e:
+            error = EruException(0, '{url} responded: {msg}\n{params}'.format(
+                url=url, msg=getattr(e, 'message', e), params=params))
+            if info is not None:
+                info.error = error
+            raise error
+        finally:
+            if resp is not None:
+                resp.close()
+            if info is not None:
+                self._finish_request(info)
+
+    @staticmethod
+    def _read_chunks(resp, chunk_size, info):
+        for chunk in resp.iter_content(chunk_size):
+            if info is not None:
+                info.bytes_in += len(chunk)
+            yield chunk
+
+    def iter_pages(self, url, params=None, page_size=PAGE_SIZE, prefetch=PREFETCH_PAGES,
+                   record_type=None, stream=False):
+        """Iterate over every record of a paginated list endpoint.
+
+        Up to `prefetch` pages after the current one are fetched in background
+        threads while the caller consumes it, so at most `prefetch + 1` pages
+        are held in memory no matter how many records there are.
+        A page shorter than `page_size` ends the iteration.
+
+        :param url: url of the list endpoint, like `/api/app/appname/containers/`.
+        :param params: extra query params, `start` and `limit` are managed here.
+        :param page_size: how many records to fetch in one request.
+        :param prefetch: how many pages to fetch ahead, 0 fetches page by page.
+        :param record_type: a :class:`Record` subclass, to yield records instead of dicts.
+        :param stream: decode every page while it's read, see :meth:`request_stream`,
+        pages are then fetched one by one and `prefetch` is ignored.
+        """
+        params = dict(params or {})
+
+        def fetch(start):
+            page_params = dict(params, start=start, limit=page_size)
+            return _as_records(record_type, self.get(url, params=page_params))
+
+        if stream:
+            start = 0
+            while True:
+                n = 0
+                for record in self.request_stream(url, dict(params, start=start, limit=page_size),
+                                                  record_type):
+                    n += 1
+                    yield record
+                if n < page_size:
+                    return
+                start += page_size
+
+        if prefetch < 1:
+            start = 0
+            while True:
+                page = fetch(start)
+                for record in page:
+                    yield record
+                if len(page) < page_size:
+                    return
+                start += page_size
+
+        pool = multiprocessing_pool.ThreadPool(prefetch)
+        pending = deque()
+        next_start = 0
+        try:
+            for _ in range(prefetch):
+                pending.append(pool.apply_async(fetch, (next_start,)))
+                next_start += page_size
+            while pending:
+                page = pending.popleft().get()
+                if len(page) < page_size:
+                    # last page, requests still in flight are past the end
+                    for record in page:
+                        yield record
+                    return
+                pending.append(pool.apply_async(fetch, (next_start,)))
+                next_start += page_size
+                for record in page:
+                    yield record
+        finally:
+            # drop pages nobody is going to read, those in flight finish in the background
+            pool.terminate()
 
     def post(self, url, **kwargs):
         return self.request(url, 'POST', **kwargs)
@@ -92,7 +2044,10 @@ class EruClient(object):
         return self.request(url, 'PUT', **kwargs)
 
     def get(self, url, **kwargs):
-        return self.request(url, 'GET', **kwargs)
+        key = _single_flight_key(url, kwargs) if self.single_flight is not None else None
+        if key is None:
+            return self.request(url, 'GET', **kwargs)
+        return self.single_flight.do(key, lambda: self.request(url, 'GET', **kwargs))
 
     def delete(self, url, **kwargs):
         return self.request(url, 'DELETE', **kwargs)
@@ -181,6 +2136,10 @@ class EruClient(object):
         params = {'start': start, 'limit': limit}
         return self.get(url, params=params)
 
+    def iter_apps(self, page_size=PAGE_SIZE, prefetch=PREFETCH_PAGES):
+        """Iterate over all apps, see :meth:`iter_pages`."""
+        return self.iter_pages('/api/app/', page_size=page_size, prefetch=prefetch)
+
     def get_version(self, name, version):
         """Get version by name and version.
 
@@ -190,23 +2149,48 @@ class EruClient(object):
         url = '/api/app/{0}/{1}/'.format(name, version)
         return self.get(url)
 
-    def list_app_containers(self, name, start=0, limit=20):
+    def list_app_containers(self, name, start=0, limit=20, records=False, stream=False):
         """List all containers of this app.
 
         :param name: the name of app.
+        :param records: if set, return :class:`Container` records instead of dicts.
+        :param stream: if set, return a generator decoding containers as they
+        arrive, see :meth:`request_stream`.
         """
         url = '/api/app/{0}/containers/'.format(name)
         params = {'start': start, 'limit': limit}
-        return self.get(url, params=params)
+        if stream:
+            return self.request_stream(url, params, Container if records else None)
+        return self._as_records(Container if records else None, self.get(url, params=params))
+
+    def iter_app_containers(self, name, page_size=PAGE_SIZE, prefetch=PREFETCH_PAGES, records=False,
+                            stream=False):
+        """Iterate over all containers of this app, see :meth:`iter_pages`.
+
+        :param name: the name of app.
+        """
+        url = '/api/app/{0}/containers/'.format(name)
+        return self.iter_pages(url, page_size=page_size, prefetch=prefetch,
+                               record_type=Container if records else None, stream=stream)
 
-    def list_app_tasks(self, name, start=0, limit=20):
+    def list_app_tasks(self, name, start=0, limit=20, records=False):
         """List all containers of this app.
 
         :param name: the name of app.
+        :param records: if set, return :class:`Task` records instead of dicts.
         """
         url = '/api/app/{0}/tasks/'.format(name)
         params = {'start': start, 'limit': limit}
-        return self.get(url, params=params)
+        return self._as_records(Task if records else None, self.get(url, params=params))
+
+    def iter_app_tasks(self, name, page_size=PAGE_SIZE, prefetch=PREFETCH_PAGES, records=False):
+        """Iterate over all tasks of this app, see :meth:`iter_pages`.
+
+        :param name: the name of app.
+        """
+        url = '/api/app/{0}/tasks/'.format(name)
+        return self.iter_pages(url, page_size=page_size, prefetch=prefetch,
+                               record_type=Task if records else None)
 
     def list_app_images(self, name, start=0, limit=20):
         """List all containers of this app.
@@ -217,23 +2201,55 @@ class EruClient(object):
         params = {'start': start, 'limit': limit}
         return self.get(url, params=params)
 
-    def list_version_tasks(self, name, version, start=0, limit=20):
+    def iter_app_images(self, name, page_size=PAGE_SIZE, prefetch=PREFETCH_PAGES):
+        """Iterate over all images of this app, see :meth:`iter_pages`.
+
+        :param name: the name of app.
+        """
+        url = '/api/app/{0}/images/'.format(name)
+        return self.iter_pages(url, page_size=page_size, prefetch=prefetch)
+
+    def list_version_tasks(self, name, version, start=0, limit=20, records=False):
         """List all containers of this app.
 
         :param name: the name of app.
+        :param records: if set, return :class:`Task` records instead of dicts.
         """
         url = '/api/app/{0}/{1}/tasks/'.format(name, version)
         params = {'start': start, 'limit': limit}
-        return self.get(url, params=params)
+        return self._as_records(Task if records else None, self.get(url, params=params))
+
+    def iter_version_tasks(self, name, version, page_size=PAGE_SIZE, prefetch=PREFETCH_PAGES,
+                           records=False):
+        """Iterate over all tasks of this version, see :meth:`iter_pages`.
+
+        :param name: the name of app.
+        :param version: specific version of app, from git revision.
+        """
+        url = '/api/app/{0}/{1}/tasks/'.format(name, version)
+        return self.iter_pages(url, page_size=page_size, prefetch=prefetch,
+                               record_type=Task if records else None)
 
-    def list_version_containers(self, name, version, start=0, limit=20):
+    def list_version_containers(self, name, version, start=0, limit=20, records=False):
         """List all containers of this app.
 
         :param name: the name of app.
+        :param records: if set, return :class:`Container` records instead of dicts.
         """
         url = '/api/app/{0}/{1}/containers/'.format(name, version)
         params = {'start': start, 'limit': limit}
-        return self.get(url, params=params)
+        return self._as_records(Container if records else None, self.get(url, params=params))
+
+    def iter_version_containers(self, name, version, page_size=PAGE_SIZE, prefetch=PREFETCH_PAGES,
+                                records=False):
+        """Iterate over all containers of this version, see :meth:`iter_pages`.
+
+        :param name: the name of app.
+        :param version: specific version of app, from git revision.
+        """
+        url = '/api/app/{0}/{1}/containers/'.format(name, version)
+        return self.iter_pages(url, page_size=page_size, prefetch=prefetch,
+                               record_type=Container if records else None)
 
     def deploy_private(self, pod_name, app_name, ncore, ncontainer, version,
                        entrypoint, env, network_ids, ports=None,
@@ -329,6 +2345,49 @@ class EruClient(object):
 
         return self.post(url, json=payload)
 
+    def _get_callback_server(self):
+        with self._callback_lock:
+            if self.callback_server is None:
+                self.callback_server = CallbackServer(_local_address(self.router.pick().url))
+            return self.callback_server.start()
+
+    def submit_deploy_private(self, pod_name, app_name, ncore, ncontainer, version,
+                              entrypoint, env, network_ids, **kwargs):
+        """:meth:`deploy_private` with a callback url of `callback_server`,
+        which is expected to be called once for every container.
+
+        e.g.::
+
+            >>> future = eru_client.submit_deploy_private('pod', 'appname', 1, \
+            ...     10, '3def4a6', 'web', 'prod', [1, 2])
+            >>> future.result(callback_timeout=60)
+
+        Other arguments are the same as :meth:`deploy_private`.
+        :returns: :class:`DeployFuture`.
+        """
+        server = self._get_callback_server()
+        waiter = server.register(expected=ncontainer)
+        try:
+            resp = self.deploy_private(pod_name, app_name, ncore, ncontainer, version, entrypoint,
+                                       env, network_ids, callback_url=waiter.url, **kwargs)
+        except Exception:
+            server.unregister(waiter)
+            raise
+        return DeployFuture(self, server, waiter, resp)
+
+    def submit_deploy_public(self, pod_name, app_name, ncontainer, version, entrypoint, env,
+                             network_ids, **kwargs):
+        """:meth:`deploy_public` with a callback url, see :meth:`submit_deploy_private`."""
+        server = self._get_callback_server()
+        waiter = server.register(expected=ncontainer)
+        try:
+            resp = self.deploy_public(pod_name, app_name, ncontainer, version, entrypoint, env,
+                                      network_ids, callback_url=waiter.url, **kwargs)
+        except Exception:
+            server.unregister(waiter)
+            raise
+        return DeployFuture(self, server, waiter, resp)
+
     def build_image(self, pod_name, app_name, base, version):
         """Build docker image for app.
 
@@ -355,7 +2414,7 @@ class EruClient(object):
     def build_log(self, task_id):
         """Get build log for task_id. returns a generator"""
         url = '/websockets/tasklog/{0}/'.format(task_id)
-        return self.request_websocket(url)
+        return self.request_websocket(url, resume='count')
 
     def container_log(self, container_id, stdout=0, stderr=0, tail=0):
         """Get container log. returns a generator.
@@ -371,7 +2430,42 @@ class EruClient(object):
             'stderr': stderr,
             'tail': tail,
         }
-        return self.request_websocket(url, as_json=False, params=params)
+        return self.request_websocket(url, as_json=False, params=params,
+                                      resume='tail' if tail else 'count')
+
+    def stream_logs(self, container_ids, stdout=1, stderr=1, tail=0, buffer_size=LOG_BUFFER_SIZE):
+        """Follow logs of many containers from one thread. returns a generator.
+
+        e.g.::
+
+            >>> for container_id, stream, line in eru_client.stream_logs(ids, tail=10):
+            ...     print(container_id[:7], stream, line)
+
+        :param container_ids: container_id of containers.
+        :param stdout: if set, will get stdout logs, tagged `stdout`.
+        :param stderr: if set, will get stderr logs, tagged `stderr`.
+        :param tail: if set, `tail` lines will be shown, just like tail -n.
+        :param buffer_size: see :meth:`multiplex_websockets`.
+        """
+        targets = []
+        for container_id in container_ids:
+            url = '/websockets/containerlog/{0}/'.format(container_id)
+            for stream, enabled in (('stdout', stdout), ('stderr', stderr)):
+                if enabled:
+                    params = {
+                        'stdout': int(stream == 'stdout'),
+                        'stderr': int(stream == 'stderr'),
+                        'tail': tail,
+                    }
+                    targets.append((container_id, stream, url, params))
+        return self.multiplex_websockets(targets, as_json=False, buffer_size=buffer_size)
+
+    def stream_build_logs(self, task_ids, buffer_size=LOG_BUFFER_SIZE):
+        """Follow build logs of many tasks from one thread. returns a generator
+        of (task_id, 'build', log)."""
+        targets = [(task_id, 'build', '/websockets/tasklog/{0}/'.format(task_id), None)
+                   for task_id in task_ids]
+        return self.multiplex_websockets(targets, buffer_size=buffer_size)
 
     def offline_version(self, pod_name, app_name, version):
         """Offline specific version of app."""
@@ -391,7 +2485,7 @@ class EruClient(object):
 
     def version(self):
         url = '/'
-        return self.get(url, as_json=False)
+        return self.get(url)
 
     def kill_container(self, container_id):
         """Kill a container, it will be shown as dead in ERU."""
@@ -471,10 +2565,10 @@ class EruClient(object):
         }
         return self.post(url, json=payload, expected_code=201)
 
-    def list_network(self, start=0, limit=20):
+    def list_network(self, start=0, limit=20, records=False):
         """List all available networks"""
         url = '/api/network/list/'
-        return self.get(url)
+        return self._as_records(Network if records else None, self.get(url))
 
     def bind_container_network(self, appname, container_id, network_names):
         url = '/api/container/%s/bind_network' % container_id
@@ -488,19 +2582,38 @@ class EruClient(object):
         url = '/api/network/{0}/'.format(id_or_name)
         return self.get(url)
 
-    def list_app_versions(self, app, start=0, limit=20):
+    def list_app_versions(self, app, start=0, limit=20, records=False):
         params = {'start': start, 'limit': limit}
-        return self.get('/api/app/%s/versions/' % app, params=params)
+        versions = self.get('/api/app/%s/versions/' % app, params=params)
+        return self._as_records(AppVersion if records else None, versions)
 
-    def list_pods(self, start=0, limit=20):
+    def iter_app_versions(self, app, page_size=PAGE_SIZE, prefetch=PREFETCH_PAGES, records=False):
+        return self.iter_pages('/api/app/%s/versions/' % app,
+                               page_size=page_size, prefetch=prefetch,
+                               record_type=AppVersion if records else None)
+
+    def list_pods(self, start=0, limit=20, records=False):
         params = {'start': start, 'limit': limit}
-        return self.get('/api/pod/list/', params=params)
+        pods = self.get('/api/pod/list/', params=params)
+        return self._as_records(Pod if records else None, pods)
+
+    def iter_pods(self, page_size=PAGE_SIZE, prefetch=PREFETCH_PAGES, records=False):
+        return self.iter_pages('/api/pod/list/', page_size=page_size, prefetch=prefetch,
+                               record_type=Pod if records else None)
 
-    def list_pod_hosts(self, pod_name_or_id, start=0, limit=20, show_all=False):
+    def list_pod_hosts(self, pod_name_or_id, start=0, limit=20, show_all=False, records=False):
         params = {'start': start, 'limit': limit}
         if show_all:
             params['all'] = 1
-        return self.get('/api/pod/{0}/hosts/'.format(pod_name_or_id), params=params)
+        hosts = self.get('/api/pod/{0}/hosts/'.format(pod_name_or_id), params=params)
+        return self._as_records(Host if records else None, hosts)
+
+    def iter_pod_hosts(self, pod_name_or_id, show_all=False,
+                       page_size=PAGE_SIZE, prefetch=PREFETCH_PAGES, records=False):
+        params = {'all': 1} if show_all else {}
+        return self.iter_pages('/api/pod/{0}/hosts/'.format(pod_name_or_id), params=params,
+                               page_size=page_size, prefetch=prefetch,
+                               record_type=Host if records else None)
 
     def get_pod(self, id_or_name):
         return self.get('/api/pod/{0}/'.format(id_or_name))
@@ -522,9 +2635,19 @@ class EruClient(object):
         and containers on this host will be shown as alive."""
         return self.put('/api/host/{0}/cure/'.format(host_name))
 
-    def list_host_containers(self, host_name, start=0, limit=20):
+    def list_host_containers(self, host_name, start=0, limit=20, records=False, stream=False):
         params = {'start': start, 'limit': limit}
-        return self.get('/api/host/{0}/containers/'.format(host_name), params=params)
+        url = '/api/host/{0}/containers/'.format(host_name)
+        if stream:
+            return self.request_stream(url, params, Container if records else None)
+        containers = self.get(url, params=params)
+        return self._as_records(Container if records else None, containers)
+
+    def iter_host_containers(self, host_name, page_size=PAGE_SIZE, prefetch=PREFETCH_PAGES, records=False,
+                             stream=False):
+        return self.iter_pages('/api/host/{0}/containers/'.format(host_name),
+                               page_size=page_size, prefetch=prefetch,
+                               record_type=Container if records else None, stream=stream)
 
     def get_task(self, task_id):
         return self.get('/api/task/{0}/'.format(task_id))
@@ -532,6 +2655,128 @@ class EruClient(object):
     def get_task_log(self, task_id):
         return self.get('/api/task/{0}/log/'.format(task_id))
 
+    def wait_for_tasks(self, task_ids, timeout=None, interval=TASK_POLL_INTERVAL,
+                       max_interval=TASK_POLL_MAX_INTERVAL, concurrency=BULK_CONCURRENCY,
+                       watch_logs=False):
+        """Wait for tasks to finish, yielding each task as soon as it's finished.
+
+        Unfinished tasks are polled together, `concurrency` of them at a time.
+        The polling interval starts at `interval` and doubles, up to
+        `max_interval`, after every round finishing no task, so long deploys
+        don't hammer ERU and short ones aren't delayed. With `watch_logs`, the
+        tasklog websocket of each task is followed in a background thread and
+        a task is polled as soon as its websocket closes, which ERU does once
+        the task is finished, the others are polled every `max_interval`.
+
+        e.g.::
+
+            >>> for task in eru_client.wait_for_tasks(resp['tasks'], timeout=600):
+            ...     print(task['id'], task['result'])
+
+        :param task_ids: ids of tasks, like the `tasks` of :meth:`deploy_private`.
+        :param timeout: seconds to wait for all the tasks, EruException is raised
+        once it's exceeded.
+        :param watch_logs: follow tasklog websockets, for build tasks mostly.
+        """
+        pending = set(task_ids)
+        deadline = time.time() + timeout if timeout is not None else None
+        woken = threading.Event()
+        closed = deque()
+        stop = threading.Event()
+
+        def on_closed(task_id):
+            closed.append(task_id)
+            woken.set()
+
+        if watch_logs and pending:
+            watcher = threading.Thread(target=self._watch_tasklogs, args=(list(pending), on_closed, stop))
+            watcher.daemon = True
+            watcher.start()
+            # polling is only the fallback of websockets failing to connect
+            interval = max_interval
+
+        delay = interval
+        next_round = time.time()
+        try:
+            while pending:
+                now = time.time()
+                if deadline is not None and now >= deadline:
+                    raise EruException(0, '{0} tasks not finished in {1}s'.format(len(pending), timeout))
+                full_round = now >= next_round
+                if full_round:
+                    batch = list(pending)
+                else:
+                    batch = set()
+                    while closed:
+                        batch.add(closed.popleft())
+                    batch = [task_id for task_id in batch if task_id in pending]
+
+                finished = 0
+                for result in self.bulk(self.get_task, batch, min(concurrency, len(batch))):
+                    if result.error is not None:
+                        if result.error.code == 404:
+                            raise result.error
+                        # try again in the next round
+                        continue
+                    if result.result.get('finished'):
+                        pending.discard(result.key)
+                        finished += 1
+                        yield result.result
+
+                if full_round:
+                    if finished:
+                        delay = interval
+                    next_round = time.time() + delay
+                    if not finished:
+                        delay = min(delay * 2, max_interval)
+                wait = next_round - time.time()
+                if deadline is not None:
+                    wait = min(wait, deadline - time.time())
+                if pending and wait > 0 and not closed:
+                    woken.wait(wait)
+                woken.clear()
+        finally:
+            stop.set()
+
+    def _watch_tasklogs(self, task_ids, closed, stop):
+        """Read the tasklog websockets of `task_ids` until `stop` is set,
+        `closed(task_id)` is called when one of them is closed."""
+        poller = _Poller()
+        conns = {}
+        try:
+            for task_id in task_ids:
+                if stop.is_set():
+                    return
+                url = self.websocket_url('/websockets/tasklog/{0}/'.format(task_id))
+                try:
+                    ws = websocket.create_connection(url, timeout=self.timeout)
+                except (websocket.WebSocketException, socket.error):
+                    # polling still finds it
+                    continue
+                conns[task_id] = ws
+                poller.register(ws.sock, task_id)
+
+            while conns and not stop.is_set():
+                for task_id in poller.select(0.5):
+                    ws = conns[task_id]
+                    try:
+                        # a ping must not wait for a data frame, pings are answered for us
+                        opcode, _ = ws.recv_data(control_frame=True)
+                    except websocket.WebSocketTimeoutException:
+                        # the rest of the frame is late, read it on the next round
+                        continue
+                    except (websocket.WebSocketException, socket.error):
+                        opcode = websocket.ABNF.OPCODE_CLOSE
+                    if opcode == websocket.ABNF.OPCODE_CLOSE:
+                        poller.unregister(ws.sock)
+                        ws.close()
+                        del conns[task_id]
+                        closed(task_id)
+        finally:
+            for ws in conns.values():
+                ws.close()
+            poller.close()
+
     def add_eip(self, *eips):
         payload = list(eips)
         return self.post('/api/network/add_eip/', json=payload, expected_code=201)
@@ -561,8 +2806,138 @@ class EruClient(object):
         url = '/api/container/{0}/release_eip/'.format(container_id)
         return self.put(url)
 
+    def bulk(self, func, keys, concurrency=BULK_CONCURRENCY):
+        """Call `func(key)` for each of `keys` with at most `concurrency` calls
+        in flight over the shared session.
+
+        Yields :class:`BulkResult` in the order calls complete, a call raising
+        :class:`EruException` is yielded with `error` set and doesn't stop the
+        others.
+
+        e.g.::
+
+            >>> failed = [r for r in eru_client.bulk(eru_client.stop_container, ids) if r.error]
+        """
+        def call(key):
+            try:
+                return BulkResult(key, func(key), None)
+            except EruException as e:
+                return BulkResult(key, None, e)
+        return _run_concurrently(call, keys, concurrency)
+
+    def kill_containers(self, container_ids, concurrency=BULK_CONCURRENCY):
+        """Bulk :meth:`kill_container`, see :meth:`bulk`."""
+        return self.bulk(self.kill_container, container_ids, concurrency)
+
+    def cure_containers(self, container_ids, concurrency=BULK_CONCURRENCY):
+        """Bulk :meth:`cure_container`, see :meth:`bulk`."""
+        return self.bulk(self.cure_container, container_ids, concurrency)
+
+    def start_containers(self, container_ids, concurrency=BULK_CONCURRENCY):
+        """Bulk :meth:`start_container`, see :meth:`bulk`."""
+        return self.bulk(self.start_container, container_ids, concurrency)
+
+    def stop_containers(self, container_ids, concurrency=BULK_CONCURRENCY):
+        """Bulk :meth:`stop_container`, see :meth:`bulk`."""
+        return self.bulk(self.stop_container, container_ids, concurrency)
+
+    def poll_containers(self, container_ids, concurrency=BULK_CONCURRENCY):
+        """Bulk :meth:`poll_container`, see :meth:`bulk`."""
+        return self.bulk(self.poll_container, container_ids, concurrency)
+
+    def get_containers(self, ids_or_sha256s, concurrency=BULK_CONCURRENCY):
+        """Bulk :meth:`get_container`, see :meth:`bulk`."""
+        return self.bulk(self.get_container, ids_or_sha256s, concurrency)
+
+    def bind_containers_eip(self, container_eips, concurrency=BULK_CONCURRENCY):
+        """Bulk :meth:`bind_container_eip`, see :meth:`bulk`.
+
+        :param container_eips: iterable of (container_id, eip) pairs, they are
+        the `key` of the results.
+        """
+        def bind(container_eip):
+            return self.bind_container_eip(*container_eip)
+        return self.bulk(bind, container_eips, concurrency)
+
+    def sync_envs(self, desired_state, concurrency=BULK_CONCURRENCY, dry_run=False, prune=False):
+        """Make app envs match `desired_state` with as few requests as possible.
+
+        e.g.::
+
+            >>> report = eru_client.sync_envs({'appname': {'prod': {'MYSQL_HOST': 'db'}, 'test': None}})
+            >>> [(c.app, c.env, c.action) for c in report.changes]
+            [('appname', 'prod', 'update'), ('appname', 'test', 'delete')]
+
+        Names and contents of the current envs of the apps are fetched
+        concurrently, only envs whose content differs are set, with their
+        whole content as :meth:`set_app_env` does, and envs mapped to None are
+        deleted. Apps not in `desired_state` are left alone, so are apps whose
+        envs couldn't be fetched.
+
+        :param desired_state: dict of app name => {env name => {key: value} or None}.
+        :param concurrency: how many requests to have in flight.
+        :param dry_run: if set, compute the changes and send nothing.
+        :param prune: also delete envs of these apps missing from `desired_state`,
+        off by default so that a partial `desired_state` deletes nothing.
+        :returns: :class:`EnvSyncReport`.
+        """
+        report = EnvSyncReport()
+        names = {}
+        for r in self.bulk(self.list_app_env_names, list(desired_state), concurrency):
+            if r.error is not None:
+                report.changes.append(EnvChange(r.key, None, 'fetch', [], [], [], r.error))
+            else:
+                names[r.key] = set((r.result or {}).get('data') or ())
+
+        contents = {}
+        for r in self.bulk(self._fetch_env, _envs_to_fetch(desired_state, names), concurrency):
+            if r.error is not None:
+                report.changes.append(EnvChange(r.key[0], r.key[1], 'fetch', [], [], [], r.error))
+                names.pop(r.key[0], None)
+            else:
+                contents[r.key] = r.result or {}
+
+        changes = _plan_env_sync(desired_state, names, contents, prune, report)
+        if dry_run:
+            report.changes.extend(changes)
+            return report
+
+        def apply(change):
+            return self._apply_env_change(change, desired_state)
+
+        for r in self.bulk(apply, changes, concurrency):
+            report.changes.append(r.key._replace(error=r.error))
+        return report
+
+    def _fetch_env(self, app_env):
+        return self.list_app_env_content(*app_env)
+
+    def _apply_env_change(self, change, desired_state):
+        if change.action == 'delete':
+            return self.delete_app_env(change.app, change.env)
+        content = _env_content(desired_state[change.app][change.env])
+        if 'env' in content:
+            # the env name is sent under this key
+            raise EruException(0, "env key 'env' can't be set through the ERU API")
+        # not set_app_env, keys may be named like its arguments
+        payload = dict(content, env=change.env)
+        return self.put('/api/app/{0}/env/'.format(change.app), json=payload)
+
+    def plan_scale_out(self, app_name, ncore=None, ncontainer=None, pod_name=None,
+                       ceiling=50, entrypoints=()):
+        """Plan a :meth:`scale_out` from all containers of app without deploying
+        anything, returns a :class:`ScalePlan`."""
+        index = ContainerIndex(self.iter_app_containers(app_name), entrypoints)
+        return _plan_scale_out(app_name, index, ncore, ncontainer, pod_name, ceiling)
+
+    def plan_scale_in(self, app_name, ncontainer, pod_names=None, entrypoints=(), floor=2):
+        """Plan a :meth:`scale_in` from all containers of app without removing
+        anything, returns a :class:`ScalePlan`."""
+        index = ContainerIndex(self.iter_app_containers(app_name), entrypoints)
+        return _plan_scale_in(app_name, index, ncontainer, pod_names, floor)
+
     def scale_out(self, app_name, ncore=None, ncontainer=None, pod_name=None,
-                  ceiling=50, entrypoints=()):
+                  ceiling=50, entrypoints=(), dry_run=False, concurrency=1):
         """
         :param app_name: str, eru app name
         :param ncore: int, if not provided, use the most common ncore
@@ -571,90 +2946,1045 @@ class EruClient(object):
         :param ceiling: int, max ncontainer
         :param pod_name: str, if not specified, use the most common pod
         :param entrypoints: tuple, if specified, only scale these entrypoints
+        :param dry_run: bool, if set, return the :class:`ScalePlan` and deploy nothing
+        :param concurrency: int, how many groups to deploy at the same time
+        :returns: list of :class:`DeployResult`, see :meth:`execute_scale_out`
         """
-        containers = self.list_app_containers(app_name, start=0, limit=100)
-        if entrypoints:
-            containers = [c for c in containers if c['entrypoint'] in entrypoints]
+        plan = self.plan_scale_out(app_name, ncore, ncontainer, pod_name, ceiling, entrypoints)
+        if dry_run:
+            return plan
+        return self.execute_scale_out(plan, concurrency)
+
+    def execute_scale_out(self, plan, concurrency=1):
+        """Deploy every group of a scale out :class:`ScalePlan`.
+
+        :param concurrency: how many `deploy_private` to run at the same time.
+        :returns: list of :class:`DeployResult`, in the order of `plan.deploys`,
+        failed deploys are reported in it rather than raised.
+        """
+        def deploy(i):
+            group, args = plan.deploys[i], deploy_args[i]
+            started = time.time()
+            try:
+                resp = self.deploy_private(*args)
+            except EruException as e:
+                return i, DeployResult(group, False, [], time.time() - started, e)
+            task_ids = resp.get('tasks', []) if isinstance(resp, dict) else []
+            return i, DeployResult(group, bool(resp), task_ids, time.time() - started, None)
+
+        deploy_args = plan.deploy_args()
+        report = [None] * len(deploy_args)
+        for i, result in _run_concurrently(deploy, range(len(deploy_args)), concurrency):
+            report[i] = result
+        return report
+
+    def scale_in(self, app_name, ncontainer, pod_names=None, entrypoints=(), floor=2,
+                 dry_run=False):
+        """in rare conditions, app are deploy across different pods, specify pods to kill"""
+        plan = self.plan_scale_in(app_name, ncontainer, pod_names, entrypoints, floor)
+        if dry_run:
+            return plan
+        return self.remove_containers(plan.to_remove)
+
+
+def _run_concurrently(func, items, concurrency):
+    """Yield `func(item)` for each of `items` as soon as it's done, running at
+    most `concurrency` of them at the same time in threads. `func` is
+    expected to report its errors in the return value rather than raise.
+
+    Items are taken from `items` only when a thread is free, so a caller
+    stopping early, like an operator aborting a mass stop, leaves the rest
+    of them alone."""
+    if concurrency <= 1:
+        for item in items:
+            yield func(item)
+        return
+
+    done = queue.Queue()
+
+    def call(item):
+        try:
+            done.put((func(item), None))
+        except BaseException:
+            done.put((None, sys.exc_info()))
+
+    items = iter(items)
+    pool = multiprocessing_pool.ThreadPool(concurrency)
+    running = 0
+    try:
+        for item in itertools.islice(items, concurrency):
+            pool.apply_async(call, (item,))
+            running += 1
+        while running:
+            result, exc_info = done.get()
+            running -= 1
+            for item in itertools.islice(items, 1):
+                pool.apply_async(call, (item,))
+                running += 1
+            if exc_info is not None:
+                six.reraise(*exc_info)
+            yield result
+    finally:
+        # nothing is queued, calls in flight finish in the background
+        pool.terminate()
+
+
+def _container_group_key(c):
+    return c['version'], c['entrypoint'], c['env']
+
+
+def _container_created(c):
+    return c['created']
+
+
+class ContainerIndex(object):
+    """Containers of an app indexed in a single pass.
+
+    Containers in removal are kept in `containers` and `by_pod`, but left out
+    of `by_group` and `by_host`, they are neither scaled out nor scaled in.
+
+    :param containers: iterable of container dicts, like :meth:`EruClient.iter_app_containers`.
+    :param entrypoints: if specified, only index containers of these entrypoints.
+    """
+
+    def __init__(self, containers, entrypoints=()):
+        self.containers = []
+        self.by_group = defaultdict(list)
+        self.by_pod = defaultdict(list)
+        self.by_host = defaultdict(list)
+        self._by_created = None
 
-        container_groups = defaultdict(list)
-        # 理论上同样版本同样入口同样环境的容器应该都相同
         for c in containers:
+            if entrypoints and c['entrypoint'] not in entrypoints:
+                continue
+            self.containers.append(c)
+            self.by_pod[c['podname']].append(c)
             if c['in_removal']:
                 continue
-            container_groups[(c['version'], c['entrypoint'], c['env'])].append(c)
+            self.by_group[_container_group_key(c)].append(c)
+            self.by_host[c.get('hostname')].append(c)
+
+    def __len__(self):
+        return len(self.containers)
+
+    @property
+    def by_created(self):
+        """All indexed containers, eldest first."""
+        if self._by_created is None:
+            self._by_created = sorted(self.containers, key=_container_created)
+        return self._by_created
+
+    def most_common_pod(self):
+        if not self.by_pod:
+            return None
+        return max(self.by_pod, key=lambda pod_name: len(self.by_pod[pod_name]))
+
+    def groups(self, pod_names=None):
+        """Yield ((version, entrypoint, env), containers) of active containers,
+        only containers in `pod_names` are kept if it's specified."""
+        for key, group in six.iteritems(self.by_group):
+            if pod_names:
+                group = [c for c in group if c['podname'] in pod_names]
+                if not group:
+                    continue
+            yield key, group
+
+    @staticmethod
+    def eldest(containers, n):
+        return heapq.nsmallest(n, containers, key=_container_created)
+
+
+ScaleOutGroup = namedtuple('ScaleOutGroup', ['version', 'entrypoint', 'env', 'ncore',
+                                             'ncontainer', 'current_ncontainer', 'networks'])
 
-        if not pod_name:
-            # pick the pod that occurs the most, and scale only within that pod
-            counter = Counter([c['podname'] for c in containers])
-            pod_name = counter.most_common()[0][0]
+BulkResult = namedtuple('BulkResult', ['key', 'result', 'error'])
+DeployResult = namedtuple('DeployResult', ['group', 'success', 'task_ids', 'latency', 'error'])
+# `action` is create, update, delete, or fetch when the current env couldn't be read,
+# `added`, `changed` and `removed` are keys, never values
+EnvChange = namedtuple('EnvChange', ['app', 'env', 'action', 'added', 'changed', 'removed', 'error'])
 
-        def calculate_ncontainer(current_ncontainer, ncontainer, ceiling):
-            ncontainer = ncontainer if ncontainer else current_ncontainer
-            will_reach_ncontainer = current_ncontainer + ncontainer
 
-            if will_reach_ncontainer <= ceiling:
-                should_add = ncontainer
+class EnvSyncReport(object):
+    """What :meth:`EruClient.sync_envs` did, or would do with `dry_run`.
+
+    :param changes: list of :class:`EnvChange`, failed ones have `error` set.
+    :param unchanged: list of (app, env) already as desired.
+    """
+
+    def __init__(self, changes=None, unchanged=None):
+        self.changes = changes or []
+        self.unchanged = unchanged or []
+
+    @property
+    def failed(self):
+        return [c for c in self.changes if c.error is not None]
+
+    def summary(self):
+        """Count of changes by action, with `failed` and `unchanged`."""
+        counts = defaultdict(int)
+        for c in self.changes:
+            counts[c.action] += 1
+        counts['failed'] = len(self.failed)
+        counts['unchanged'] = len(self.unchanged)
+        return dict(counts)
+
+    def __repr__(self):
+        return '<EnvSyncReport changes:%s failed:%s unchanged:%s>' % (
+            len(self.changes), len(self.failed), len(self.unchanged))
+
+
+def _env_content(content):
+    # ERU keeps env values as strings
+    return dict((k, v if isinstance(v, six.string_types) else six.text_type(v))
+                for k, v in six.iteritems(content))
+
+
+def _diff_env(current, desired):
+    """Sorted (added, changed, removed) keys from `current` to `desired`."""
+    added = sorted(k for k in desired if k not in current)
+    changed = sorted(k for k in desired if k in current and current[k] != desired[k])
+    removed = sorted(k for k in current if k not in desired)
+    return added, changed, removed
+
+
+def _envs_to_fetch(desired_state, names):
+    """(app, env) whose current content has to be read to diff it."""
+    return [(app, env) for app, current in six.iteritems(names)
+            for env, content in six.iteritems(desired_state[app])
+            if content is not None and env in current]
+
+
+def _plan_env_sync(desired_state, names, contents, prune, report):
+    """The :class:`EnvChange` needed, envs already as desired go to `report.unchanged`.
+
+    :param names: dict of app => set of its current env names.
+    :param contents: dict of (app, env) => current content.
+    """
+    changes = []
+    for app, current in six.iteritems(names):
+        desired = desired_state[app]
+        for env, content in six.iteritems(desired):
+            if content is None:
+                if env in current:
+                    changes.append(EnvChange(app, env, 'delete', [], [], [], None))
+                continue
+            content = _env_content(content)
+            if env not in current:
+                changes.append(EnvChange(app, env, 'create', sorted(content), [], [], None))
+                continue
+            added, changed, removed = _diff_env(_env_content(contents[(app, env)]), content)
+            if added or changed or removed:
+                changes.append(EnvChange(app, env, 'update', added, changed, removed, None))
             else:
-                should_add = ceiling - current_ncontainer
-
-            if should_add < 1:
-                raise EruException(500, 'current_ncontainer={} will scale by {}, reached ceiling {}'.format(current_ncontainer, should_add, ceiling))
-
-            return should_add
-
-        report = []
-        for (version, entrypoint, env), container_group in container_groups.iteritems():
-            sample_container = container_group[0]
-            networks = []
-            for n in sample_container['networks']:
-                net = IPNetwork(n['vlan_address'])
-                ip = str(IPAddress(net.first))
-                networks.append(ip)
-
-            # if ncontainer isn't specified, just double it
-            current_ncontainer = len(container_group)
-            _ncontainer = calculate_ncontainer(current_ncontainer, ncontainer, ceiling)
-
-            # if ncore isn't specified, copy from sample_container
-            _ncore = ncore if ncore else len(sample_container['cores']['full'])
-            success = self.deploy_private(pod_name,
-                                          app_name,
-                                          _ncore,
-                                          _ncontainer,
-                                          version,
-                                          entrypoint,
-                                          env,
-                                          networks)
-            report.append(success)
-
-        if not all(report):
-            raise EruException(500, 'error during scaling, go check karazhan')
-        # TODO: should be able to infer task success from return value
-        return report
+                report.unchanged.append((app, env))
+        if prune:
+            for env in sorted(current - set(desired)):
+                changes.append(EnvChange(app, env, 'delete', [], [], [], None))
+    return changes
 
-    def scale_in(self, app_name, ncontainer, pod_names=None, entrypoints=(), floor=2):
-        """in rare conditions, app are deploy across different pods, specify pods to kill"""
-        containers = self.list_app_containers(app_name, start=0, limit=100)
-        if entrypoints:
-            containers = [c for c in containers if c['entrypoint'] in entrypoints]
 
-        pod_names = [pod_names] if isinstance(pod_names, six.string_types) else pod_names
-        if pod_names:
-            containers = [c for c in containers if c['entrypoint'] in entrypoints]
+class ScalePlan(object):
+    """What :meth:`EruClient.scale_out` or :meth:`EruClient.scale_in` is going to do.
+
+    :param deploys: list of :class:`ScaleOutGroup`, one `deploy_private` for each.
+    :param to_remove: list of container ids to remove.
+    """
+
+    def __init__(self, app_name, pod_name=None, deploys=None, to_remove=None):
+        self.app_name = app_name
+        self.pod_name = pod_name
+        self.deploys = deploys or []
+        self.to_remove = to_remove or []
+
+    def deploy_args(self):
+        """Positional arguments of `deploy_private` for each deploy."""
+        return [(self.pod_name, self.app_name, g.ncore, g.ncontainer,
+                 g.version, g.entrypoint, g.env, g.networks) for g in self.deploys]
+
+    def __repr__(self):
+        return '<ScalePlan app:%s pod:%s deploys:%s to_remove:%s>' % (
+            self.app_name, self.pod_name, len(self.deploys), len(self.to_remove))
+
 
-        container_groups = defaultdict(list)
+_VLAN_GATEWAYS = {}
+_VLAN_GATEWAYS_SIZE = 4096
+
+
+def _vlan_gateway(vlan_address):
+    """First address of the network of `vlan_address`, like `10.1.0.0` for
+    `10.1.2.3/16`, memoized as containers of a network share few prefixes."""
+    gateway = _VLAN_GATEWAYS.get(vlan_address)
+    if gateway is None:
+        gateway = str(netaddr.IPAddress(netaddr.IPNetwork(vlan_address).first))
+        if len(_VLAN_GATEWAYS) >= _VLAN_GATEWAYS_SIZE:
+            _VLAN_GATEWAYS.clear()
+        _VLAN_GATEWAYS[vlan_address] = gateway
+    return gateway
+
+
+def _plan_scale_out(app_name, index, ncore, ncontainer, pod_name, ceiling):
+    if not pod_name:
+        # pick the pod that occurs the most, and scale only within that pod
+        pod_name = index.most_common_pod()
+
+    def calculate_ncontainer(current_ncontainer, ncontainer, ceiling):
+        ncontainer = ncontainer if ncontainer else current_ncontainer
+        will_reach_ncontainer = current_ncontainer + ncontainer
+
+        if will_reach_ncontainer <= ceiling:
+            should_add = ncontainer
+        else:
+            should_add = ceiling - current_ncontainer
+
+        if should_add < 1:
+            raise EruException(500, 'current_ncontainer={} will scale by {}, reached ceiling {}'.format(current_ncontainer, should_add, ceiling))
+
+        return should_add
+
+    deploys = []
+    # 理论上同样版本同样入口同样环境的容器应该都相同
+    for (version, entrypoint, env), container_group in index.groups():
+        sample_container = container_group[0]
+        networks = [_vlan_gateway(n['vlan_address']) for n in sample_container['networks']]
+
+        # if ncontainer isn't specified, just double it
+        current_ncontainer = len(container_group)
+        _ncontainer = calculate_ncontainer(current_ncontainer, ncontainer, ceiling)
+
+        # if ncore isn't specified, copy from sample_container
+        _ncore = ncore if ncore else len(sample_container['cores']['full'])
+        deploys.append(ScaleOutGroup(version, entrypoint, env, _ncore, _ncontainer,
+                                     current_ncontainer, networks))
+    return ScalePlan(app_name, pod_name, deploys=deploys)
+
+
+def _plan_scale_in(app_name, index, ncontainer, pod_names, floor):
+    pod_names = [pod_names] if isinstance(pod_names, six.string_types) else pod_names
+
+    to_remove = []
+    for key, container_group in index.groups(pod_names):
+        current_ncontainer = len(container_group)
+        if current_ncontainer <= floor or current_ncontainer <= ncontainer:
+            # there's nothing to scale in
+            continue
+        # kill the most `ncontainer` eldest containers
+        eldest_containers = index.eldest(container_group, ncontainer)
+        to_remove.extend([c['container_id'] for c in eldest_containers])
+    return ScalePlan(app_name, to_remove=to_remove)
+
+
+RELEASE_STAGES = ('build', 'deploy', 'poll')
+
+ReleaseSpec = namedtuple('ReleaseSpec', ['app_name', 'version', 'base', 'build_pod', 'deploys'])
+StageTiming = namedtuple('StageTiming', ['stage', 'app_name', 'started', 'latency', 'error'])
+
+
+class ReleaseResult(object):
+    """What happened to one :class:`ReleaseSpec` in a :class:`Release`."""
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.build_task = None
+        self.build_log = deque(maxlen=100)
+        self.deploys = []
+        self.tasks = []
+        self.containers = []
+        self.errors = []
+        self.timings = []
+
+    @property
+    def ok(self):
+        return not self.errors
+
+
+class Release(object):
+    """Build, deploy and poll many apps at once, each stage with its own
+    bounded concurrency. An app is deployed as soon as its image is built,
+    while other builds are still running, and its containers are polled as
+    soon as its deploy tasks are done::
+
+        >>> specs = [ReleaseSpec('appname', '3def4a6', base_image, 'pod',
+        ...                      [dict(pod_name='pod', ncore=1, ncontainer=10, entrypoint='web',
+        ...                            env='prod', network_ids=[1])])]
+        >>> release = Release(eru_client, specs)
+        >>> results = release.run()
+        >>> release.report()
+
+    Stages are:
+
+    - `build`: :meth:`EruClient.build_image` on `build_pod`, drain
+      :meth:`EruClient.build_log` and wait for the task, skipped if `base` is None.
+    - `deploy`: one :meth:`EruClient.deploy_private` for each of `deploys`,
+      dicts of its arguments besides `app_name` and `version`.
+    - `poll`: :meth:`EruClient.wait_for_tasks` for the tasks of a deploy, then
+      :meth:`EruClient.poll_container` for the containers in the
+      `container_ids` prop of those tasks.
+
+    :param client: an :class:`EruClient`.
+    :param specs: list of :class:`ReleaseSpec`.
+    :param concurrency: dict of stage => how many of it run at the same time.
+    :param timeout: seconds to wait for any task of builds or deploys.
+    """
+
+    default_concurrency = {'build': 4, 'deploy': 8, 'poll': 16}
+
+    def __init__(self, client, specs, concurrency=None, timeout=None):
+        self.client = client
+        self.specs = list(specs)
+        self.concurrency = dict(self.default_concurrency, **(concurrency or {}))
+        self.timeout = timeout
+        self.results = []
+        self.started = None
+        self.latency = None
+        self._pools = {}
+        self._outstanding = 0
+        self._cond = threading.Condition()
+
+    def run(self):
+        """Run the whole release, returns a :class:`ReleaseResult` for each spec."""
+        self.results = [ReleaseResult(spec) for spec in self.specs]
+        self.started = time.time()
+        self._pools = dict((stage, multiprocessing_pool.ThreadPool(max(self.concurrency[stage], 1)))
+                           for stage in RELEASE_STAGES)
+        try:
+            for result in self.results:
+                if result.spec.base is None:
+                    self._start_deploys(result)
+                else:
+                    self._submit('build', result, self._build)
+            with self._cond:
+                while self._outstanding:
+                    self._cond.wait(1)
+        finally:
+            for pool in self._pools.values():
+                pool.close()
+            self.latency = time.time() - self.started
+        return self.results
+
+    def _submit(self, stage, result, func, *args):
+        with self._cond:
+            self._outstanding += 1
+        self._pools[stage].apply_async(self._run_stage, (stage, result, func) + args)
+
+    def _run_stage(self, stage, result, func, *args):
+        started = time.time()
+        error = None
+        try:
+            func(result, *args)
+        except Exception as e:
+            error = e if isinstance(e, EruException) else EruException(0, repr(e))
+            result.errors.append((stage, error))
+        finally:
+            result.timings.append(StageTiming(stage, result.spec.app_name, started,
+                                              time.time() - started, error))
+            with self._cond:
+                self._outstanding -= 1
+                self._cond.notify_all()
+
+    def _build(self, result):
+        spec = result.spec
+        client = self.client
+        resp = client.build_image(spec.build_pod, spec.app_name, spec.base, spec.version)
+        result.build_task = task_id = resp['task']
+        for line in client.build_log(task_id):
+            result.build_log.append(line)
+        for _ in client.wait_for_tasks([task_id], timeout=self.timeout):
+            pass
+        self._start_deploys(result)
+
+    def _start_deploys(self, result):
+        for deploy in result.spec.deploys:
+            self._submit('deploy', result, self._deploy, deploy)
+
+    def _deploy(self, result, deploy):
+        spec = result.spec
+        resp = self.client.deploy_private(app_name=spec.app_name, version=spec.version, **deploy)
+        result.deploys.append(resp)
+        task_ids = resp.get('tasks', []) if isinstance(resp, dict) else []
+        if task_ids:
+            self._submit('poll', result, self._poll, task_ids)
+
+    def _poll(self, result, task_ids):
+        client = self.client
+        container_ids = []
+        for task in client.wait_for_tasks(task_ids, timeout=self.timeout, concurrency=1):
+            result.tasks.append(task)
+            container_ids.extend((task.get('props') or {}).get('container_ids', []))
+        for container_id in container_ids:
+            result.containers.append(client.poll_container(container_id))
+
+    def report(self):
+        """Time spent in each stage, for the whole release::
+
+            {'wall': 42.1, 'stages': {'build': {'count': 3, 'failed': 0, 'total': 61.2,
+                                                'mean': 20.4, 'max': 25.3}, ...}}
+        """
+        stages = {}
+        for stage in RELEASE_STAGES:
+            timings = [t for result in self.results for t in result.timings if t.stage == stage]
+            latencies = [t.latency for t in timings]
+            stages[stage] = {
+                'count': len(timings),
+                'failed': sum(1 for t in timings if t.error is not None),
+                'total': sum(latencies),
+                'mean': sum(latencies) / len(latencies) if latencies else 0,
+                'max': max(latencies) if latencies else 0,
+            }
+        return {'wall': self.latency, 'stages': stages}
+
+
+# query keywords of :meth:`Inventory.containers` and the container fields they match
+_INVENTORY_FIELDS = {
+    'app': 'appname',
+    'host': 'hostname',
+    'pod': 'podname',
+    'entrypoint': 'entrypoint',
+    'version': 'version',
+    'env': 'env',
+}
+
+
+class Inventory(RequestHook):
+    """Local snapshot of the pods, hosts, apps and containers of the cluster,
+    indexed to be queried without calling ERU::
+
+        >>> inventory = Inventory(eru_client)
+        >>> inventory.crawl()
+        >>> inventory.containers(app='appname', host='host-1', entrypoint='web')
+        >>> inventory.save('/var/cache/eru-inventory.json')
+
+    and in the next process::
+
+        >>> inventory = Inventory.load(eru_client, '/var/cache/eru-inventory.json')
+        >>> inventory.refresh(max_age=600)
+
+    Containers are fetched host by host, `concurrency` hosts at a time, and
+    kept as :class:`Container` records. ERU has no change feed, so
+    :meth:`refresh` lists pods, hosts and apps again, which is cheap, and
+    only fetches containers of hosts that are new, changed, marked dirty or
+    older than `max_age`. Non GET requests sent through `client` mark the
+    hosts and apps they touch dirty, found from the url, the `appname` and
+    `hostname` of deploys and the containers removed, looked up in the
+    inventory; changes made by others are only seen after `max_age`, or by
+    refreshing those hosts or apps explicitly.
+
+    :param client: an :class:`EruClient`, the inventory registers itself as a
+    hook of it until :meth:`close`.
+    :param concurrency: how many pods, hosts or apps to fetch at the same time.
+    """
+
+    def __init__(self, client, concurrency=BULK_CONCURRENCY):
+        self.client = client
+        self.concurrency = concurrency
+        self.pods = {}
+        self.hosts = {}
+        self.apps = {}
+        self.crawled = None
+        self._containers = {}
+        self._indexes = dict((field, defaultdict(set)) for field in _INVENTORY_FIELDS)
+        self._pod_hosts = defaultdict(set)
+        # ('host' or 'app', name) -> when its containers were fetched
+        self._fetched = {}
+        self._dirty = set()
+        self._lock = threading.RLock()
+        client.hooks.append(self)
+
+    def close(self):
+        """Stop following the requests of `client`, the snapshot stays queryable."""
+        if self in self.client.hooks:
+            self.client.hooks.remove(self)
+
+    def __len__(self):
+        return len(self._containers)
+
+    def container(self, container_id):
+        return self._containers.get(container_id)
+
+    def containers(self, app=None, host=None, pod=None, entrypoint=None, version=None, env=None):
+        """Containers matching all the given criteria, all of them if none is given.
+
+        e.g.::
+
+            >>> inventory.containers(app='appname', host='host-1', entrypoint='web')
+        """
+        criteria = [(k, v) for k, v in (('app', app), ('host', host), ('pod', pod),
+                                        ('entrypoint', entrypoint), ('version', version),
+                                        ('env', env)) if v is not None]
+        with self._lock:
+            if not criteria:
+                return list(self._containers.values())
+            matches = sorted((self._indexes[k].get(v, ()) for k, v in criteria), key=len)
+            ids = set(matches[0]).intersection(*matches[1:])
+            return [self._containers[i] for i in ids]
+
+    def pod_hosts(self, pod_name):
+        with self._lock:
+            return [self.hosts[name] for name in self._pod_hosts.get(pod_name, ())]
+
+    def crawl(self):
+        """Forget everything and fetch the whole cluster again, see :meth:`refresh`."""
+        with self._lock:
+            self.pods.clear()
+            self.hosts.clear()
+            self.apps.clear()
+            self._containers.clear()
+            for index in self._indexes.values():
+                index.clear()
+            self._pod_hosts.clear()
+            self._fetched.clear()
+            self._dirty.clear()
+        return self.refresh()
+
+    def refresh(self, pods=None, hosts=None, apps=None, max_age=None):
+        """Fetch again what changed since the last refresh.
+
+        Without arguments pods, hosts and apps are listed again and containers
+        are fetched for hosts and apps that are new, changed, dirty, or fetched
+        more than `max_age` seconds ago. Otherwise only the hosts of `pods`,
+        and containers of those hosts, `hosts` and `apps` are fetched.
+
+        Hosts or apps failing to be fetched keep their previous containers and
+        stay dirty.
+
+        :param pods: names of pods to list hosts of.
+        :param hosts: names of hosts to fetch containers of.
+        :param apps: names of apps to fetch containers of.
+        :param max_age: seconds after which containers are fetched anyway.
+        :returns: list of :class:`BulkResult` of what failed, keyed like `('host', name)`.
+        """
+        client = self.client
+        full = pods is None and hosts is None and apps is None
+        errors = []
+        targets = set(('host', name) for name in hosts or ())
+        targets.update(('app', name) for name in apps or ())
+
+        # everything is fetched first, readers only wait for the swap
+        if full:
+            pod_list = list(client.iter_pods())
+            app_list = list(client.iter_apps())
+            pods = [p['name'] for p in pod_list]
+        pod_hosts = []
+        for result in client.bulk(self._list_pod_hosts, pods or (), self.concurrency):
+            if result.error is not None:
+                errors.append(BulkResult(('pod', result.key), None, result.error))
+            else:
+                pod_hosts.append(result)
+
+        with self._lock:
+            if full:
+                self.pods = dict((p['name'], p) for p in pod_list)
+                for name in set(self._pod_hosts) - set(self.pods):
+                    targets.update(self._update_pod_hosts(name, []))
+            for result in pod_hosts:
+                targets.update(self._update_pod_hosts(result.key, result.result))
+            if full:
+                self._update_apps(app_list)
+                targets.update(self._dirty)
+                if max_age is not None:
+                    now = time.time()
+                    targets.update(key for key, fetched in six.iteritems(self._fetched)
+                                   if now - fetched > max_age)
+            self._dirty.difference_update(targets)
+
+        fetched = []
+        for result in client.bulk(self._list_containers, targets, self.concurrency):
+            if result.error is not None:
+                errors.append(result)
+            else:
+                fetched.append(result)
+        with self._lock:
+            for result in fetched:
+                self._replace(result.key, result.result)
+            self._dirty.update(result.key for result in errors if result.key[0] != 'pod')
+        if full:
+            self.crawled = time.time()
+        return errors
+
+    def _list_pod_hosts(self, pod_name):
+        # pages are fetched one by one, `concurrency` already bounds the requests
+        return list(self.client.iter_pod_hosts(pod_name, show_all=True, prefetch=0))
+
+    def _list_containers(self, key):
+        kind, name = key
+        if kind == 'host':
+            containers = self.client.iter_host_containers(name, prefetch=0, records=True)
+        else:
+            containers = self.client.iter_app_containers(name, prefetch=0, records=True)
+        return list(containers), time.time()
+
+    def _update_pod_hosts(self, pod_name, hosts):
+        """Store the hosts of a pod, returns the keys of hosts to fetch containers of."""
+        changed = set()
+        names = set()
+        for host in hosts:
+            name = host['name']
+            names.add(name)
+            if self.hosts.get(name) != host:
+                self.hosts[name] = host
+                changed.add(('host', name))
+        for name in self._pod_hosts.get(pod_name, set()) - names:
+            # host is gone, so are its containers
+            self.hosts.pop(name, None)
+            self._replace(('host', name), ([], None))
+        if names:
+            self._pod_hosts[pod_name] = names
+        else:
+            self._pod_hosts.pop(pod_name, None)
+        return changed
+
+    def _update_apps(self, apps):
+        names = set(app['name'] for app in apps)
+        for name in set(self.apps) - names:
+            self._replace(('app', name), ([], None))
+        self.apps = dict((app['name'], app) for app in apps)
+
+    def _replace(self, key, fetched):
+        kind, name = key
+        containers, fetched_at = fetched
+        for container_id in list(self._indexes[kind].get(name, ())):
+            self._discard(container_id)
         for c in containers:
-            key = c['version'], c['entrypoint'], c['env']
-            container_groups[key].append(c)
-
-        to_remove = []
-        for (version, entrypoint, env), container_group in container_groups.iteritems():
-            current_ncontainer = len(container_group)
-            if current_ncontainer <= floor or current_ncontainer <= ncontainer:
-                # there's nothing to scale in
-                continue
-            # kill the most `ncontainer` eldest containers
-            eldest_containers = sorted(container_group, key=lambda d: d['created'])[:ncontainer]
-            to_remove.extend([c['container_id'] for c in eldest_containers])
+            self._add(c)
+        if fetched_at is None:
+            self._fetched.pop(key, None)
+        else:
+            self._fetched[key] = fetched_at
+
+    def _add(self, c):
+        container_id = c['container_id']
+        if container_id in self._containers:
+            self._discard(container_id)
+        self._containers[container_id] = c
+        for kind, field in six.iteritems(_INVENTORY_FIELDS):
+            self._indexes[kind][c.get(field)].add(container_id)
+
+    def _discard(self, container_id):
+        c = self._containers.pop(container_id, None)
+        if c is None:
+            return
+        for kind, field in six.iteritems(_INVENTORY_FIELDS):
+            ids = self._indexes[kind].get(c.get(field))
+            if ids is not None:
+                ids.discard(container_id)
+                if not ids:
+                    del self._indexes[kind][c.get(field)]
+
+    def mark_dirty(self, hosts=(), apps=()):
+        """Have the next :meth:`refresh` fetch containers of these hosts and apps."""
+        with self._lock:
+            self._dirty.update(('host', name) for name in hosts)
+            self._dirty.update(('app', name) for name in apps)
+
+    def after_request(self, info):
+        if info.method == 'GET' or info.error is not None:
+            return
+        template, args = match_endpoint(info.url)
+        if (info.method, template) not in CACHE_INVALIDATIONS:
+            return
+        body = info.body if isinstance(info.body, dict) else {}
+        container_ids = list(body.get('cids') or ())
+        if 'container_id' in args:
+            container_ids.append(args['container_id'])
+        with self._lock:
+            for container_id in container_ids:
+                c = self._containers.get(container_id)
+                if c is not None:
+                    self._dirty.add(('host', c.get('hostname')))
+                    self._dirty.add(('app', c.get('appname')))
+            if 'host' in args:
+                self._dirty.add(('host', args['host']))
+            if body.get('hostname'):
+                self._dirty.add(('host', body['hostname']))
+            for name in (args.get('name'), body.get('appname')):
+                if name:
+                    self._dirty.add(('app', name))
+
+    def save(self, path):
+        """Write a snapshot to `path`, replaced atomically."""
+        with self._lock:
+            snapshot = {
+                'format': 1,
+                'crawled': self.crawled,
+                'pods': list(self.pods.values()),
+                'hosts': dict((pod, [self.hosts[name] for name in names])
+                              for pod, names in six.iteritems(self._pod_hosts)),
+                'apps': list(self.apps.values()),
+                'containers': [c.to_dict() for c in self._containers.values()],
+                'fetched': [[kind, name, fetched] for (kind, name), fetched
+                            in six.iteritems(self._fetched)],
+                'dirty': [list(key) for key in self._dirty],
+            }
+        tmp = '{0}.{1}.tmp'.format(path, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(snapshot, f, separators=(',', ':'))
+        os.rename(tmp, path)
+
+    @classmethod
+    def load(cls, client, path, concurrency=BULK_CONCURRENCY):
+        """Warm start from a snapshot written by :meth:`save`, call
+        :meth:`refresh` to catch up with what changed since."""
+        with open(path) as f:
+            snapshot = json.load(f)
+        inventory = cls(client, concurrency)
+        inventory.crawled = snapshot['crawled']
+        inventory.pods = dict((p['name'], p) for p in snapshot['pods'])
+        for pod_name, hosts in six.iteritems(snapshot['hosts']):
+            inventory._update_pod_hosts(pod_name, hosts)
+        inventory._update_apps(snapshot['apps'])
+        for c in snapshot['containers']:
+            inventory._add(Container.from_dict(c))
+        inventory._fetched = dict(((kind, name), fetched)
+                                  for kind, name, fetched in snapshot['fetched'])
+        inventory._dirty = set((kind, name) for kind, name in snapshot['dirty'])
+        return inventory
+
+
+_NOT_FULL_BYTE = re.compile(b'[^\xff]')
+IP_POOL_MAX_SIZE = 1 << 24
+
+
+_NETSPACES = {}
+
+
+def _netspace(netspace):
+    net = _NETSPACES.get(netspace)
+    if net is None:
+        net = _NETSPACES[netspace] = netaddr.IPNetwork(netspace)
+    return net
+
+
+class IPPool(object):
+    """Free addresses of a netspace, one bit for each address, so a /16 takes
+    8KB whatever the number of containers in it.
+
+    The network address, the first host which is the gateway and the
+    broadcast address are never handed out, nor are `reserved`.
+
+    :param netspace: like `10.200.0.0/16`.
+    :param reserved: extra addresses never to hand out.
+    """
+
+    def __init__(self, netspace, reserved=()):
+        self.network = netaddr.IPNetwork(netspace)
+        self.size = self.network.size
+        if self.size > IP_POOL_MAX_SIZE:
+            raise EruException(0, '{0} is too large for a local pool'.format(netspace))
+        self._first = self.network.first
+        self._bits = bytearray((self.size + 7) // 8)
+        # bits past the end of the netspace are never free
+        for offset in range(self.size, len(self._bits) * 8):
+            self._set(offset)
+        self._used = 0
+        self._cursor = 0
+        self._lock = threading.Lock()
+        for offset in (0, 1, self.size - 1):
+            if 0 <= offset < self.size and not self._get(offset):
+                self._set(offset)
+                self._used += 1
+        self.mark_used(reserved)
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, address):
+        return self._offset(address) is not None
+
+    @property
+    def free(self):
+        return self.size - self._used
+
+    def _offset(self, address):
+        """Offset of `address` in the netspace, None if it's out of it.
+        `address` may carry a prefix like container `vlan_address` does."""
+        offset = int(netaddr.IPAddress(str(address).split('/', 1)[0])) - self._first
+        return offset if 0 <= offset < self.size else None
+
+    def _get(self, offset):
+        return self._bits[offset >> 3] & (1 << (offset & 7))
+
+    def _set(self, offset):
+        self._bits[offset >> 3] |= 1 << (offset & 7)
+
+    def _clear(self, offset):
+        self._bits[offset >> 3] &= ~(1 << (offset & 7)) & 0xff
+
+    def is_free(self, address):
+        offset = self._offset(address)
+        return offset is not None and not self._get(offset)
+
+    def mark_used(self, addresses):
+        """Mark `addresses` as taken, those out of the netspace are ignored.
+        Returns how many of them were free."""
+        n = 0
+        with self._lock:
+            for address in addresses:
+                offset = self._offset(address)
+                if offset is not None and not self._get(offset):
+                    self._set(offset)
+                    n += 1
+            self._used += n
+        return n
+
+    def release(self, addresses):
+        """Give back addresses from :meth:`allocate`, like after a failed deploy."""
+        with self._lock:
+            for address in addresses:
+                offset = self._offset(address)
+                if offset is not None and offset > 1 and offset < self.size - 1 and self._get(offset):
+                    self._clear(offset)
+                    self._used -= 1
+
+    def allocate(self, n):
+        """Take `n` free addresses and return them as strings, the search goes
+        on from where the last one stopped so released addresses aren't
+        handed out again right away. Raises :class:`EruException` and takes
+        nothing if there aren't `n` free addresses."""
+        with self._lock:
+            if n > self.size - self._used:
+                raise EruException(0, '{0} free addresses in {1}, {2} wanted'.format(
+                    self.size - self._used, self.network, n))
+            offsets = []
+            nbytes = len(self._bits)
+            i = self._cursor >> 3
+            while len(offsets) < n:
+                # skip full bytes, 8 taken addresses at a time
+                m = _NOT_FULL_BYTE.search(self._bits, i)
+                if m is None:
+                    i = 0
+                    continue
+                i = m.start()
+                byte = self._bits[i]
+                for bit in range(8):
+                    if not byte & (1 << bit):
+                        offset = (i << 3) + bit
+                        self._set(offset)
+                        offsets.append(offset)
+                        if len(offsets) == n:
+                            break
+                i = (i + 1) % nbytes
+            self._used += n
+            self._cursor = (offsets[-1] + 1) % self.size if offsets else self._cursor
+        return [str(netaddr.IPAddress(self._first + offset)) for offset in offsets]
+
+
+class NetworkIndex(object):
+    """Networks of ERU cached by id and name, and an :class:`IPPool` for
+    each of them to pick `spec_ips` of fixed IP deploys without trying
+    addresses against ERU one by one::
+
+        >>> networks = NetworkIndex(eru_client, inventory)
+        >>> ips = networks.allocate('net0', 10)
+        >>> eru_client.deploy_private('pod', 'app', 1, 10, 'v1', 'web', 'prod',
+        ...                           [networks.get('net0')['id']], spec_ips=ips)
+
+    Pools know of the addresses of the containers passed to :meth:`observe`,
+    and of those in `inventory` when they're created. Allocations are only
+    local, addresses taken by others since are only known once observed, so
+    :meth:`release` what a failed deploy didn't use.
+
+    :param client: an :class:`EruClient`.
+    :param inventory: an :class:`Inventory` to learn the used addresses from.
+    """
+
+    def __init__(self, client, inventory=None):
+        self.client = client
+        self.inventory = inventory
+        self._by_id = {}
+        self._by_name = {}
+        self._pools = {}
+        self._lock = threading.RLock()
+
+    def refresh(self):
+        """List the networks of ERU again, pools of known networks are kept."""
+        # not paged, the whole list comes at once
+        networks = list(self.client.list_network())
+        with self._lock:
+            self._by_id.clear()
+            self._by_name.clear()
+            for network in networks:
+                self._add(network)
+        return networks
+
+    def _add(self, network):
+        self._by_id[network['id']] = network
+        self._by_name[network['name']] = network
+
+    def networks(self):
+        with self._lock:
+            if not self._by_id:
+                self.refresh()
+            return list(self._by_id.values())
+
+    def get(self, id_or_name):
+        """The network of this id or name, fetched from ERU once."""
+        with self._lock:
+            network = self._cached(id_or_name)
+        if network is None:
+            network = self.client.get_network(id_or_name)
+            with self._lock:
+                self._add(network)
+        return network
+
+    def _cached(self, id_or_name):
+        if isinstance(id_or_name, six.string_types) and id_or_name.isdigit():
+            id_or_name = int(id_or_name)
+        if isinstance(id_or_name, six.integer_types):
+            return self._by_id.get(id_or_name)
+        return self._by_name.get(id_or_name)
+
+    def network_of(self, address):
+        """The narrowest known network `address` belongs to, None if there's none."""
+        ip = netaddr.IPAddress(str(address).split('/', 1)[0])
+        found = None
+        for network in self.networks():
+            net = _netspace(network['netspace'])
+            if ip in net and (found is None or net.prefixlen > found[1].prefixlen):
+                found = network, net
+        return found[0] if found else None
+
+    def pool(self, id_or_name):
+        """:class:`IPPool` of this network, created at the first call."""
+        network = self.get(id_or_name)
+        with self._lock:
+            pool = self._pools.get(network['id'])
+            if pool is None:
+                pool = self._pools[network['id']] = IPPool(network['netspace'])
+                if self.inventory is not None:
+                    pool.mark_used(self._addresses(self.inventory.containers()))
+        return pool
+
+    @staticmethod
+    def _addresses(containers):
+        for c in containers:
+            for n in c.get('networks') or ():
+                if n.get('vlan_address'):
+                    yield n['vlan_address']
+
+    def observe(self, containers):
+        """Mark the addresses of `containers` as used in the pools they belong to,
+        e.g. ``networks.observe(eru_client.iter_app_containers('app'))``."""
+        for address in self._addresses(containers):
+            with self._lock:
+                pool = next((p for p in self._pools.values() if address in p), None)
+            if pool is None:
+                network = self.network_of(address)
+                if network is None:
+                    continue
+                pool = self.pool(network['id'])
+            pool.mark_used((address,))
+
+    def allocate(self, id_or_name, n):
+        """Take `n` free addresses of this network, see :meth:`IPPool.allocate`."""
+        return self.pool(id_or_name).allocate(n)
+
+    def release(self, id_or_name, addresses):
+        self.pool(id_or_name).release(addresses)
+
 
-        return self.remove_containers(to_remove)
+def __getattr__(name):
+    # PEP 562 (python 3.7+): the asyncio client lives in its own module so
+    # that this one stays importable on python 2.
+    if name == 'AsyncEruClient':
+        from eruhttp_async import AsyncEruClient
+        return AsyncEruClient
+    raise AttributeError("module 'eruhttp' has no attribute '{0}'".format(name))
@@ -0,0 +1,595 @@
+# -*- coding: utf-8 -*-
+"""asyncio flavour of :class:`eruhttp.EruClient`, python 3.6+ only.
+
+Every API method of ``EruClient`` only builds an url and a payload and then
+hands them to ``request``/``request_websocket``, so ``AsyncEruClient`` just
+replaces those two with coroutines and all the methods become awaitable::
+
+    >>> async with AsyncEruClient('http://eru.intra/') as client:
+    ...     apps = await asyncio.gather(*[client.get_app(n) for n in names])
+    ...     async for line in client.container_log(container_id, stdout=1):
+    ...         print(line)
+"""
+import asyncio
+import time
+from collections import deque
+from urllib.parse import urljoin
+
+import aiohttp
+
+from eruhttp import (BULK_CONCURRENCY, CALLBACK_TIMEOUT, LOG_BUFFER_SIZE, PAGE_SIZE, PREFETCH_PAGES,
+                     TASK_POLL_INTERVAL, TASK_POLL_MAX_INTERVAL, BulkResult, ContainerIndex,
+                     DeployFuture, DeployResult, EnvChange, EnvSyncReport, EruClient, EruException,
+                     _as_records, _drop_overlap, _envs_to_fetch, _plan_env_sync, _plan_scale_in, _plan_scale_out,
+                     _single_flight_key, match_endpoint)
+
+
+class AsyncDeployFuture(DeployFuture):
+    """:class:`eruhttp.DeployFuture` of :class:`AsyncEruClient`, `result` is a coroutine."""
+
+    async def result(self, callback_timeout=CALLBACK_TIMEOUT, timeout=None):
+        loop = asyncio.get_event_loop()
+        done = asyncio.Event()
+
+        def wake():
+            try:
+                loop.call_soon_threadsafe(done.set)
+            except RuntimeError:
+                # the loop is closed, nobody waits anymore
+                pass
+
+        # no thread is held while waiting, the callback server wakes the loop
+        self._waiter.on_done(wake)
+        try:
+            await asyncio.wait_for(done.wait(), callback_timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self._server.unregister(self._waiter)
+        self.pushed = self._waiter.done()
+        if self.pushed:
+            return self.callbacks
+        return [task async for task in self._client.wait_for_tasks(self.task_ids, timeout=timeout)]
+
+
+class AsyncEruClient(EruClient):
+
+    def __init__(self, url, timeout=5, username='', password='', pool_size=100, **kwargs):
+        """`cache`, `transport`, `coalesce`, `stream_config` and `hooks` are the
+        same as :class:`eruhttp.EruClient`, requests are cached, retried and
+        fail over to other nodes the same way."""
+        super(AsyncEruClient, self).__init__(url, timeout, username, password, **kwargs)
+        self.session.close()
+        self.session = None
+        self.pool_size = pool_size
+        self._flights = {}
+
+    def _get_session(self):
+        # aiohttp sessions have to be created inside a running event loop
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size)
+            self.session = aiohttp.ClientSession(connector=connector)
+        return self.session
+
+    async def close(self):
+        self.router.close()
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def request(self, url, method='GET', params=None, data=None, json=None, files=None, expected_code=200):
+        if params is None:
+            params = {}
+        if data is None:
+            data = {}
+
+        params.setdefault('start', 0)
+        params.setdefault('limit', 20)
+
+        cache, cache_key, entry, headers = self.cache, None, None, {}
+        if cache is not None:
+            template, args = match_endpoint(url)
+            if method == 'GET' and template in cache.ttls:
+                cache_key = cache.key(url, params)
+                entry = cache.get(cache_key)
+                if entry is not None:
+                    if entry.expires > time.time():
+                        return entry.value
+                    if entry.etag:
+                        headers['If-None-Match'] = entry.etag
+                    if entry.last_modified:
+                        headers['If-Modified-Since'] = entry.last_modified
+
+        # aiohttp only accepts str and int query values, `requests` is less picky
+        query = {k: v if isinstance(v, str) else str(v) for k, v in params.items()}
+        body = data or None
+        if files:
+            body = aiohttp.FormData(data)
+            for name, f in files.items():
+                body.add_field(name, f, filename=name)
+        elif json is not None:
+            body = self.transport.encode_body(json, headers)
+
+        info = self._start_request('http', method, url, params, json if json is not None else data)
+        try:
+            status, resp_headers, content = await self._send(method, url, query, body, headers, info)
+            if entry is not None and status == 304:
+                cache.touch(entry)
+                return entry.value
+            r = self.transport.codec.loads(content)
+            if info is not None:
+                info.response = r
+            if status != expected_code:
+                raise EruException(status, r.get('error', 'Unknown error'))
+            if cache_key is not None:
+                cache.set(cache_key, template, args, r,
+                          resp_headers.get('ETag'), resp_headers.get('Last-Modified'))
+            return r
+        except EruException as e:
+            if info is not None:
+                info.error = e
+            raise
+        except Exception as e:
+            err_msg = '''{url} responded: {msg}\n{params}\n{data}\n{json}'''.format(
+                url=url, msg=getattr(e, 'message', e), params=params, data=data, json=json)
+            error = EruException(0, err_msg)
+            if info is not None:
+                info.error = error
+            raise error
+        finally:
+            if cache is not None and method != 'GET':
+                cache.invalidate_for(method, template, args)
+            if info is not None:
+                self._finish_request(info)
+
+    async def _send(self, method, url, query, body, headers, info=None):
+        """See :meth:`eruhttp.EruClient._send`, returns the status, headers
+        and body of the response."""
+        transport = self.transport
+        retry = transport.retry
+        router = self.router
+        deadline = time.time() + transport.deadline if transport.deadline else None
+        connect_timeout = transport.connect_timeout or self.timeout
+        read_timeout = transport.read_timeout or self.timeout
+        limiters = transport.limiters(method, url)
+        node = router.pick()
+        tried = set()
+        retries = 0
+        while True:
+            for i, limiter in enumerate(limiters):
+                if not await self._acquire(limiter, deadline):
+                    for acquired in limiters[:i]:
+                        acquired.release()
+                    raise EruException(0, 'Deadline exceeded')
+
+            total = None
+            if deadline is not None:
+                total = deadline - time.time()
+                if total <= 0:
+                    for limiter in limiters:
+                        limiter.release()
+                    raise EruException(0, 'Deadline exceeded')
+            timeout = aiohttp.ClientTimeout(total=total, sock_connect=connect_timeout, sock_read=read_timeout)
+
+            started = time.time()
+            failed = True
+            error = caught = status = None
+            try:
+                async with self._get_session().request(method,
+                                                       urljoin(node.url, url),
+                                                       params=query,
+                                                       data=body,
+                                                       headers=headers,
+                                                       timeout=timeout) as resp:
+                    content = await resp.read()
+                status = resp.status
+                failed = status >= 500
+                if info is not None:
+                    info.status = status
+                    info.bytes_in = len(content)
+                if status not in retry.statuses:
+                    return status, resp.headers, content
+            except asyncio.TimeoutError:
+                error = EruException(0, 'Read timeout')
+            except aiohttp.ClientConnectionError:
+                error = EruException(0, 'Connection refused')
+            except Exception as e:
+                caught = e
+                raise
+            finally:
+                latency = time.time() - started
+                for limiter in limiters:
+                    limiter.release(latency, failed)
+                if error is not None:
+                    reason = error.message
+                elif isinstance(caught, aiohttp.ClientPayloadError):
+                    # the node broke off the response
+                    reason = str(caught)
+                elif caught is None and status in retry.statuses:
+                    reason = 'Status {0}'.format(status)
+                else:
+                    # an error of the request itself isn't the node's fault
+                    reason = None
+                router.observe(node, latency, reason)
+
+            if method in retry.methods:
+                tried.add(node)
+                other = router.pick(exclude=tried)
+                if other is not None:
+                    node = other
+                    if info is not None:
+                        info.retries += 1
+                    continue
+
+            give_up = not retry.can_retry(method, retries)
+            delay = 0 if give_up else retry.delay(retries)
+            if give_up or (deadline is not None and time.time() + delay >= deadline):
+                if error is not None:
+                    raise error
+                return status, resp.headers, content
+            await asyncio.sleep(delay)
+            retries += 1
+            node = router.pick()
+            tried.clear()
+            if info is not None:
+                info.retries += 1
+
+    @staticmethod
+    async def _acquire(limiter, deadline=None):
+        # `Limiter.acquire` would block the loop
+        while True:
+            wait = limiter.try_acquire()
+            if wait == 0:
+                return True
+            if deadline is not None and time.time() >= deadline:
+                return False
+            await asyncio.sleep(wait if wait is not None else 0.005)
+
+    async def get(self, url, **kwargs):
+        key = _single_flight_key(url, kwargs) if self.single_flight is not None else None
+        if key is None:
+            return await self.request(url, 'GET', **kwargs)
+
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = self._flights[key] = asyncio.ensure_future(self.request(url, 'GET', **kwargs))
+            flight.add_done_callback(lambda _: self._flights.pop(key, None))
+        # one waiter being cancelled must not cancel the others
+        return await asyncio.shield(flight)
+
+    def _as_records(self, record_type, records):
+        # `records` is the coroutine of `get` here
+        if record_type is None:
+            return records
+
+        async def convert():
+            return _as_records(record_type, await records)
+        return convert()
+
+    def request_stream(self, url, params=None, record_type=None, chunk_size=None):
+        raise EruException(0, 'AsyncEruClient does not stream responses, call without stream=True')
+
+    async def iter_pages(self, url, params=None, page_size=PAGE_SIZE, prefetch=PREFETCH_PAGES,
+                         record_type=None, stream=False):
+        """See :meth:`eruhttp.EruClient.iter_pages`, pages are prefetched as tasks.
+        `stream` is ignored, pages are decoded whole."""
+        params = dict(params or {})
+
+        def fetch(start):
+            page_params = dict(params, start=start, limit=page_size)
+            return asyncio.ensure_future(self.get(url, params=page_params))
+
+        pending = deque()
+        next_start = 0
+        try:
+            for _ in range(max(prefetch, 1)):
+                pending.append(fetch(next_start))
+                next_start += page_size
+            while pending:
+                page = _as_records(record_type, await pending.popleft())
+                if len(page) < page_size:
+                    for record in page:
+                        yield record
+                    return
+                pending.append(fetch(next_start))
+                next_start += page_size
+                for record in page:
+                    yield record
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def request_websocket(self, url, as_json=True, params=None, resume=None):
+        """See :meth:`eruhttp.EruClient.request_websocket`, aiohttp pings the
+        server every `recv_timeout` seconds of :class:`eruhttp.StreamConfig`
+        and breaks the connection when a pong doesn't come back in time."""
+        config = self.stream_config
+        params = dict(params or {})
+        loads = self.transport.codec.loads
+        delivered = 0
+        history = deque(maxlen=config.resume_window)
+        skip, replay = 0, None
+        reconnects = 0
+        info = self._start_request('websocket', 'GET', url, dict(params))
+        try:
+            while True:
+                error = None
+                try:
+                    async with self._get_session().ws_connect(self.websocket_url(url, params),
+                                                              heartbeat=config.recv_timeout) as ws:
+                        while True:
+                            try:
+                                # the replay comes in a burst, don't wait long for its end
+                                msg = await ws.receive(timeout=min(1, config.recv_timeout)
+                                                       if replay is not None else None)
+                            except asyncio.TimeoutError:
+                                msg = None
+                            data = msg is not None and msg.type in (aiohttp.WSMsgType.TEXT,
+                                                                    aiohttp.WSMsgType.BINARY)
+                            if msg is not None and not data and msg.type != aiohttp.WSMsgType.CLOSE:
+                                # gone without a close frame
+                                error = ws.exception() or 'closed with code {0}'.format(ws.close_code)
+                                break
+                            frames = [msg.data] if data and msg.data else []
+                            if data:
+                                reconnects = 0
+                            if skip:
+                                dropped = min(skip, len(frames))
+                                frames, skip = frames[dropped:], skip - dropped
+                            if replay is not None:
+                                replay.extend(frames)
+                                # a replay shorter than resume_window is over when it pauses
+                                if data and len(replay) < config.resume_window:
+                                    continue
+                                frames, replay = _drop_overlap(history, replay), None
+                            if resume == 'tail':
+                                history.extend(frames)
+                            if info is not None:
+                                info.bytes_in += sum(len(frame) for frame in frames)
+                                info.frames += len(frames)
+                            for frame in frames:
+                                delivered += 1
+                                yield loads(frame) if as_json else frame
+                            if msg is not None and not data:
+                                return
+                except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+                    error = e
+
+                if not resume or reconnects >= config.max_reconnects:
+                    error = EruException(0, 'Websocket {0} broken: {1}'.format(url, error))
+                    if info is not None:
+                        info.error = error
+                    raise error
+                await asyncio.sleep(min(config.max_backoff, config.backoff * 2 ** reconnects))
+                reconnects += 1
+                if info is not None:
+                    info.retries += 1
+                if resume == 'count':
+                    skip = delivered
+                elif resume == 'tail':
+                    params['tail'] = config.resume_window
+                    replay = []
+        finally:
+            if info is not None:
+                self._finish_request(info)
+
+    async def multiplex_websockets(self, targets, as_json=True, buffer_size=LOG_BUFFER_SIZE):
+        """See :meth:`eruhttp.EruClient.multiplex_websockets`."""
+        arrived = asyncio.Queue()
+        closed = object()
+
+        async def pump(tag, stream, url, params):
+            room = asyncio.Semaphore(buffer_size)
+            end = closed
+            try:
+                async for frame in self.request_websocket(url, as_json=as_json, params=params):
+                    await room.acquire()
+                    arrived.put_nowait((room, (tag, stream, frame)))
+            except EruException as e:
+                end = e
+            finally:
+                arrived.put_nowait((None, end))
+
+        pumps = [asyncio.ensure_future(pump(*target)) for target in targets]
+        remaining = len(pumps)
+        try:
+            while remaining:
+                room, item = await arrived.get()
+                if item is closed:
+                    remaining -= 1
+                    continue
+                if isinstance(item, EruException):
+                    raise item
+                room.release()
+                yield item
+        finally:
+            for p in pumps:
+                p.cancel()
+
+    async def bulk(self, func, keys, concurrency=BULK_CONCURRENCY):
+        """See :meth:`eruhttp.EruClient.bulk`, `func` returns an awaitable."""
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def call(key):
+            async with semaphore:
+                try:
+                    return BulkResult(key, await func(key), None)
+                except EruException as e:
+                    return BulkResult(key, None, e)
+
+        for done in asyncio.as_completed([call(key) for key in keys]):
+            yield await done
+
+    async def sync_envs(self, desired_state, concurrency=BULK_CONCURRENCY, dry_run=False, prune=False):
+        """See :meth:`eruhttp.EruClient.sync_envs`."""
+        report = EnvSyncReport()
+        names = {}
+        async for r in self.bulk(self.list_app_env_names, list(desired_state), concurrency):
+            if r.error is not None:
+                report.changes.append(EnvChange(r.key, None, 'fetch', [], [], [], r.error))
+            else:
+                names[r.key] = set((r.result or {}).get('data') or ())
+
+        contents = {}
+        async for r in self.bulk(self._fetch_env, _envs_to_fetch(desired_state, names), concurrency):
+            if r.error is not None:
+                report.changes.append(EnvChange(r.key[0], r.key[1], 'fetch', [], [], [], r.error))
+                names.pop(r.key[0], None)
+            else:
+                contents[r.key] = r.result or {}
+
+        changes = _plan_env_sync(desired_state, names, contents, prune, report)
+        if dry_run:
+            report.changes.extend(changes)
+            return report
+
+        def apply(change):
+            return self._apply_env_change(change, desired_state)
+
+        async for r in self.bulk(apply, changes, concurrency):
+            report.changes.append(r.key._replace(error=r.error))
+        return report
+
+    async def wait_for_tasks(self, task_ids, timeout=None, interval=TASK_POLL_INTERVAL,
+                             max_interval=TASK_POLL_MAX_INTERVAL, concurrency=BULK_CONCURRENCY,
+                             watch_logs=False):
+        """See :meth:`eruhttp.EruClient.wait_for_tasks`, websockets are followed in tasks."""
+        pending = set(task_ids)
+        deadline = time.time() + timeout if timeout is not None else None
+        woken = asyncio.Event()
+        closed = deque()
+
+        async def watch(task_id):
+            try:
+                async for _ in self.request_websocket('/websockets/tasklog/{0}/'.format(task_id),
+                                                      as_json=False):
+                    pass
+            except EruException:
+                # polling finds out about the task anyway
+                pass
+            closed.append(task_id)
+            woken.set()
+
+        watchers = []
+        if watch_logs:
+            watchers = [asyncio.ensure_future(watch(task_id)) for task_id in pending]
+            interval = max_interval
+
+        delay = interval
+        next_round = time.time()
+        try:
+            while pending:
+                now = time.time()
+                if deadline is not None and now >= deadline:
+                    raise EruException(0, '{0} tasks not finished in {1}s'.format(len(pending), timeout))
+                full_round = now >= next_round
+                if full_round:
+                    batch = list(pending)
+                else:
+                    batch = set()
+                    while closed:
+                        batch.add(closed.popleft())
+                    batch = [task_id for task_id in batch if task_id in pending]
+
+                finished = 0
+                async for result in self.bulk(self.get_task, batch, concurrency):
+                    if result.error is not None:
+                        if result.error.code == 404:
+                            raise result.error
+                        continue
+                    if result.result.get('finished'):
+                        pending.discard(result.key)
+                        finished += 1
+                        yield result.result
+
+                if full_round:
+                    if finished:
+                        delay = interval
+                    next_round = time.time() + delay
+                    if not finished:
+                        delay = min(delay * 2, max_interval)
+                wait = next_round - time.time()
+                if deadline is not None:
+                    wait = min(wait, deadline - time.time())
+                if pending and wait > 0 and not closed:
+                    try:
+                        await asyncio.wait_for(woken.wait(), wait)
+                    except asyncio.TimeoutError:
+                        pass
+                woken.clear()
+        finally:
+            for watcher in watchers:
+                watcher.cancel()
+
+    async def submit_deploy_private(self, pod_name, app_name, ncore, ncontainer, version,
+                                    entrypoint, env, network_ids, **kwargs):
+        """See :meth:`eruhttp.EruClient.submit_deploy_private`, returns :class:`AsyncDeployFuture`."""
+        server = self._get_callback_server()
+        waiter = server.register(expected=ncontainer)
+        try:
+            resp = await self.deploy_private(pod_name, app_name, ncore, ncontainer, version, entrypoint,
+                                             env, network_ids, callback_url=waiter.url, **kwargs)
+        except Exception:
+            server.unregister(waiter)
+            raise
+        return AsyncDeployFuture(self, server, waiter, resp)
+
+    async def submit_deploy_public(self, pod_name, app_name, ncontainer, version, entrypoint, env,
+                                   network_ids, **kwargs):
+        server = self._get_callback_server()
+        waiter = server.register(expected=ncontainer)
+        try:
+            resp = await self.deploy_public(pod_name, app_name, ncontainer, version, entrypoint, env,
+                                            network_ids, callback_url=waiter.url, **kwargs)
+        except Exception:
+            server.unregister(waiter)
+            raise
+        return AsyncDeployFuture(self, server, waiter, resp)
+
+    async def plan_scale_out(self, app_name, ncore=None, ncontainer=None, pod_name=None,
+                             ceiling=50, entrypoints=()):
+        containers = [c async for c in self.iter_app_containers(app_name)]
+        index = ContainerIndex(containers, entrypoints)
+        return _plan_scale_out(app_name, index, ncore, ncontainer, pod_name, ceiling)
+
+    async def plan_scale_in(self, app_name, ncontainer, pod_names=None, entrypoints=(), floor=2):
+        containers = [c async for c in self.iter_app_containers(app_name)]
+        index = ContainerIndex(containers, entrypoints)
+        return _plan_scale_in(app_name, index, ncontainer, pod_names, floor)
+
+    async def scale_out(self, app_name, ncore=None, ncontainer=None, pod_name=None,
+                        ceiling=50, entrypoints=(), dry_run=False, concurrency=1):
+        """See :meth:`eruhttp.EruClient.scale_out`."""
+        plan = await self.plan_scale_out(app_name, ncore, ncontainer, pod_name, ceiling, entrypoints)
+        if dry_run:
+            return plan
+        return await self.execute_scale_out(plan, concurrency)
+
+    async def execute_scale_out(self, plan, concurrency=1):
+        semaphore = asyncio.Semaphore(max(concurrency, 1))
+
+        async def deploy(group, args):
+            async with semaphore:
+                started = time.time()
+                try:
+                    resp = await self.deploy_private(*args)
+                except EruException as e:
+                    return DeployResult(group, False, [], time.time() - started, e)
+                task_ids = resp.get('tasks', []) if isinstance(resp, dict) else []
+                return DeployResult(group, bool(resp), task_ids, time.time() - started, None)
+
+        return list(await asyncio.gather(*[deploy(group, args) for group, args
+                                           in zip(plan.deploys, plan.deploy_args())]))
+
+    async def scale_in(self, app_name, ncontainer, pod_names=None, entrypoints=(), floor=2,
+                       dry_run=False):
+        plan = await self.plan_scale_in(app_name, ncontainer, pod_names, entrypoints, floor)
+        if dry_run:
+            return plan
+        return await self.remove_containers(plan.to_remove)
@@ -7,8 +7,8 @@ setup(
     zip_safe=False,
     author_email='tonic@wolege.ca',
     description='ERU client for python',
-    py_modules=['eruhttp'],
-    packages=find_packages(),
+    py_modules=['eruhttp', 'eruhttp_async', 'erucli'],
+    packages=find_packages(exclude=['benchmarks', 'benchmarks.*']),
     include_package_data=True,
     install_requires=[
         'requests >= 2.7.0',
@@ -17,4 +17,11 @@ setup(
         'six == 1.9.0',
         'websocket_client == 0.37.0',
     ],
+    entry_points={
+        'console_scripts': ['eru = erucli:main'],
+    },
+    extras_require={
+        'async': ['aiohttp >= 3.3'],
+        'fastjson': ['orjson'],
+    },
 )
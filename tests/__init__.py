@@ -0,0 +1,5 @@
+# -*- coding: utf-8 -*-
+"""Tests of eru-py against the stand-in server of `benchmarks.fake_server`::
+
+    $ python -m unittest discover -s tests -t .
+"""
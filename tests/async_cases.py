@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""Tests of :mod:`eruhttp_async`, python 3 only, loaded by `test_async`."""
+import asyncio
+import concurrent.futures
+import struct
+import time
+import unittest
+
+import eruhttp
+from benchmarks.fake_server import FakeEru, websocket_frame
+from tests.servers import CannedServer, WebsocketServer, http_response, refused_url
+
+try:
+    from eruhttp_async import AsyncEruClient
+except ImportError:  # aiohttp not installed
+    AsyncEruClient = None
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+@unittest.skipIf(AsyncEruClient is None, 'needs aiohttp')
+class AsyncIterPagesTest(unittest.TestCase):
+
+    def test_pages(self):
+        async def pages(url):
+            async with AsyncEruClient(url) as client:
+                containers = [c async for c in client.iter_app_containers('app', page_size=100)]
+                # stream is accepted and ignored
+                streamed = [c async for c in client.iter_app_containers('app', stream=True)]
+                plan = await client.scale_out('app', ncontainer=1, ceiling=1000, dry_run=True)
+                with self.assertRaises(eruhttp.EruException):
+                    client.list_app_containers('app', stream=True)
+                return containers, streamed, plan
+        with FakeEru(apps={'app': 250}) as server:
+            containers, streamed, plan = run(pages(server.url))
+        self.assertEqual(len(containers), 250)
+        self.assertEqual(containers, streamed)
+        self.assertTrue(plan.deploys)
+
+
+@unittest.skipIf(AsyncEruClient is None, 'needs aiohttp')
+class AsyncCoalesceTest(unittest.TestCase):
+
+    def test_one_request(self):
+        async def get_apps(url):
+            async with AsyncEruClient(url, coalesce=True) as client:
+                return await asyncio.gather(*[client.get_app('app') for _ in range(5)])
+        with FakeEru(apps={'app': 1}, latency=0.1) as server:
+            results = run(get_apps(server.url))
+            requests = server.requests
+        self.assertEqual([r['name'] for r in results], ['app'] * 5)
+        self.assertEqual(requests, 1)
+
+
+@unittest.skipIf(AsyncEruClient is None, 'needs aiohttp')
+class AsyncSyncEnvsTest(unittest.TestCase):
+
+    def test_sync_envs(self):
+        async def sync(url):
+            async with AsyncEruClient(url) as client:
+                return await client.sync_envs({'app': {'test': {'HOST': 'new'}, 'dev': None}})
+        with FakeEru() as server:
+            server.envs['app'] = {'prod': {'HOST': 'db'}, 'test': {'HOST': 'old'}, 'dev': {'HOST': 'dev'}}
+            report = run(sync(server.url))
+            envs = server.envs['app']
+        self.assertEqual(sorted((c.env, c.action) for c in report.changes),
+                         [('dev', 'delete'), ('test', 'update')])
+        self.assertFalse(report.failed)
+        self.assertEqual(envs, {'prod': {'HOST': 'db'}, 'test': {'HOST': 'new'}})
+
+
+@unittest.skipIf(AsyncEruClient is None, 'needs aiohttp')
+class AsyncSendTest(unittest.TestCase):
+
+    def run_client(self, url, call, **kwargs):
+        async def send():
+            async with AsyncEruClient(url, health_interval=None, **kwargs) as client:
+                return await call(client), client
+        return run(send())
+    def test_retry_then_success(self):
+        server = CannedServer([http_response(503), http_response(200, b'{"name": "app"}')])
+        try:
+            r, _ = self.run_client(server.url, lambda c: c.get_app('app'), transport=eruhttp.TransportConfig(
+                retry=eruhttp.RetryPolicy(max_retries=1, backoff=0)))
+            self.assertEqual(r, {'name': 'app'})
+            self.assertEqual(server.requests, 2)
+        finally:
+            server.close()
+
+    def test_failover(self):
+        server = CannedServer([http_response(200, b'{"name": "app"}')])
+        try:
+            r, client = self.run_client([refused_url(), server.url], lambda c: c.get_app('app'))
+            self.assertEqual(r, {'name': 'app'})
+            self.assertEqual([n.healthy for n in client.router.nodes], [False, True])
+        finally:
+            server.close()
+
+    def test_deadline(self):
+        server = CannedServer([http_response(503)] * 100)
+        try:
+            started = time.time()
+            with self.assertRaises(eruhttp.EruException):
+                self.run_client(server.url, lambda c: c.get_app('app'), transport=eruhttp.TransportConfig(
+                    retry=eruhttp.RetryPolicy(max_retries=100, backoff=0.05, max_backoff=0.05), deadline=0.3))
+            self.assertLess(time.time() - started, 1)
+            self.assertLess(server.requests, 100)
+        finally:
+            server.close()
+
+    def test_cache(self):
+        server = CannedServer([http_response(200, b'{"name": "app"}')])
+
+        async def twice(client):
+            return [await client.get_app('app'), await client.get_app('app')]
+        try:
+            r, _ = self.run_client(server.url, twice, cache=eruhttp.ResponseCache())
+            self.assertEqual(r, [{'name': 'app'}] * 2)
+            self.assertEqual(server.requests, 1)
+        finally:
+            server.close()
+
+
+def drop_after(conn, path):
+    """Sends `a0`, `a1` then goes away, the third time `a0` to `a2` and a close."""
+    n = 3 if 'third' in path else 2
+    for i in range(n):
+        conn.sendall(websocket_frame('a{0}'.format(i).encode('ascii')))
+    if n == 3:
+        conn.sendall(websocket_frame(struct.pack('!H', 1000), opcode=0x8))
+
+
+@unittest.skipIf(AsyncEruClient is None, 'needs aiohttp')
+class AsyncWebsocketTest(unittest.TestCase):
+
+    def stream(self, url, hooks=None, **kwargs):
+        async def frames():
+            config = eruhttp.StreamConfig(backoff=0.01, max_reconnects=1)
+            async with AsyncEruClient(self.server.url, stream_config=config, hooks=hooks) as client:
+                received = []
+                try:
+                    async for frame in client.request_websocket(url, as_json=False, **kwargs):
+                        received.append(frame)
+                except eruhttp.EruException as e:
+                    return received, e
+                return received, None
+        return run(frames())
+
+    def setUp(self):
+        self.connections = []
+
+        def handler(conn, path):
+            self.connections.append(path)
+            drop_after(conn, path + ('third' if len(self.connections) >= 3 else ''))
+        self.server = WebsocketServer(handler)
+
+    def tearDown(self):
+        self.server.close()
+
+    def test_broken(self):
+        frames, error = self.stream('/websockets/containerlog/c1/')
+        self.assertEqual(frames, ['a0', 'a1'])
+        self.assertIn('broken', error.message)
+        self.assertEqual(len(self.connections), 1)
+
+    def test_resume_count(self):
+        # one reconnect in a row allowed, frames reset the count
+        frames, error = self.stream('/websockets/containerlog/c1/', resume='count')
+        self.assertEqual(frames, ['a0', 'a1', 'a2'])
+        self.assertIsNone(error)
+        self.assertEqual(len(self.connections), 3)
+
+    def test_hooks(self):
+        metrics = eruhttp.MetricsAggregator()
+        self.stream('/websockets/containerlog/c1/', hooks=[metrics])
+        self.stream('/websockets/containerlog/c1/', hooks=[metrics], resume='count')
+        m = metrics.snapshot()['GET /websockets/containerlog/{container_id}/']
+        self.assertEqual((m['count'], m['errors'], m['retries']), (2, 1, 1))
+        # a0 a1, then a0 a1 a2 with the replayed a0 a1 not counted again
+        self.assertEqual(m['bytes_in'], 10)
+
+    def test_multiplex(self):
+        async def frames():
+            async with AsyncEruClient(self.server.url) as client:
+                received = []
+                with self.assertRaises(eruhttp.EruException):
+                    async for tag, stream, frame in client.multiplex_websockets(
+                            [('c1', 1, '/websockets/containerlog/c1/', {})], as_json=False):
+                        received.append(frame)
+                return received
+        self.assertEqual(run(frames()), ['a0', 'a1'])
+
+
+@unittest.skipIf(AsyncEruClient is None, 'needs aiohttp')
+class AsyncDeployFutureTest(unittest.TestCase):
+
+    def test_result(self):
+        async def deploy(url):
+            loop = asyncio.get_event_loop()
+            # the only thread of the default executor is busy
+            loop.set_default_executor(concurrent.futures.ThreadPoolExecutor(1))
+            busy = loop.run_in_executor(None, time.sleep, 2)
+            async with AsyncEruClient(url) as client:
+                futures = [await client.submit_deploy_private('pod', 'app', 1, 2, 'v1', 'web', 'prod', [1])
+                           for _ in range(3)]
+                started = time.time()
+                results = await asyncio.gather(*[f.result(callback_timeout=5) for f in futures])
+                elapsed = time.time() - started
+                client.callback_server.stop()
+            await busy
+            return futures, results, elapsed
+        with FakeEru(task_duration=0.2) as server:
+            futures, results, elapsed = run(deploy(server.url))
+        self.assertTrue(all(f.pushed for f in futures))
+        self.assertEqual([len(r) for r in results], [2, 2, 2])
+        self.assertLess(elapsed, 1)
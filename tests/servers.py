@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""Raw socket servers misbehaving in ways the stand-in ERU server doesn't."""
+import base64
+import hashlib
+import re
+import select
+import socket
+import struct
+import threading
+import time
+
+from benchmarks.fake_server import WEBSOCKET_GUID, websocket_frame
+
+
+def http_response(status, body=b'{}', headers=()):
+    lines = ['HTTP/1.1 {0} X'.format(status), 'Connection: close',
+             'Content-Length: {0}'.format(len(body))] + list(headers)
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('ascii') + body
+
+
+BROKEN_CHUNKED = (b'HTTP/1.1 200 OK\r\nConnection: close\r\nTransfer-Encoding: chunked\r\n\r\n'
+                  b'zz\r\n')
+
+
+class CannedServer(object):
+    """Answers each connection with the next of `responses`, raw bytes,
+    None closes the connection without answering."""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = 0
+        self.sock = socket.socket()
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(8)
+        self.url = 'http://127.0.0.1:{0}/'.format(self.sock.getsockname()[1])
+        self.thread = threading.Thread(target=self.serve)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def serve(self):
+        while self.responses:
+            try:
+                conn, _ = self.sock.accept()
+            except socket.error:
+                return
+            data = b''
+            while b'\r\n\r\n' not in data:
+                chunk = conn.recv(4096)
+                if not chunk:
+                    break
+                data += chunk
+            self.requests += 1
+            response = self.responses.pop(0)
+            if response is not None:
+                conn.sendall(response)
+            conn.close()
+
+    def close(self):
+        self.sock.close()
+
+
+def refused_url():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    url = 'http://127.0.0.1:{0}/'.format(sock.getsockname()[1])
+    sock.close()
+    return url
+
+
+class SilentServer(object):
+    """Accepts tcp connections and never answers the websocket handshake."""
+
+    def __init__(self):
+        self.sock = socket.socket()
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(8)
+        self.url = 'http://127.0.0.1:{0}/'.format(self.sock.getsockname()[1])
+        self.connections = []
+        thread = threading.Thread(target=self.serve)
+        thread.daemon = True
+        thread.start()
+
+    def serve(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except socket.error:
+                return
+            self.connections.append(conn)
+
+    def close(self):
+        self.sock.close()
+        for conn in self.connections:
+            conn.close()
+
+
+def read_frame(conn):
+    """(opcode, payload) of the next frame a client sent, None once it's gone."""
+    def read(n):
+        data = b''
+        while len(data) < n:
+            chunk = conn.recv(n - len(data))
+            if not chunk:
+                raise socket.error('closed')
+            data += chunk
+        return data
+    try:
+        head = bytearray(read(2))
+        n = head[1] & 0x7f
+        if n == 126:
+            n = struct.unpack('!H', read(2))[0]
+        elif n == 127:
+            n = struct.unpack('!Q', read(8))[0]
+        mask = bytearray(read(4)) if head[1] & 0x80 else None
+        payload = bytearray(read(n))
+    except socket.error:
+        return None
+    if mask is not None:
+        for i in range(n):
+            payload[i] ^= mask[i % 4]
+    return head[0] & 0x0f, bytes(payload)
+
+
+class WebsocketServer(object):
+    """Completes websocket handshakes and hands every connection to
+    `handler(conn, path)`, in its own thread. `connections` counts them."""
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.connections = 0
+        self.sock = socket.socket()
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(8)
+        self.url = 'http://127.0.0.1:{0}/'.format(self.sock.getsockname()[1])
+        thread = threading.Thread(target=self.serve)
+        thread.daemon = True
+        thread.start()
+
+    def serve(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except socket.error:
+                return
+            self.connections += 1
+            thread = threading.Thread(target=self.handshake, args=(conn,))
+            thread.daemon = True
+            thread.start()
+
+    def handshake(self, conn):
+        request = b''
+        while b'\r\n\r\n' not in request:
+            chunk = conn.recv(4096)
+            if not chunk:
+                conn.close()
+                return
+            request += chunk
+        path = request.split(b' ')[1].decode('ascii')
+        key = re.search(br'Sec-WebSocket-Key: *(\S+)', request, re.I).group(1)
+        accept = base64.b64encode(hashlib.sha1(key + WEBSOCKET_GUID.encode('ascii')).digest())
+        conn.sendall(b'HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\n'
+                     b'Connection: Upgrade\r\nSec-WebSocket-Accept: ' + accept + b'\r\n\r\n')
+        try:
+            self.handler(conn, path)
+            # unread pongs would turn the close into a reset
+            conn.shutdown(socket.SHUT_WR)
+            conn.settimeout(1)
+            while conn.recv(4096):
+                pass
+        except socket.error:
+            pass
+        finally:
+            conn.close()
+
+    def close(self):
+        self.sock.close()
+
+
+def pong_while_silent(duration, then=(b'done',)):
+    """A :class:`WebsocketServer` handler answering pings and sending no
+    data for `duration` seconds, then the frames of `then` and a close."""
+    def handler(conn, path):
+        deadline = time.time() + duration
+        while time.time() < deadline:
+            if not select.select([conn], [], [], 0.05)[0]:
+                continue
+            frame = read_frame(conn)
+            if frame is None:
+                return
+            if frame[0] == 0x9:
+                conn.sendall(websocket_frame(frame[1], opcode=0xa))
+        for data in then:
+            conn.sendall(websocket_frame(data))
+        conn.sendall(websocket_frame(struct.pack('!H', 1000), opcode=0x8))
+    return handler
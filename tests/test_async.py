@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+"""Loads the tests of `async_cases`, which python 2 can't even parse."""
+import unittest
+
+import six
+
+if six.PY3:
+    from tests.async_cases import *  # noqa: F401,F403
+
+
+if __name__ == '__main__':
+    unittest.main()
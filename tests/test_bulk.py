@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+import time
+import unittest
+
+import eruhttp
+from benchmarks.fake_server import FakeEru
+
+
+class BulkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeEru(latency=0.05).start()
+        self.client = eruhttp.EruClient(self.server.url)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+
+    def test_results(self):
+        def get(key):
+            if key % 3 == 0:
+                raise eruhttp.EruException(404, 'not found')
+            return self.client.get_container(str(key))
+        results = list(self.client.bulk(get, range(12), concurrency=4))
+        self.assertEqual(sorted(r.key for r in results), list(range(12)))
+        for r in results:
+            if r.key % 3 == 0:
+                self.assertEqual((r.result, r.error.code), (None, 404))
+            else:
+                self.assertEqual((r.result['container_id'], r.error), (str(r.key), None))
+
+    def test_concurrency(self):
+        started = time.time()
+        list(self.client.stop_containers(range(16), concurrency=8))
+        # 2 rounds of 8, not 16 requests one after the other
+        self.assertLess(time.time() - started, 16 * 0.05 / 2)
+
+    def test_abort(self):
+        results = self.client.stop_containers(range(200), concurrency=4)
+        next(results)
+        results.close()
+        time.sleep(0.3)
+        # those in flight and the one taken to replace the first, not the 200
+        self.assertLessEqual(self.server.requests, 5)
+
+    def test_raise(self):
+        def fail(key):
+            raise ValueError(key)
+        with self.assertRaises(ValueError):
+            list(eruhttp._run_concurrently(fail, range(10), 4))
+
+
+if __name__ == '__main__':
+    unittest.main()
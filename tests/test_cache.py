@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+import time
+import unittest
+
+import eruhttp
+from benchmarks.fake_server import FakeEru
+from tests.servers import CannedServer, http_response
+
+APP = '/api/app/{name}/'
+
+
+class ResponseCacheTest(unittest.TestCase):
+
+    def test_lru(self):
+        cache = eruhttp.ResponseCache(maxsize=2)
+        for name in ('a', 'b'):
+            cache.set(cache.key('/api/app/' + name, {}), APP, {'name': name}, name)
+        # `a` is now the most recently used, `b` goes first
+        self.assertEqual(cache.get(cache.key('/api/app/a', {})).value, 'a')
+        cache.set(cache.key('/api/app/c', {}), APP, {'name': 'c'}, 'c')
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get(cache.key('/api/app/b', {})))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_no_ttl(self):
+        cache = eruhttp.ResponseCache(ttls={})
+        cache.set(cache.key('/api/app/a', {}), APP, {'name': 'a'}, 'a')
+        self.assertEqual(len(cache), 0)
+
+    def test_expired(self):
+        cache = eruhttp.ResponseCache(ttls={APP: 0.01})
+        key = cache.key('/api/app/a', {})
+        cache.set(key, APP, {'name': 'a'}, 'a')
+        time.sleep(0.02)
+        entry = cache.get(key)
+        self.assertEqual(entry.value, 'a')
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+        cache.touch(entry)
+        self.assertGreater(entry.expires, time.time())
+
+    def test_invalidate(self):
+        cache = eruhttp.ResponseCache()
+        for name in ('a', 'b'):
+            cache.set(cache.key('/api/app/' + name, {}), APP, {'name': name}, name)
+        cache.invalidate_for('PUT', '/api/app/{name}/env/', {'name': 'a'})
+        self.assertEqual(len(cache), 2)
+        cache.invalidate_for('POST', '/api/app/register/', {'name': 'a'})
+        self.assertIsNone(cache.get(cache.key('/api/app/a', {})))
+        self.assertEqual(cache.get(cache.key('/api/app/b', {})).value, 'b')
+
+
+class ClientCacheTest(unittest.TestCase):
+
+    def test_revalidate(self):
+        server = CannedServer([http_response(200, b'{"name": "app"}', ['ETag: "1"']),
+                               http_response(304, b'')])
+        try:
+            cache = eruhttp.ResponseCache(ttls={APP: 0.01})
+            client = eruhttp.EruClient(server.url, cache=cache)
+            self.assertEqual(client.get_app('app'), {'name': 'app'})
+            time.sleep(0.02)
+            self.assertEqual(client.get_app('app'), {'name': 'app'})
+            self.assertEqual(server.requests, 2)
+        finally:
+            server.close()
+
+    def test_invalidated_by_writes(self):
+        with FakeEru() as server:
+            client = eruhttp.EruClient(server.url, cache=eruhttp.ResponseCache())
+            self.assertEqual(client.list_app_env_names('app')['data'], [])
+            client.set_app_env('app', 'prod', HOST='db')
+            self.assertEqual(client.list_app_env_names('app')['data'], ['prod'])
+            requests = server.requests
+            client.list_app_env_names('app')
+            self.assertEqual(server.requests, requests)
+
+
+if __name__ == '__main__':
+    unittest.main()
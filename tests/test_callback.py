@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+import json
+import unittest
+
+import requests
+
+import eruhttp
+from benchmarks.fake_server import FakeEru
+
+
+class CallbackServerTest(unittest.TestCase):
+
+    def test_deploy(self):
+        with FakeEru() as server:
+            client = eruhttp.EruClient(server.url)
+            future = client.submit_deploy_private('pod', 'app', 1, 3, 'v1', 'web', 'prod', [1])
+            callbacks = future.result(callback_timeout=5)
+            self.assertTrue(future.pushed)
+            self.assertEqual(len(callbacks), 3)
+            # the server ERU reaches locally listens there only
+            self.assertEqual(client.callback_server.url.split(':')[1], '//127.0.0.1')
+            client.callback_server.stop()
+
+    def test_forged(self):
+        with eruhttp.CallbackServer('127.0.0.1') as server:
+            waiter = server.register()
+            other = server.register()
+            self.assertNotEqual(waiter.token, other.token)
+            self.assertEqual(len(waiter.token), 32)
+            forged = requests.post(server.url + 'callback/{0:016x}/'.format(1), data=json.dumps({}))
+            self.assertEqual(forged.status_code, 404)
+            self.assertFalse(waiter.done())
+            self.assertEqual(requests.post(waiter.url, json={'ok': 1}).status_code, 200)
+            self.assertTrue(waiter.wait(1))
+            self.assertEqual(waiter.callbacks, [{'ok': 1}])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import erucli
+from benchmarks.fake_server import FakeEru
+
+
+class Commands(object):
+
+    def slow_log(self, lines, pause=0.1):
+        for i in range(lines):
+            time.sleep(pause)
+            yield i
+
+    def broken(self, name):
+        return len(name) + None
+
+
+class CallTest(unittest.TestCase):
+
+    def test_wrong_arguments(self):
+        with self.assertRaises(erucli.CliError) as cm:
+            list(erucli.call(Commands(), 'slow_log', [], {'lines': 1, 'follow': True}))
+        self.assertEqual(cm.exception.code, 2)
+
+    def test_bug_is_not_usage_error(self):
+        with self.assertRaises(TypeError):
+            list(erucli.call(Commands(), 'broken', ['app'], {}))
+
+    def test_run_direct(self):
+        with FakeEru(apps={'app': 1}) as server:
+            self.assertEqual(list(erucli.run_direct(server.url, 5, 'get_app', ['app'], {}))[0][0],
+                             'result')
+            with self.assertRaises(erucli.CliError) as cm:
+                list(erucli.run_direct(server.url, 5, 'get_app', [], {}))
+            self.assertEqual(cm.exception.code, 2)
+            requests = server.requests
+        self.assertEqual(requests, 1)
+
+
+class DaemonTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'eru.sock')
+        self.daemon = erucli.Daemon(self.path, idle=0.2)
+        self.daemon.client = lambda url, timeout: Commands()
+        self.thread = threading.Thread(target=self.daemon.serve)
+        self.thread.start()
+        while self.daemon.server is None:
+            time.sleep(0.01)
+
+    def tearDown(self):
+        if self.thread.is_alive():
+            self.daemon.stop()
+        self.thread.join()
+        shutil.rmtree(self.directory)
+
+    def run_command(self, method, *args, **kwargs):
+        return list(erucli.run_daemon(self.path, 0.2, 'http://eru', 5, method, list(args), kwargs))
+
+    def test_stream_outlives_idle(self):
+        # streams for 0.5s, more than `idle` between the start and the end
+        items = []
+        for item in erucli.run_daemon(self.path, 0.2, 'http://eru', 5, 'slow_log', [5], {}):
+            items.append(item)
+            self.assertTrue(self.thread.is_alive())
+        self.assertEqual(items, [('item', i) for i in range(5)])
+        self.thread.join(2)
+        self.assertFalse(self.thread.is_alive())
+
+    def test_wrong_arguments(self):
+        with self.assertRaises(erucli.CliError) as cm:
+            self.run_command('slow_log')
+        self.assertEqual(cm.exception.code, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+import unittest
+
+import eruhttp
+from benchmarks.fake_server import FakeEru
+
+
+class SingleFlightTest(unittest.TestCase):
+
+    def run_flights(self, func, n=5):
+        flight = eruhttp.SingleFlight()
+        results = []
+        lock = threading.Lock()
+
+        def call():
+            try:
+                r = flight.do('key', func)
+            except Exception as e:
+                r = e
+            with lock:
+                results.append(r)
+        threads = [threading.Thread(target=call) for _ in range(n)]
+        for t in threads:
+            t.start()
+        return flight, threads, results
+
+    def test_shared_result(self):
+        release = threading.Event()
+        calls = []
+
+        def func():
+            calls.append(1)
+            release.wait()
+            return 'result'
+        flight, threads, results = self.run_flights(func)
+        # let every thread join the flight
+        time.sleep(0.1)
+        release.set()
+        for t in threads:
+            t.join()
+        self.assertEqual(results, ['result'] * 5)
+        self.assertEqual(len(calls), 1)
+        # the next call isn't shared with the finished flight
+        self.assertEqual(flight.do('key', lambda: 'again'), 'again')
+
+    def test_shared_error(self):
+        release = threading.Event()
+        error = eruhttp.EruException(500, 'boom')
+
+        def func():
+            release.wait()
+            raise error
+        _, threads, results = self.run_flights(func)
+        release.set()
+        for t in threads:
+            t.join()
+        self.assertEqual(results, [error] * 5)
+
+    def test_key(self):
+        self.assertEqual(eruhttp._single_flight_key('/api/app/a/', {}),
+                         eruhttp._single_flight_key('/api/app/a/', {'params': {'start': 0}}))
+        self.assertIsNone(eruhttp._single_flight_key('/api/app/a/', {'params': {}, 'stream': True}))
+
+
+class CoalesceTest(unittest.TestCase):
+
+    def test_one_request(self):
+        with FakeEru(apps={'app': 1}, latency=0.2) as server:
+            client = eruhttp.EruClient(server.url, coalesce=True)
+            results = []
+            threads = [threading.Thread(target=lambda: results.append(client.get_app('app')))
+                       for _ in range(5)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            requests = server.requests
+            client.close()
+        self.assertEqual(len(results), 5)
+        self.assertEqual(requests, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+import unittest
+import zlib
+
+import eruhttp
+from benchmarks.fake_server import FakeEru
+
+DOC = {u'name': u'app', u'env': {u'MOTTO': u'ça va', u'N': 1}, u'ids': [1, 2.5, None, True]}
+
+
+class JsonCodecTest(unittest.TestCase):
+
+    def test_codecs(self):
+        self.assertIn('json', eruhttp.JSON_CODECS)
+        for name, codec in eruhttp.JSON_CODECS.items():
+            encoded = codec.dumps(DOC)
+            self.assertIsInstance(encoded, bytes, name)
+            self.assertEqual(codec.loads(encoded), DOC, name)
+            self.assertEqual(codec.loads(encoded.decode('utf-8')), DOC, name)
+
+    def test_json_codec(self):
+        self.assertIs(eruhttp.json_codec(), list(eruhttp.JSON_CODECS.values())[0])
+        self.assertEqual(eruhttp.json_codec('json').name, 'json')
+        with self.assertRaises(eruhttp.EruException):
+            eruhttp.json_codec('nope')
+
+
+class CompressionTest(unittest.TestCase):
+
+    def test_encode_body(self):
+        transport = eruhttp.TransportConfig(codec='json', compress_min_size=100)
+        headers = {}
+        self.assertEqual(transport.encode_body(DOC, headers), eruhttp.json_codec('json').dumps(DOC))
+        self.assertEqual(headers, {'Content-Type': 'application/json'})
+
+        big = dict(DOC, pad='x' * 1000)
+        body = transport.encode_body(big, headers)
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        self.assertLess(len(body), 200)
+        self.assertEqual(transport.codec.loads(zlib.decompress(body, 31)), big)
+
+    def test_client(self):
+        transport = eruhttp.TransportConfig(compress_min_size=512)
+        pad = 'x' * 4096
+        with FakeEru(apps={'app': 50}, gzip=True) as server:
+            client = eruhttp.EruClient(server.url, transport=transport)
+            client.set_app_env('app', 'prod', PAD=pad)
+            containers = client.list_app_containers('app', limit=50)
+            received, sent = server.bytes_received, server.bytes_sent
+            envs = server.envs['app']['prod']
+            client.close()
+        self.assertEqual(envs, {'PAD': pad})
+        self.assertLess(received, 1024)
+        self.assertEqual(len(containers), 50)
+        self.assertLess(sent, len(eruhttp.json_codec('json').dumps(containers)) / 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
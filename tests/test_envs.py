@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+import eruhttp
+from benchmarks.fake_server import FakeEru
+
+
+class SyncEnvsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeEru().start()
+        self.server.envs.update({
+            'app': {'prod': {'HOST': 'db'}, 'test': {'HOST': 'old'}, 'dev': {'HOST': 'dev'}},
+        })
+        self.client = eruhttp.EruClient(self.server.url)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+
+    def actions(self, report):
+        return sorted((c.app, c.env, c.action) for c in report.changes)
+
+    def test_dry_run(self):
+        report = self.client.sync_envs({'app': {'prod': {'HOST': 'db'}, 'test': {'HOST': 'new'}}},
+                                       dry_run=True)
+        self.assertEqual(self.actions(report), [('app', 'test', 'update')])
+        self.assertEqual(report.unchanged, [('app', 'prod')])
+        self.assertEqual(self.server.envs['app']['test'], {'HOST': 'old'})
+
+    def test_apply(self):
+        report = self.client.sync_envs({'app': {'test': {'HOST': 'new'}, 'dev': None,
+                                                'stage': {'HOST': 'stage'}}})
+        self.assertEqual(self.actions(report), [('app', 'dev', 'delete'), ('app', 'stage', 'create'),
+                                                ('app', 'test', 'update')])
+        self.assertFalse(report.failed)
+        self.assertEqual(self.server.envs['app'], {'prod': {'HOST': 'db'}, 'test': {'HOST': 'new'},
+                                                   'stage': {'HOST': 'stage'}})
+
+    def test_prune(self):
+        desired = {'app': {'prod': {'HOST': 'db'}}}
+        self.assertEqual(self.client.sync_envs(desired).changes, [])
+        report = self.client.sync_envs(desired, prune=True)
+        self.assertEqual(self.actions(report), [('app', 'dev', 'delete'), ('app', 'test', 'delete')])
+        self.assertEqual(sorted(self.server.envs['app']), ['prod'])
+
+    def test_argument_names(self):
+        report = self.client.sync_envs({'app': {'prod': {'HOST': 'db', 'name': 'x'},
+                                                'test': {'env': 'x'}}})
+        failed = report.failed
+        self.assertEqual([(c.env, c.action) for c in failed], [('test', 'update')])
+        self.assertIsInstance(failed[0].error, eruhttp.EruException)
+        self.assertEqual(self.server.envs['app']['prod'], {'HOST': 'db', 'name': 'x'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+import eruhttp
+from benchmarks.fake_server import FakeEru
+from tests.servers import CannedServer, http_response
+
+APP = 'GET /api/app/{name}/'
+
+
+class Collect(eruhttp.RequestHook):
+
+    def __init__(self):
+        self.events = []
+
+    def before_request(self, info):
+        self.events.append(('before', info.endpoint, info.latency))
+
+    def after_request(self, info):
+        self.events.append(('after', info.endpoint, info.status, info.response))
+
+
+class RequestHookTest(unittest.TestCase):
+
+    def test_order(self):
+        hook = Collect()
+        with FakeEru(apps={'app': 1}) as server:
+            client = eruhttp.EruClient(server.url, hooks=[hook])
+            client.get_app('app')
+        self.assertEqual(hook.events, [
+            ('before', '/api/app/{name}/', None),
+            ('after', '/api/app/{name}/', 200, {'name': 'app', 'git': 'git@example.com:app.git'}),
+        ])
+
+
+class MetricsAggregatorTest(unittest.TestCase):
+
+    def test_snapshot(self):
+        metrics = eruhttp.MetricsAggregator()
+        with FakeEru(apps={'app': 1}) as server:
+            client = eruhttp.EruClient(server.url, hooks=[metrics])
+            client.get_app('app')
+            with self.assertRaises(eruhttp.EruException):
+                client.get_app('unknown')
+            client.get_container('c1')
+        snapshot = metrics.snapshot()
+        self.assertEqual(sorted(snapshot), [APP, 'GET /api/container/{container_id}/'])
+        m = snapshot[APP]
+        self.assertEqual((m['count'], m['errors'], m['retries']), (2, 1, 0))
+        self.assertEqual(m['statuses'], {'200': 1, '404': 1})
+        self.assertGreater(m['bytes_in'], 0)
+        self.assertEqual(sum(m['latency']['buckets'].values()), 2)
+
+        metrics.reset()
+        self.assertEqual(metrics.snapshot(), {})
+
+    def test_retries(self):
+        server = CannedServer([http_response(503, b'{}'), http_response(200, b'{"name": "app"}')])
+        try:
+            metrics = eruhttp.MetricsAggregator()
+            transport = eruhttp.TransportConfig(retry=eruhttp.RetryPolicy(backoff=0.01))
+            client = eruhttp.EruClient(server.url, transport=transport, hooks=[metrics])
+            self.assertEqual(client.get_app('app'), {'name': 'app'})
+        finally:
+            server.close()
+        m = metrics.snapshot()[APP]
+        self.assertEqual((m['count'], m['errors'], m['retries']), (1, 0, 1))
+        self.assertEqual(m['statuses'], {'200': 1})
+
+    def test_quantile(self):
+        m = eruhttp._EndpointMetrics()
+        m.count = 100
+        m.buckets[0] = 98
+        m.buckets[3] = 2
+        self.assertEqual(m.quantile(0.5), 0.005)
+        self.assertEqual(m.quantile(0.99), 0.05)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import threading
+import unittest
+
+import eruhttp
+from benchmarks.fake_server import FakeEru
+
+
+class InventoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeEru(apps={'app': 20, 'other': 4}, hosts_per_pod=4).start()
+        self.client = eruhttp.EruClient(self.server.url)
+        self.inventory = eruhttp.Inventory(self.client)
+        self.inventory.crawl()
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+
+    def test_crawl(self):
+        self.assertEqual(len(self.inventory), 24)
+        self.assertEqual(len(self.inventory.containers(app='other')), 4)
+        self.assertEqual(len(self.inventory.containers(app='app', host='host1')), 5)
+
+    def test_dirty_from_body(self):
+        self.client.deploy_private('pod0', 'other', 1, 1, 'v0', 'web', 'prod', [1], host_name='host2')
+        self.assertEqual(self.inventory._dirty, set([('app', 'other'), ('host', 'host2')]))
+
+        self.inventory._dirty.clear()
+        self.client.offline_version('pod0', 'app', 'v1')
+        self.assertEqual(self.inventory._dirty, set([('app', 'app')]))
+
+        self.inventory._dirty.clear()
+        c = self.inventory.containers(app='other', host='host3')[0]
+        self.client.remove_containers([c['container_id'], 'unknown'])
+        self.assertEqual(self.inventory._dirty, set([('app', 'other'), ('host', 'host3')]))
+
+    def test_close(self):
+        self.inventory.close()
+        self.assertNotIn(self.inventory, self.client.hooks)
+        self.client.offline_version('pod0', 'app', 'v1')
+        self.assertEqual(self.inventory._dirty, set())
+        self.assertEqual(len(self.inventory), 24)
+
+    def test_refresh_unlocked(self):
+        inventory = self.inventory
+        locked = []
+
+        class Probe(eruhttp.RequestHook):
+
+            def before_request(self, info):
+                def probe():
+                    held = not inventory._lock.acquire(False)
+                    if not held:
+                        inventory._lock.release()
+                    locked.append(held)
+                t = threading.Thread(target=probe)
+                t.start()
+                t.join()
+
+        self.client.hooks.append(Probe())
+        inventory.mark_dirty(apps=['other'])
+        inventory.refresh()
+        self.assertTrue(locked)
+        self.assertFalse(any(locked))
+        self.assertEqual(len(inventory.containers(app='other')), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
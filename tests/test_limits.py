@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+import unittest
+
+import eruhttp
+from benchmarks.fake_server import FakeEru
+
+
+class LimiterTest(unittest.TestCase):
+
+    def test_concurrency(self):
+        limiter = eruhttp.Limiter(concurrency=2)
+        self.assertEqual(limiter.try_acquire(), 0)
+        self.assertEqual(limiter.try_acquire(), 0)
+        self.assertIsNone(limiter.try_acquire())
+        self.assertFalse(limiter.acquire(deadline=time.time() + 0.01))
+        threading.Timer(0.05, limiter.release).start()
+        self.assertTrue(limiter.acquire(deadline=time.time() + 2))
+        self.assertEqual(limiter.in_flight, 2)
+
+    def test_rate(self):
+        limiter = eruhttp.Limiter(rate=20, burst=2)
+        self.assertEqual([limiter.try_acquire() for _ in range(2)], [0, 0])
+        wait = limiter.try_acquire()
+        self.assertGreater(wait, 0)
+        self.assertLessEqual(wait, 0.05)
+        started = time.time()
+        self.assertTrue(limiter.acquire())
+        self.assertGreater(time.time() - started, 0.03)
+
+    def test_adaptive(self):
+        limiter = eruhttp.Limiter(concurrency=8, adaptive=True, min_concurrency=2)
+        # fast and fine while the limit is used: grows
+        for _ in range(8):
+            limiter.try_acquire()
+        for _ in range(8):
+            limiter.release(0.01)
+        self.assertGreater(limiter.limit, 8)
+        # a 5xx: cut once a round trip
+        limit = limiter.limit
+        limiter.try_acquire()
+        limiter.release(0.01, failed=True)
+        self.assertEqual(limiter.limit, limit * 0.5)
+        limiter.try_acquire()
+        limiter.release(0.01, failed=True)
+        self.assertEqual(limiter.limit, limit * 0.5)
+        time.sleep(0.02)
+        # latency over the tolerance is congestion too, never under min_concurrency
+        for _ in range(3):
+            limiter.try_acquire()
+            limiter.release(0.1)
+            time.sleep(0.1)
+        self.assertEqual(limiter.limit, 2)
+
+
+class TransportLimitsTest(unittest.TestCase):
+
+    def test_limiters(self):
+        read, deploy, everything = eruhttp.Limiter(), eruhttp.Limiter(), eruhttp.Limiter()
+        transport = eruhttp.TransportConfig(limits={'read': read, 'deploy': deploy, '*': everything})
+        self.assertEqual(transport.limiters('GET', '/api/app/app/'), [read, everything])
+        self.assertEqual(transport.limiters('POST', '/api/deploy/private/'), [deploy, everything])
+        self.assertEqual(transport.limiters('PUT', '/api/app/app/env/'), [everything])
+        self.assertEqual(eruhttp.TransportConfig().limiters('GET', '/api/app/app/'), ())
+
+    def test_client(self):
+        limiter = eruhttp.Limiter(concurrency=1)
+        transport = eruhttp.TransportConfig(limits={'read': limiter}, deadline=0.1)
+        with FakeEru(apps={'app': 1}) as server:
+            client = eruhttp.EruClient(server.url, transport=transport)
+            self.assertEqual(client.get_app('app')['name'], 'app')
+            self.assertEqual(limiter.in_flight, 0)
+            # the only slot is taken, the request gives up at its deadline
+            limiter.try_acquire()
+            with self.assertRaises(eruhttp.EruException):
+                client.get_app('app')
+            requests = server.requests
+            client.close()
+        self.assertEqual(requests, 1)
+        self.assertEqual(limiter.in_flight, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+import json
+import unittest
+
+import eruhttp
+from tests.servers import CannedServer, http_response
+
+
+class IPPoolTest(unittest.TestCase):
+
+    def test_never_handed_out(self):
+        pool = eruhttp.IPPool('10.0.0.0/29', reserved=['10.0.0.5'])
+        self.assertEqual(pool.free, 4)
+        self.assertEqual(sorted(pool.allocate(4)), ['10.0.0.2', '10.0.0.3', '10.0.0.4', '10.0.0.6'])
+        self.assertEqual(pool.free, 0)
+        with self.assertRaises(eruhttp.EruException):
+            pool.allocate(1)
+
+    def test_mark_used(self):
+        pool = eruhttp.IPPool('10.100.0.0/16')
+        # container vlan addresses carry a prefix, others aren't in the pool
+        self.assertEqual(pool.mark_used(['10.100.0.2/16', '10.100.0.2', '10.101.0.2']), 1)
+        self.assertFalse(pool.is_free('10.100.0.2'))
+        self.assertNotIn('10.101.0.2', pool)
+        self.assertEqual(pool.allocate(1), ['10.100.0.3'])
+
+    def test_allocate_all_or_nothing(self):
+        pool = eruhttp.IPPool('10.0.0.0/28')
+        with self.assertRaises(eruhttp.EruException):
+            pool.allocate(pool.free + 1)
+        self.assertEqual(pool.free, 13)
+        self.assertEqual(len(set(pool.allocate(13))), 13)
+
+    def test_release(self):
+        pool = eruhttp.IPPool('10.0.0.0/24')
+        first = pool.allocate(200)
+        # the search goes on past the released addresses
+        pool.release(first[:10] + ['10.0.0.1', '10.0.0.255'])
+        self.assertEqual(pool.free, 63)
+        self.assertFalse(pool.is_free('10.0.0.1'))
+        second = pool.allocate(53)
+        self.assertFalse(set(first[:10]) & set(second))
+        self.assertEqual(sorted(pool.allocate(10)), sorted(first[:10]))
+
+    def test_too_large(self):
+        with self.assertRaises(eruhttp.EruException):
+            eruhttp.IPPool('10.0.0.0/7')
+
+
+class NetworkIndexTest(unittest.TestCase):
+
+    def test_refresh(self):
+        # more networks than a page, the list isn't paged
+        networks = [{'id': i, 'name': 'net{0}'.format(i), 'netspace': '10.{0}.0.0/16'.format(i)}
+                    for i in range(150)]
+        server = CannedServer([http_response(200, json.dumps(networks).encode('ascii'))])
+        try:
+            index = eruhttp.NetworkIndex(eruhttp.EruClient(server.url))
+            self.assertEqual(index.refresh(), networks)
+            self.assertEqual(index.get('net42')['id'], 42)
+            self.assertEqual(server.requests, 1)
+        finally:
+            server.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
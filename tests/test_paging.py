@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+import eruhttp
+from benchmarks.fake_server import FakeEru
+
+
+class IterPagesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeEru(apps={'app': 250}).start()
+        self.client = eruhttp.EruClient(self.server.url)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+
+    def test_pages(self):
+        for prefetch in (0, 4):
+            containers = list(self.client.iter_app_containers('app', page_size=100, prefetch=prefetch))
+            self.assertEqual(len(containers), 250)
+            self.assertEqual(len(set(c['container_id'] for c in containers)), 250)
+
+    def test_stream(self):
+        streamed = list(self.client.iter_app_containers('app', page_size=100, stream=True))
+        self.assertEqual(streamed, list(self.client.iter_app_containers('app', page_size=100)))
+
+    def test_records(self):
+        containers = list(self.client.iter_app_containers('app', records=True, stream=True))
+        self.assertTrue(all(isinstance(c, eruhttp.Container) for c in containers))
+        self.assertEqual(len(containers), 250)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+import copy
+import pickle
+import unittest
+
+import six
+
+import eruhttp
+from benchmarks.fake_server import FakeEru
+
+
+class RecordTest(unittest.TestCase):
+
+    def setUp(self):
+        server = FakeEru()
+        self.raw = server.container('app', 7)
+        server.stop()
+        self.c = eruhttp.Container.from_dict(self.raw)
+
+    def test_read(self):
+        c = self.c
+        self.assertEqual(c.appname, 'app')
+        self.assertEqual(c['entrypoint'], 'worker')
+        self.assertEqual(c['cores']['full'], self.raw['cores']['full'])
+        self.assertEqual(c.get('props'), {})
+        self.assertIsNone(c.get('missing'))
+        self.assertIn('networks', c)
+        self.assertNotIn('missing', c)
+        with self.assertRaises(KeyError):
+            c['missing']
+        with self.assertRaises(AttributeError):
+            c.missing
+
+    def test_to_dict(self):
+        self.assertEqual(self.c.to_dict(), self.raw)
+        self.assertEqual(eruhttp.Container.from_dict(self.raw), self.c)
+        self.assertNotEqual(eruhttp.Host.from_dict(self.raw), self.c)
+
+    def test_pickle(self):
+        for c in (pickle.loads(pickle.dumps(self.c, 2)), copy.deepcopy(self.c)):
+            self.assertEqual(c, self.c)
+            self.assertEqual(c.podname, 'pod1')
+
+    @unittest.skipIf(six.PY2, 'json decodes to unicode, not interned on python 2')
+    def test_interned(self):
+        other = eruhttp.Container.from_dict(dict(self.raw, podname=''.join(['po', 'd1'])))
+        self.assertIs(other.podname, self.c.podname)
+
+
+class ClientRecordsTest(unittest.TestCase):
+
+    def test_records(self):
+        with FakeEru(apps={'app': 150}) as server:
+            client = eruhttp.EruClient(server.url)
+            dicts = list(client.iter_app_containers('app'))
+            records = list(client.iter_app_containers('app', records=True))
+            page = client.list_app_containers('app', limit=5, records=True)
+            client.close()
+        self.assertTrue(all(isinstance(c, eruhttp.Container) for c in records + page))
+        self.assertEqual([c.to_dict() for c in records], dicts)
+        # the planners take records as they are
+        plan = eruhttp._plan_scale_in('app', eruhttp.ContainerIndex(records), 1, None, 2)
+        self.assertEqual(plan.to_remove,
+                         eruhttp._plan_scale_in('app', eruhttp.ContainerIndex(dicts), 1, None, 2).to_remove)
+
+
+if __name__ == '__main__':
+    unittest.main()
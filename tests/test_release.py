@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+import eruhttp
+from benchmarks.fake_server import FakeEru
+
+DEPLOYS = [dict(pod_name=pod, ncore=1, ncontainer=2, entrypoint='web', env='prod', network_ids=[1])
+           for pod in ('pod0', 'pod1')]
+
+
+class FailingClient(eruhttp.EruClient):
+
+    def deploy_private(self, *args, **kwargs):
+        if kwargs.get('app_name') == 'bad':
+            raise eruhttp.EruException(400, 'no resource')
+        return super(FailingClient, self).deploy_private(*args, **kwargs)
+
+
+class ReleaseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeEru(task_duration=0.1, log_lines=3).start()
+        self.client = FailingClient(self.server.url)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+
+    def test_run(self):
+        specs = [eruhttp.ReleaseSpec('app0', 'v1', 'base', 'pod0', DEPLOYS),
+                 eruhttp.ReleaseSpec('app1', 'v1', 'base', 'pod0', DEPLOYS),
+                 eruhttp.ReleaseSpec('prebuilt', 'v1', None, 'pod0', DEPLOYS[:1]),
+                 eruhttp.ReleaseSpec('bad', 'v1', None, 'pod0', DEPLOYS[:1])]
+        release = eruhttp.Release(self.client, specs, concurrency={'build': 1})
+        app0, app1, prebuilt, bad = release.run()
+
+        for result in (app0, app1):
+            self.assertTrue(result.ok)
+            self.assertIsNotNone(result.build_task)
+            self.assertEqual(len(result.build_log), 3)
+            self.assertEqual(len(result.deploys), 2)
+            self.assertEqual(len(result.tasks), 2)
+            self.assertEqual(len(result.containers), 4)
+        self.assertIsNone(prebuilt.build_task)
+        self.assertEqual(len(prebuilt.containers), 2)
+        self.assertFalse(bad.ok)
+        self.assertEqual([(stage, e.code) for stage, e in bad.errors], [('deploy', 400)])
+
+        # app0 is deployed while app1 is still building
+        build1 = [t for t in app1.timings if t.stage == 'build'][0]
+        deploys0 = [t for t in app0.timings if t.stage == 'deploy']
+        self.assertLess(min(t.started for t in deploys0), build1.started + build1.latency)
+
+        report = release.report()
+        self.assertEqual(report['stages']['build']['count'], 2)
+        self.assertEqual(report['stages']['deploy']['count'], 6)
+        self.assertEqual(report['stages']['deploy']['failed'], 1)
+        self.assertEqual(report['stages']['poll']['count'], 5)
+        self.assertGreaterEqual(report['wall'], 0.2)
+
+
+if __name__ == '__main__':
+    unittest.main()
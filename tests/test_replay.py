@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+
+import eruhttp
+from benchmarks.fake_server import FakeEru
+from benchmarks.replay import replay
+
+
+class TrafficRecorderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.server = FakeEru(apps={'app': 5}, log_lines=3).start()
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.directory)
+
+    def record(self, name, **kwargs):
+        path = os.path.join(self.directory, name)
+        recorder = eruhttp.TrafficRecorder(path, **kwargs)
+        client = eruhttp.EruClient(self.server.url, hooks=[recorder])
+        client.get_app('app')
+        with self.assertRaises(eruhttp.EruException):
+            client.get_app('unknown')
+        client.set_app_env('app', 'prod', PASSWORD='hunter2')
+        client.post('/api/app/register/', json={'name': 'new', 'token': 'abc', 'git': 'git'},
+                    expected_code=201)
+        list(client.container_log('c1'))
+        recorder.close()
+        client.close()
+        return list(eruhttp.read_traffic(path))
+
+    def test_record(self):
+        entries = self.record('traffic.jsonl', buffer_size=2)
+        self.assertEqual([(e['method'], e['endpoint'], e['status']) for e in entries], [
+            ('GET', '/api/app/{name}/', 200),
+            ('GET', '/api/app/{name}/', 404),
+            ('PUT', '/api/app/{name}/env/', 200),
+            ('POST', '/api/app/register/', 201),
+            ('GET', '/websockets/containerlog/{container_id}/', None),
+        ])
+        ok, missing, env, register, log = entries
+        self.assertEqual(ok['response']['name'], 'app')
+        self.assertEqual(missing['error'][0], 404)
+        self.assertEqual(env['body'], {'env': 'prod', 'PASSWORD': eruhttp.REDACTED})
+        self.assertEqual(register['body']['token'], eruhttp.REDACTED)
+        self.assertEqual(register['body']['name'], 'new')
+        self.assertEqual((log['kind'], log['frames']), ('websocket', 3))
+        self.assertTrue(all(e['t'] <= f['t'] for e, f in zip(entries, entries[1:])))
+        self.assertTrue(all(e['latency'] >= 0 for e in entries))
+
+    def test_gzip(self):
+        entries = self.record('traffic.jsonl.gz', buffer_size=2, responses=False)
+        with open(os.path.join(self.directory, 'traffic.jsonl.gz'), 'rb') as f:
+            self.assertEqual(f.read(2), b'\x1f\x8b')
+        self.assertEqual(len(entries), 5)
+        self.assertTrue(all(e['response'] is None for e in entries))
+        self.assertGreater(entries[0]['bytes_in'], 0)
+
+    def test_replay(self):
+        entries = self.record('traffic.jsonl')
+        requests = self.server.requests
+        stats = replay(entries, self.server.url, speed=0, workers=2)
+        self.assertEqual(stats['requests'], 5)
+        self.assertEqual(stats['errors'], {'404': 1})
+        self.assertEqual(self.server.requests, requests * 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
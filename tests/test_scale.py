@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+import unittest
+
+import eruhttp
+from benchmarks.fake_server import FakeEru
+
+
+class ScalePlanTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # more containers than a single page of the old planner
+        cls.server = FakeEru(apps={'app': 300}).start()
+        cls.client = eruhttp.EruClient(cls.server.url)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.client.close()
+        cls.server.stop()
+
+    def test_scale_out(self):
+        plan = self.client.plan_scale_out('app', pod_name='pod0', ceiling=200)
+        self.assertEqual(plan.pod_name, 'pod0')
+        groups = dict(((g.version, g.entrypoint), g) for g in plan.deploys)
+        self.assertEqual(len(groups), 6)
+        # the 3 containers in removal are not counted
+        self.assertEqual(sum(g.current_ncontainer for g in plan.deploys), 297)
+        web = groups[('v0', 'web')]
+        self.assertEqual((web.current_ncontainer, web.ncontainer, web.ncore), (50, 50, 1))
+        self.assertEqual(web.networks, ['10.100.0.0'])
+        self.assertEqual(groups[('v0', 'worker')].current_ncontainer, 49)
+        self.assertEqual(plan.deploy_args()[0][:2], ('pod0', 'app'))
+
+    def test_scale_out_ceiling(self):
+        plan = self.client.plan_scale_out('app', ncontainer=10, ncore=2, ceiling=55,
+                                          entrypoints=('web',))
+        self.assertEqual(sorted(g.entrypoint for g in plan.deploys), ['web'] * 3)
+        self.assertEqual(set((g.ncontainer, g.ncore) for g in plan.deploys), set([(5, 2)]))
+        with self.assertRaises(eruhttp.EruException):
+            self.client.plan_scale_out('app', ceiling=50, entrypoints=('web',))
+
+    def test_scale_in(self):
+        plan = self.client.scale_in('app', 1, dry_run=True)
+        expected = [self.server.container('app', i)['container_id'] for i in range(6)]
+        self.assertEqual(sorted(plan.to_remove), sorted(expected))
+
+        plan = self.client.plan_scale_in('app', 2, pod_names='pod1', floor=49)
+        # worker groups of 49 containers are at the floor, the one of 50 isn't
+        self.assertEqual(len(plan.to_remove), 0)
+        plan = self.client.plan_scale_in('app', 2, pod_names=['pod1'], floor=48)
+        self.assertEqual(len(plan.to_remove), 6)
+
+
+class FailingClient(eruhttp.EruClient):
+    """Fails deploys of the `worker` entrypoint, counts deploys in flight."""
+
+    def __init__(self, *args, **kwargs):
+        super(FailingClient, self).__init__(*args, **kwargs)
+        self.in_flight = self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def deploy_private(self, *args):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(0.05)
+            if args[5] == 'worker':
+                raise eruhttp.EruException(400, 'no resource')
+            return super(FailingClient, self).deploy_private(*args)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+class ExecuteScaleOutTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeEru(apps={'app': 60}).start()
+        self.client = FailingClient(self.server.url)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+
+    def test_report(self):
+        plan = self.client.plan_scale_out('app', ncontainer=1, pod_name='pod0')
+        report = self.client.scale_out('app', ncontainer=1, pod_name='pod0', concurrency=3)
+        self.assertEqual([r.group for r in report], plan.deploys)
+        for r in report:
+            if r.group.entrypoint == 'worker':
+                self.assertFalse(r.success)
+                self.assertEqual(r.error.code, 400)
+                self.assertEqual(r.task_ids, [])
+            else:
+                self.assertTrue(r.success)
+                self.assertIsNone(r.error)
+                self.assertEqual(len(r.task_ids), 1)
+            self.assertGreaterEqual(r.latency, 0.05)
+        self.assertEqual(self.client.max_in_flight, 3)
+
+    def test_serial(self):
+        self.client.scale_out('app', ncontainer=1, pod_name='pod0')
+        self.assertEqual(self.client.max_in_flight, 1)
+
+
+class ContainerIndexTest(unittest.TestCase):
+
+    def test_in_removal(self):
+        server = FakeEru()
+        containers = [server.container('app', i) for i in (0, 6, 99)]
+        server.stop()
+        index = eruhttp.ContainerIndex(containers)
+        self.assertEqual(len(index), 3)
+        self.assertEqual([key for key, _ in index.groups()], [('v0', 'web', 'prod')])
+        self.assertEqual(len(index.by_pod['pod1']), 1)
+        self.assertEqual(index.eldest(index.by_group[('v0', 'web', 'prod')], 1), [containers[0]])
+        self.assertEqual(index.by_created[0], containers[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+import json
+import unittest
+
+from eruhttp import iter_json_array
+
+ITEMS = [{'name': u'caf\xe9 中', 'ports': [80, 443]}, u'a, ] [ "b', 12.5, -3, 1e3, True, None, [], {}]
+
+
+def split(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+class IterJsonArrayTest(unittest.TestCase):
+
+    def test_chunk_sizes(self):
+        data = json.dumps(ITEMS, ensure_ascii=False).encode('utf-8')
+        # every split, multi-byte characters and numbers included
+        for size in range(1, len(data) + 1):
+            self.assertEqual(list(iter_json_array(split(data, size))), ITEMS, size)
+
+    def test_whitespace(self):
+        data = b' \n[ 1 ,\t2 ,\n{"a" : 3} ]\n'
+        self.assertEqual(list(iter_json_array(split(data, 3))), [1, 2, {'a': 3}])
+
+    def test_empty(self):
+        self.assertEqual(list(iter_json_array([b'[', b']'])), [])
+
+    def test_lazy(self):
+        items = iter_json_array(iter([b'[{"a": 1},', b'{"a": 2}']))
+        self.assertEqual(next(items), {'a': 1})
+        with self.assertRaises(ValueError):
+            list(items)
+
+    def test_not_array(self):
+        with self.assertRaises(ValueError):
+            list(iter_json_array([b'{"a": 1}']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+import eruhttp
+from tests.servers import BROKEN_CHUNKED, CannedServer, http_response, refused_url
+
+
+class SendTest(unittest.TestCase):
+
+    def test_missing_scheme(self):
+        client = eruhttp.EruClient('eru.local')
+        with self.assertRaises(eruhttp.EruException) as cm:
+            client.get_app('app')
+        self.assertEqual(cm.exception.code, 0)
+        self.assertNotIn("'resp'", cm.exception.message)
+        self.assertIn('Invalid URL', cm.exception.message)
+
+    def test_connection_refused(self):
+        client = eruhttp.EruClient(refused_url())
+        with self.assertRaises(eruhttp.EruException) as cm:
+            client.get_app('app')
+        self.assertEqual(cm.exception.message, 'Connection refused')
+        self.assertFalse(client.router.nodes[0].healthy)
+
+    def test_broken_body(self):
+        server = CannedServer([BROKEN_CHUNKED])
+        try:
+            client = eruhttp.EruClient(server.url)
+            with self.assertRaises(eruhttp.EruException) as cm:
+                client.get_app('app')
+            self.assertEqual(cm.exception.code, 0)
+            self.assertNotIn("'resp'", cm.exception.message)
+            self.assertFalse(client.router.nodes[0].healthy)
+        finally:
+            server.close()
+
+    def test_retry_then_error(self):
+        # a retried request failing to connect must not report the previous response
+        server = CannedServer([http_response(503), None])
+        try:
+            client = eruhttp.EruClient(server.url, transport=eruhttp.TransportConfig(
+                retry=eruhttp.RetryPolicy(max_retries=1, backoff=0)))
+            with self.assertRaises(eruhttp.EruException) as cm:
+                client.get_app('app')
+            self.assertEqual(cm.exception.code, 0)
+            self.assertEqual(server.requests, 2)
+        finally:
+            server.close()
+
+    def test_retry_then_success(self):
+        server = CannedServer([http_response(503), http_response(200, b'{"name": "app"}')])
+        try:
+            client = eruhttp.EruClient(server.url, transport=eruhttp.TransportConfig(
+                retry=eruhttp.RetryPolicy(max_retries=1, backoff=0)))
+            self.assertEqual(client.get_app('app'), {'name': 'app'})
+        finally:
+            server.close()
+
+    def test_error_status(self):
+        server = CannedServer([http_response(404, b'{"error": "app not found"}')])
+        try:
+            client = eruhttp.EruClient(server.url)
+            with self.assertRaises(eruhttp.EruException) as cm:
+                client.get_app('app')
+            self.assertEqual((cm.exception.code, cm.exception.message), (404, 'app not found'))
+            self.assertTrue(client.router.nodes[0].healthy)
+        finally:
+            server.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+import struct
+import threading
+import time
+import unittest
+
+import eruhttp
+from benchmarks.fake_server import FakeEru
+from benchmarks.fake_server import websocket_frame
+from tests.servers import SilentServer, WebsocketServer, pong_while_silent
+
+
+class RequestWebsocketTest(unittest.TestCase):
+
+    def test_lines(self):
+        with FakeEru(log_lines=5) as server:
+            client = eruhttp.EruClient(server.url)
+            self.assertEqual(len(list(client.container_log('c1', stdout=1))), 5)
+
+    def test_handshake_timeout(self):
+        server = SilentServer()
+        try:
+            config = eruhttp.StreamConfig(recv_timeout=0.1, max_reconnects=2, backoff=0.01)
+            client = eruhttp.EruClient(server.url, stream_config=config)
+            for resume in (None, 'count'):
+                with self.assertRaises(eruhttp.EruException) as cm:
+                    list(client.request_websocket('/websockets/containerlog/c1/', resume=resume))
+                self.assertIn('broken', cm.exception.message)
+            # the first attempt and 2 reconnects when resuming
+            self.assertEqual(len(server.connections), 4)
+        finally:
+            server.close()
+
+    def test_quiet_stream(self):
+        # pongs keep a stream without data alive
+        server = WebsocketServer(pong_while_silent(1.5))
+        try:
+            config = eruhttp.StreamConfig(recv_timeout=0.2, heartbeat_timeout=0.5, max_reconnects=0)
+            client = eruhttp.EruClient(server.url, stream_config=config)
+            frames = list(client.request_websocket('/websockets/containerlog/c1/', as_json=False))
+            self.assertEqual(frames, ['done'])
+            self.assertEqual(server.connections, 1)
+        finally:
+            server.close()
+
+
+def busy_or_quiet(conn, path):
+    if 'quiet' in path:
+        # a ping, then a line once the busy stream is done
+        conn.sendall(websocket_frame(b'', opcode=0x9))
+        time.sleep(0.6)
+        conn.sendall(websocket_frame(b'late'))
+    elif 'broken' in path:
+        conn.sendall(websocket_frame(b'last'))
+        # gone without a close frame
+        return
+    else:
+        for i in range(5):
+            conn.sendall(websocket_frame('busy {0}'.format(i).encode('ascii')))
+            time.sleep(0.1)
+    conn.sendall(websocket_frame(struct.pack('!H', 1000), opcode=0x8))
+
+
+class MultiplexWebsocketsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = WebsocketServer(busy_or_quiet)
+        self.client = eruhttp.EruClient(self.server.url, timeout=3)
+
+    def tearDown(self):
+        self.server.close()
+
+    def test_ping_on_quiet_stream(self):
+        started = time.time()
+        arrived = []
+        for tag, stream, frame in self.client.multiplex_websockets(
+                [('quiet', 1, '/quiet/', {}), ('busy', 1, '/busy/', {})], as_json=False):
+            arrived.append((frame, time.time() - started))
+        frames = [frame for frame, _ in arrived]
+        self.assertEqual(frames, ['busy {0}'.format(i) for i in range(5)] + ['late'])
+        # nothing waited for the socket timeout
+        self.assertLess(arrived[-2][1], 1)
+
+    def test_broken_stream(self):
+        frames = []
+        with self.assertRaises(eruhttp.EruException) as cm:
+            for tag, stream, frame in self.client.multiplex_websockets(
+                    [('broken', 1, '/broken/', {}), ('busy', 1, '/busy/', {})], as_json=False):
+                frames.append(frame)
+        self.assertIn('/broken/', cm.exception.message)
+        self.assertIn('last', frames)
+
+
+def tasklog(conn, path):
+    if '/1/' in path:
+        # a ping, then silence for longer than the socket timeout
+        conn.sendall(websocket_frame(b'', opcode=0x9))
+        time.sleep(1.2)
+    else:
+        time.sleep(0.1)
+    conn.sendall(websocket_frame(struct.pack('!H', 1000), opcode=0x8))
+
+
+class WatchTasklogsTest(unittest.TestCase):
+
+    def test_ping(self):
+        server = WebsocketServer(tasklog)
+        try:
+            client = eruhttp.EruClient(server.url, timeout=0.5)
+            started = time.time()
+            closed = {}
+
+            def close(task_id):
+                closed[task_id] = time.time() - started
+            client._watch_tasklogs([1, 2], close, threading.Event())
+            self.assertLess(closed[2], 0.4)
+            # the timeout didn't pass for a close
+            self.assertGreater(closed[1], 1)
+        finally:
+            server.close()
+
+
+if __name__ == '__main__':
+    unittest.main()